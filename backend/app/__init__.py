@@ -11,13 +11,45 @@ logging.basicConfig(
 
 def create_app():
     app = Flask(__name__)
-    from app.routes import delete_bp, detect_bp, main_bp, upload_bp
+    from app.commands import (
+        migrate_document_metadata_command,
+        rebuild_metadata_index_command,
+        rebuild_search_index_command,
+        warm_tiktoken_cache_command,
+    )
+    from app.routes import delete_bp, detect_bp, jobs_bp, main_bp, metrics_bp, search_bp, upload_bp
 
     # Register blueprints or routes
     app.register_blueprint(main_bp)
     app.register_blueprint(upload_bp)
     app.register_blueprint(detect_bp)
     app.register_blueprint(delete_bp)
-    CORS(app, resources={r'/*': {'origins': '*'}})
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(search_bp)
+    app.cli.add_command(rebuild_metadata_index_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(migrate_document_metadata_command)
+    app.cli.add_command(warm_tiktoken_cache_command)
+    CORS(app, resources={r'/*': {'origins': '*'}}, expose_headers=['X-Next-Cursor'])
+    _resume_pending_jobs()
 
     return app
+
+
+def _resume_pending_jobs():
+    """Starts the job workers when jobs are waiting in the queue, left queued or with an expired lease by a previous
+    process, so they are drained now rather than once another job is submitted. Otherwise the workers, and the
+    document service behind them, are still built on first use."""
+    from app.config import Config
+    from app.jobs.job_queue import SQLiteJobQueue
+    from app.routes import document_service
+
+    queue = SQLiteJobQueue(Config()._job_queue_path)
+    try:
+        pending = queue.has_pending()
+    finally:
+        queue.close()
+    if pending:
+        logging.getLogger(__name__).info('Starting the job workers to drain pending jobs')
+        document_service.jobs.start()
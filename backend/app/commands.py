@@ -0,0 +1,53 @@
+import logging
+import os
+
+import click
+
+logger = logging.getLogger(__name__)
+
+
+@click.command('rebuild-metadata-index')
+@click.option('--prefix', default='documents', show_default=True, help='S3 key prefix to index.')
+def rebuild_metadata_index_command(prefix):
+    """Rebuilds the local metadata index from the documents in the configured storage backend."""
+    from app.config import Config
+    from app.factories.storage_factory import DocumentStorageFactory
+
+    indexed = DocumentStorageFactory.create_storage(Config()._storage_backend).rebuild_metadata_index(prefix=prefix)
+    click.echo(f'Indexed {indexed} documents under prefix "{prefix}".')
+
+
+@click.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Extracts the text of every stored document into the full-text search index at SEARCH_INDEX_PATH."""
+    from app.services.document_service import DocumentService
+
+    indexed = DocumentService().rebuild_search_index()
+    click.echo(f'Indexed the text of {indexed} documents.')
+
+
+@click.command('migrate-document-metadata')
+@click.option('--prefix', default='documents', show_default=True, help='S3 key prefix to migrate.')
+@click.option('--dry-run', is_flag=True, help='Only count the documents that would be migrated.')
+def migrate_document_metadata_command(prefix, dry_run):
+    """Moves categories stored in the metadata of documents into their mutable metadata objects."""
+    from app.storage.s3_file_storage import S3FileStorage
+
+    counts = S3FileStorage().migrate_mutable_metadata(prefix=prefix, dry_run=dry_run)
+    action = 'Would migrate' if dry_run else 'Migrated'
+    click.echo(f'{action} {counts["migrated"]} of {counts["scanned"]} documents under prefix "{prefix}".')
+
+
+@click.command('warm-tiktoken-cache')
+@click.option('--model', 'models', multiple=True, default=['gpt-4o-mini'], show_default=True)
+@click.option('--cache-dir', default=None, help='Defaults to the tiktoken_cache directory bundled with deployments.')
+def warm_tiktoken_cache_command(models, cache_dir):
+    """Downloads the tokenizer files of the given models so deployments can load them without network access."""
+    from app.detection.shared_resources import BUNDLED_TIKTOKEN_CACHE_DIR, get_encoder
+
+    cache_dir = cache_dir or BUNDLED_TIKTOKEN_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ['TIKTOKEN_CACHE_DIR'] = cache_dir
+    for model in models:
+        get_encoder(model)
+    click.echo(f'Cached tokenizers of {", ".join(models)} in {cache_dir}.')
@@ -1,4 +1,9 @@
 import os
+import tempfile
+
+
+def _optional_int(value):
+    return int(value) if value else None
 
 
 class Config:
@@ -7,6 +12,52 @@ class Config:
         self._aws_access_key = os.environ.get('MY_AWS_ACCESS_KEY_ID')
         self._aws_region = os.environ.get('MY_AWS_DEFAULT_REGION', 'eu-north-1')
         self._s3_bucket = os.environ.get('MY_AWS_STORAGE_BUCKET_NAME')
+        self._storage_backend = os.environ.get('STORAGE_BACKEND', 's3')
+        self._local_storage_path = os.environ.get(
+            'LOCAL_STORAGE_PATH', os.path.join(tempfile.gettempdir(), 'document_storage')
+        )
+        self._s3_endpoint_url = os.environ.get('S3_ENDPOINT_URL') or None
+        self._s3_max_concurrency = int(os.environ.get('S3_MAX_CONCURRENCY', '16'))
+        self._s3_multipart_threshold_mb = int(os.environ.get('S3_MULTIPART_THRESHOLD_MB', '8'))
+        self._s3_multipart_chunksize_mb = int(os.environ.get('S3_MULTIPART_CHUNKSIZE_MB', '8'))
+        self._s3_upload_max_concurrency = int(os.environ.get('S3_UPLOAD_MAX_CONCURRENCY', '10'))
+        self._max_upload_size_mb = int(os.environ.get('MAX_UPLOAD_SIZE_MB', '2'))
+        self._max_archive_size_mb = int(os.environ.get('MAX_ARCHIVE_SIZE_MB', '200'))
+        self._presigned_upload_max_size_mb = int(os.environ.get('PRESIGNED_UPLOAD_MAX_SIZE_MB', '100'))
+        self._presigned_upload_expires_seconds = int(os.environ.get('PRESIGNED_UPLOAD_EXPIRES_SECONDS', '900'))
+        self._upload_deduplication = os.environ.get('UPLOAD_DEDUPLICATION', 'false').lower() in ('true', '1')
+        self._metadata_index_path = os.environ.get(
+            'METADATA_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'document_metadata_index.sqlite3')
+        )
+        self._metadata_index_max_age_seconds = float(os.environ.get('METADATA_INDEX_MAX_AGE_SECONDS', '300'))
+        self._search_index_path = os.environ.get(
+            'SEARCH_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'document_search_index.sqlite3')
+        )
+        self._search_index_on_upload = os.environ.get('SEARCH_INDEX_ON_UPLOAD', 'true').lower() in ('true', '1')
+
+        self._classification_cache_backend = os.environ.get('CLASSIFICATION_CACHE_BACKEND', 'memory')
+        self._classification_cache_path = os.environ.get(
+            'CLASSIFICATION_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'classification_cache.sqlite3')
+        )
+        self._classification_cache_max_entries = int(os.environ.get('CLASSIFICATION_CACHE_MAX_ENTRIES', '10000'))
+        self._classification_cache_ttl_seconds = float(
+            os.environ.get('CLASSIFICATION_CACHE_TTL_SECONDS', str(7 * 24 * 60 * 60))
+        )
+        self._detect_batch_concurrency = int(os.environ.get('DETECT_BATCH_CONCURRENCY', '8'))
+        self._job_queue_path = os.environ.get(
+            'JOB_QUEUE_PATH', os.path.join(tempfile.gettempdir(), 'document_jobs.sqlite3')
+        )
+        self._job_workers = int(os.environ.get('JOB_WORKERS', '4'))
+        self._job_lease_seconds = float(os.environ.get('JOB_LEASE_SECONDS', '60'))
+        self._job_retention_seconds = float(os.environ.get('JOB_RETENTION_SECONDS', str(24 * 60 * 60)))
+        self._openai_requests_per_minute = int(os.environ.get('OPENAI_REQUESTS_PER_MINUTE', '500'))
+        self._openai_tokens_per_minute = int(os.environ.get('OPENAI_TOKENS_PER_MINUTE', '200000'))
+        self._openai_max_retries = int(os.environ.get('OPENAI_MAX_RETRIES', '4'))
+        self._prompt_truncation_strategy = os.environ.get('PROMPT_TRUNCATION_STRATEGY', 'head')
+        self._pdf_extraction_workers = int(os.environ.get('PDF_EXTRACTION_WORKERS', '0'))
+        self._pdf_first_pages = _optional_int(os.environ.get('PDF_FIRST_PAGES'))
+        self._pdf_last_pages = _optional_int(os.environ.get('PDF_LAST_PAGES'))
+        self._pdf_page_timeout_seconds = float(os.environ.get('PDF_PAGE_TIMEOUT_SECONDS', '10'))
 
     def __repr__(self):
         return (
@@ -0,0 +1,220 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def build_cache_key(
+    content_hash: str, model: str, prompt_version: str, variant: str, max_tokens: int, truncation: str
+) -> str:
+    """A classification is only reusable for the same bytes, model and prompt, and for the same prompt variant
+    (single or packed) fed the same amount of text truncated the same way."""
+    return f'{content_hash}:{model}:{prompt_version}:{variant}:{max_tokens}:{truncation}'
+
+
+def hash_content(content) -> str:
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+class ClassificationCache(ABC):
+    """Base class for category caches with LRU and TTL eviction; counts hits and misses for every backend."""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: Optional[float] = None) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        category = self._get(key)
+        with self._stats_lock:
+            if category is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return category
+
+    def set(self, key: str, category: str) -> None:
+        evicted = self._set(key, category)
+        if evicted:
+            with self._stats_lock:
+                self._evictions += evicted
+
+    def _is_expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            lookups = self._hits + self._misses
+            return {
+                'backend': self.backend_name,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'size': len(self),
+            }
+
+    @property
+    @abstractmethod
+    def backend_name(self) -> str:
+        pass
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def _set(self, key: str, category: str) -> int:
+        """Stores the category and returns the number of entries evicted to make room for it."""
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+
+class InMemoryClassificationCache(ClassificationCache):
+    backend_name = 'memory'
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: Optional[float] = None) -> None:
+        super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            category, stored_at = entry
+            if self._is_expired(stored_at):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return category
+
+    def _set(self, key: str, category: str) -> int:
+        with self._lock:
+            self._entries[key] = (category, time.time())
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteClassificationCache(ClassificationCache):
+    """On-disk cache that survives restarts and can be shared by every worker process on a host."""
+
+    backend_name = 'sqlite'
+
+    def __init__(self, db_path: str, max_entries: int = 100000, ttl_seconds: Optional[float] = None) -> None:
+        super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS classifications (
+                    key TEXT PRIMARY KEY,
+                    category TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS classifications_last_access ON classifications (last_access)'
+            )
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT category, stored_at FROM classifications WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            category, stored_at = row
+            if self._is_expired(stored_at):
+                self._connection.execute('DELETE FROM classifications WHERE key = ?', (key,))
+                return None
+            self._connection.execute('UPDATE classifications SET last_access = ? WHERE key = ?', (time.time(), key))
+            return category
+
+    def _set(self, key: str, category: str) -> int:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO classifications (key, category, stored_at, last_access) VALUES (?, ?, ?, ?)',
+                (key, category, now, now),
+            )
+            cursor = self._connection.execute(
+                """
+                DELETE FROM classifications WHERE key IN (
+                    SELECT key FROM classifications ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            return cursor.rowcount
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM classifications WHERE key = ?', (key,))
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM classifications')
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM classifications').fetchone()[0]
+
+
+def create_classification_cache(config) -> Optional[ClassificationCache]:
+    """Builds the cache backend selected by ``CLASSIFICATION_CACHE_BACKEND`` (memory, sqlite or none)."""
+    backend = config._classification_cache_backend
+    ttl_seconds = config._classification_cache_ttl_seconds
+    max_entries = config._classification_cache_max_entries
+    if backend == 'none':
+        return None
+    if backend == 'memory':
+        return InMemoryClassificationCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    if backend == 'sqlite':
+        return SQLiteClassificationCache(
+            config._classification_cache_path, max_entries=max_entries, ttl_seconds=ttl_seconds
+        )
+    raise ValueError(f'Unsupported classification cache backend: {backend}')
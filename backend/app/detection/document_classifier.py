@@ -1,12 +1,16 @@
 import logging
 import os
-from typing import Dict, List, Optional
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
 
-import tiktoken
-from openai import OpenAI, RateLimitError
+from openai import RateLimitError
 
-from app.detection.openai_chat_service import OpenAIChatService
-from app.detection.openai_config import OpenAIConfig
+from app.detection.classification_cache import ClassificationCache, build_cache_key
+from app.detection.prompt_template import PromptTemplate, get_prompt_template
+from app.detection.rate_limit_scheduler import RateLimitScheduler
+from app.detection.shared_resources import get_chat_service, get_encoder, get_openai_client
+from app.detection.token_truncation import truncate_to_tokens
 from app.factories.processor_factory import DocumentProcessorFactory
 
 logger = logging.getLogger(__name__)
@@ -19,104 +23,310 @@ class DocumentClassifier:
     }
     # Reserve some tokens for the API's response and overhead.
     DEFAULT_RESERVED_RESPONSE_TOKENS = 70
+    # Bump whenever either prompt changes so cached classifications from the previous prompt are not reused.
+    PROMPT_VERSION = '1'
+    # Packing: at most this many documents per request, each truncated to at most this many tokens.
+    MAX_DOCUMENTS_PER_PACK = 10
+    PACKED_DOCUMENT_MAX_TOKENS = 600
+    # Completion tokens reserved per document for its "<number>: <category>" answer line.
+    PACKED_RESPONSE_TOKENS_PER_DOCUMENT = 10
+    # Separator and "Document N:" header around every packed document.
+    PACKED_DOCUMENT_HEADER_SAMPLE = 'Document 10:\n\n\n'
+    PACKED_ANSWER_PATTERN = re.compile(r'^\s*\[?(\d+)\]?\s*[:.)\-]\s*(.+?)\s*$')
 
-    def __init__(self, api_key: Optional[str] = None, model: str = 'gpt-4o-mini') -> None:
+    SYSTEM_MESSAGE = 'You are a helpful assistant.'
+    USER_MESSAGE_PREFIX = (
+        'Categorize the following document into one of these categories: '
+        'invoice, contract, report, etc. (in English). '
+        'Reply with the category name only.\n\n'
+        'Document:\n'
+    )
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = 'gpt-4o-mini',
+        cache: Optional[ClassificationCache] = None,
+        scheduler: Optional[RateLimitScheduler] = None,
+        truncation_strategy: str = 'head',
+    ) -> None:
         self.api_key = api_key or os.getenv('OPENAI_API_KEY')
         if not self.api_key:
             raise ValueError(
                 'OpenAI API key must be provided either as an argument or via the OPENAI_API_KEY environment variable.'
             )
 
-        self._client = OpenAI(api_key=self.api_key)
         self.model = model
+        self.cache = cache
+        self.scheduler = scheduler or RateLimitScheduler()
+        self.truncation_strategy = truncation_strategy
+        self.max_tokens_for_model = self.MODEL_MAX_TOKENS.get(self.model, 4096)
 
-        # Set up the tokenizer for the specified model.
-        try:
-            self.token_encoder = tiktoken.encoding_for_model(self.model)
-        except Exception as e:
-            logger.error('Failed to load tokenizer for model %s: %s', self.model, e)
-            raise
+    # The tokenizer, the OpenAI client and the prompt token counts are shared by every classifier in the process and
+    # only loaded on first use, so constructing a classifier costs neither time nor network.
+    @property
+    def token_encoder(self):
+        return get_encoder(self.model)
 
-        self.max_tokens_for_model = self.MODEL_MAX_TOKENS.get(self.model, 4096)
+    @property
+    def _client(self):
+        return get_openai_client(self.api_key)
 
-    def _truncate_text_to_tokens(self, text: str, max_tokens: int) -> str:
+    @property
+    def prompt_template(self) -> PromptTemplate:
+        return get_prompt_template(
+            self.model,
+            self.SYSTEM_MESSAGE,
+            self.USER_MESSAGE_PREFIX,
+            self._build_packed_prompt_messages([''])[1]['content'],
+            self.PACKED_DOCUMENT_HEADER_SAMPLE,
+        )
+
+    def _truncate_text_to_tokens(self, text: str, max_tokens: int, strategy: Optional[str] = None) -> str:
         """Truncate the text so that it does not exceed max_tokens."""
-        tokens = self.token_encoder.encode(text)
-        truncated_tokens = tokens[:max_tokens]
-        return self.token_encoder.decode(truncated_tokens)
+        return self._truncate_and_count_tokens(text, max_tokens, strategy)[0]
 
-    def _build_prompt_messages(self, file_content: str) -> List[Dict[str, str]]:
-        system_message = 'You are a helpful assistant.'
-        user_message_prefix = (
-            'Categorize the following document into one of these categories: '
-            'invoice, contract, report, etc. (in English). '
-            'Reply with the category name only.\n\n'
-            'Document:\n'
-        )
+    def _truncate_and_count_tokens(self, text: str, max_tokens: int, strategy: Optional[str] = None) -> Tuple[str, int]:
+        return truncate_to_tokens(self.token_encoder, text, max_tokens, strategy or self.truncation_strategy)
 
-        # Calculate token counts for the fixed parts of the prompt.
-        system_tokens = len(self.token_encoder.encode(system_message))
-        prefix_tokens = len(self.token_encoder.encode(user_message_prefix))
+    @property
+    def document_token_budget(self) -> int:
+        """Tokens left for the document text once the fixed prompt parts and the response are accounted for."""
+        template = self.prompt_template
+        return self.max_tokens_for_model - (
+            template.system_tokens + template.user_message_prefix_tokens + self.DEFAULT_RESERVED_RESPONSE_TOKENS
+        )
 
+    def _build_prompt_messages(self, file_content: str) -> Tuple[List[Dict[str, str]], int]:
+        """Returns the prompt messages and their token count."""
         # Determine the available tokens for the document text.
-        available_document_tokens = self.max_tokens_for_model - (
-            system_tokens + prefix_tokens + self.DEFAULT_RESERVED_RESPONSE_TOKENS
-        )
+        available_document_tokens = self.document_token_budget
         if available_document_tokens <= 0:
             raise ValueError("The fixed prompt components exceed the model's maximum token limit.")
+        fixed_tokens = self.max_tokens_for_model - self.DEFAULT_RESERVED_RESPONSE_TOKENS - available_document_tokens
 
         # Truncate the document content to fit within the available tokens.
-        truncated_content = self._truncate_text_to_tokens(file_content, available_document_tokens)
-        user_message = f'{user_message_prefix}{truncated_content}\n\nCategory:'
+        truncated_content, content_tokens = self._truncate_and_count_tokens(file_content, available_document_tokens)
+        user_message = f'{self.USER_MESSAGE_PREFIX}{truncated_content}\n\nCategory:'
 
         return [
-            {'role': 'system', 'content': system_message},
+            {'role': 'system', 'content': self.SYSTEM_MESSAGE},
             {'role': 'user', 'content': user_message},
-        ]
+        ], fixed_tokens + content_tokens
 
-    def detect_category(self, file_name: str, content: str) -> str:
+    def extract_text(self, file_name: str, content, max_tokens: Optional[int] = None) -> str:
+        """Extracts the document text. With ``max_tokens`` parsing stops as soon as enough text was collected to
+        fill that many tokens, so only the beginning of a large document is ever parsed."""
         # Determine the appropriate processor based on file extension.
         file_extension = file_name.split('.')[-1].lower()
         processor = DocumentProcessorFactory.get_processor(file_extension)
-        file_content = processor.extract_text(content)
+        if max_tokens is None:
+            return processor.extract_text(content)
 
-        # Build prompt messages with dynamically calculated token limits.
-        messages = self._build_prompt_messages(file_content)
-        prompt = messages[1].get('content')
+        chunks, collected_tokens = [], 0
+        for chunk in processor.iter_text(content):
+            chunks.append(chunk)
+            collected_tokens += len(self.token_encoder.encode(chunk))
+            if collected_tokens >= max_tokens:
+                break
+        return ''.join(chunks)
+
+    def extract_prompt_text(self, file_name: str, content) -> str:
+        """Extracts just the text that fits the single-document prompt, truncated to the token budget."""
+        budget = self.document_token_budget
+        # Keeping the end of a document means parsing all of it; keeping the beginning only needs the budget.
+        extract_tokens = budget if self.truncation_strategy == 'head' else None
+        return self.truncate_prompt_text(self.extract_text(file_name, content, max_tokens=extract_tokens))
+
+    def truncate_prompt_text(self, text: str) -> str:
+        """Cuts already extracted text down to what fits the single-document prompt."""
+        return self._truncate_text_to_tokens(text, self.document_token_budget)
+
+    def _cache_key(self, content_hash: str, packed: bool = False) -> str:
+        if packed:
+            return build_cache_key(
+                content_hash, self.model, self.PROMPT_VERSION, 'packed', self.PACKED_DOCUMENT_MAX_TOKENS, 'head'
+            )
+        return build_cache_key(
+            content_hash,
+            self.model,
+            self.PROMPT_VERSION,
+            'single',
+            self.document_token_budget,
+            self.truncation_strategy,
+        )
+
+    def get_cached_category(self, content_hash: str, packed: bool = False) -> Optional[str]:
+        """The category cached for the document with hash ``content_hash``, if any."""
+        if self.cache is None:
+            return None
+        return self.cache.get(self._cache_key(content_hash, packed))
+
+    def _cache_category(self, content_hash: str, category: Optional[str], packed: bool = False) -> None:
+        if category and self.cache is not None:
+            self.cache.set(self._cache_key(content_hash, packed), category)
+
+    def _request_completion(self, messages: List[Dict[str, str]], max_tokens: int, prompt_tokens: int) -> str:
+        """Sends the messages to OpenAI through the rate limit scheduler, falling back to the chat service when the
+        scheduler's retries are exhausted."""
         try:
             logger.info('Uploading document to OpenAI API.')
             logger.info('Detecting document category using OpenAI API.')
-            completion = self._client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=10,
-                temperature=0.5,
+            # OpenAI counts max_tokens against the tokens-per-minute limit up front.
+            completion = self.scheduler.run(
+                lambda: self._client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.5,
+                ),
+                tokens=prompt_tokens + max_tokens,
             )
 
             # Extract and clean the result.
-            category = completion.choices[0].message.content.strip()
-            if not category:
+            answer = completion.choices[0].message.content.strip()
+            if not answer:
                 raise Exception('OpenAI API returned an empty category.')
+            return answer
 
         except RateLimitError:
             logger.error('Failed to detect document category using openai module : LIMIT REACHED')
-            category = self.detect_via_chat_service(prompt=prompt)
+            return self.detect_via_chat_service(prompt=messages[1].get('content'), max_completion_tokens=max_tokens)
 
         except Exception as e:
             logger.error('Failed to detect document category: %s', e)
+            raise
+
+    def detect_category_from_text(self, file_name: str, file_content: str, content_hash: str) -> str:
+        """Detects the category of already extracted text; ``content_hash`` is the hash of the original bytes."""
+        cached_category = self.get_cached_category(content_hash)
+        if cached_category:
+            logger.info('Document: {%s} category served from cache: %s', file_name, cached_category)
+            return cached_category
+        return self._classify_text(file_name, file_content, content_hash)
+
+    def _classify_text(self, file_name: str, file_content: str, content_hash: str) -> str:
+        # Build prompt messages with dynamically calculated token limits.
+        messages, prompt_tokens = self._build_prompt_messages(file_content)
+        category = self._request_completion(messages, max_tokens=10, prompt_tokens=prompt_tokens)
         logger.info('Document: {%s} category detected: %s', file_name, category)
+        self._cache_category(content_hash, category)
         return category
 
-    # This function perfom a simmilar request in openai playground
-    def detect_via_chat_service(self, prompt: str):
-        logger.error('Trying to retreive category using openai playground')
-        config = OpenAIConfig(
-            api_key='PLAYGROUND API REQUEST',
-            organization='PLAYGROUND API REQUEST',
-            project='PLAYGROUND API REQUEST',
+    def _build_packed_prompt_messages(self, file_contents: Sequence[str]) -> List[Dict[str, str]]:
+        user_message_prefix = (
+            f'Categorize each of the following {len(file_contents)} numbered documents into one of these categories: '
+            'invoice, contract, report, etc. (in English). '
+            'Reply with exactly one line per document, in order, formatted as "<number>: <category name>" '
+            'and nothing else.\n\n'
+        )
+        documents = ''.join(
+            f'Document {position}:\n{file_content}\n\n' for position, file_content in enumerate(file_contents, 1)
         )
+        return [
+            {'role': 'system', 'content': self.SYSTEM_MESSAGE},
+            {'role': 'user', 'content': f'{user_message_prefix}{documents}Categories:'},
+        ]
+
+    def _pack_documents(self, file_contents: Sequence[str]) -> List[Tuple[List[Tuple[int, str]], int]]:
+        """Truncates every document to the packed per-document budget and groups them greedily into packs that fit
+        the model's context window together with their prompt and answer lines. Returns each pack with its prompt
+        token count."""
+        overhead_tokens = self.prompt_template.packed_overhead_tokens
+        per_document_overhead = self.prompt_template.packed_document_overhead_tokens
+
+        packs, current_pack, current_tokens = [], [], overhead_tokens
+        for position, file_content in enumerate(file_contents):
+            truncated, truncated_tokens = self._truncate_and_count_tokens(
+                file_content, self.PACKED_DOCUMENT_MAX_TOKENS, strategy='head'
+            )
+            document_tokens = truncated_tokens + per_document_overhead
+            reserved_response_tokens = self.PACKED_RESPONSE_TOKENS_PER_DOCUMENT * (len(current_pack) + 1)
+            if current_pack and (
+                len(current_pack) >= self.MAX_DOCUMENTS_PER_PACK
+                or current_tokens + document_tokens + reserved_response_tokens > self.max_tokens_for_model
+            ):
+                packs.append((current_pack, current_tokens))
+                current_pack, current_tokens = [], overhead_tokens
+            current_pack.append((position, truncated))
+            current_tokens += document_tokens
+        if current_pack:
+            packs.append((current_pack, current_tokens))
+        return packs
+
+    def _parse_packed_response(self, answer: str, document_count: int) -> List[Optional[str]]:
+        categories = [None] * document_count
+        for line in answer.splitlines():
+            match = self.PACKED_ANSWER_PATTERN.match(line)
+            if not match:
+                continue
+            position = int(match.group(1))
+            if 1 <= position <= document_count and categories[position - 1] is None:
+                categories[position - 1] = match.group(2)
+        return categories
+
+    def _classify_pack(self, pack_and_tokens: Tuple[List[Tuple[int, str]], int]) -> List[Optional[str]]:
+        pack, prompt_tokens = pack_and_tokens
+        messages = self._build_packed_prompt_messages([file_content for _, file_content in pack])
+        try:
+            answer = self._request_completion(
+                messages,
+                max_tokens=self.PACKED_RESPONSE_TOKENS_PER_DOCUMENT * len(pack) + 10,
+                prompt_tokens=prompt_tokens,
+            )
+        except Exception as e:
+            logger.error('Failed to detect categories of a pack of %s documents: %s', len(pack), e)
+            return [None] * len(pack)
+        return self._parse_packed_response(answer or '', len(pack))
 
-        chat_service = OpenAIChatService(config)
+    def detect_categories_from_texts(
+        self, documents: Sequence[Tuple[str, str]], max_workers: int = 4
+    ) -> List[Optional[str]]:
+        """Detects the categories of many already extracted ``(file_content, content_hash)`` texts, such as extracted
+        text sidecars, packing several truncated texts into each completion request; ``content_hash`` is the hash of
+        the original bytes. Documents missing from a packed answer are classified on their own; those that still
+        fail map to ``None``."""
+        content_hashes = [content_hash for _, content_hash in documents]
+        categories = [self.get_cached_category(content_hash, packed=True) for content_hash in content_hashes]
+        pending = [
+            (position, self._truncate_text_to_tokens(file_content, self.PACKED_DOCUMENT_MAX_TOKENS, strategy='head'))
+            for position, (file_content, _) in enumerate(documents)
+            if not categories[position]
+        ]
+        self._classify_packed(pending, content_hashes, categories, max_workers)
+        return categories
+
+    def _classify_packed(
+        self,
+        pending: List[Tuple[int, str]],
+        content_hashes: Sequence[str],
+        categories: List[Optional[str]],
+        max_workers: int,
+    ) -> None:
+        """Classifies the ``(position, text)`` documents in packed requests, filling in ``categories``."""
+        packs = self._pack_documents([file_content for _, file_content in pending])
+        logger.info('Detecting categories of %s documents in %s packed requests', len(pending), len(packs))
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(packs)))) as executor:
+            pack_categories = list(executor.map(self._classify_pack, packs))
+
+        for (pack, _), answers in zip(packs, pack_categories):
+            for (pending_position, _), category in zip(pack, answers):
+                position, file_content = pending[pending_position]
+                if not category:
+                    # The packed answer skipped this document; retry it with the single-document prompt.
+                    try:
+                        messages, prompt_tokens = self._build_prompt_messages(file_content)
+                        category = self._request_completion(messages, max_tokens=10, prompt_tokens=prompt_tokens)
+                    except Exception:
+                        category = None
+                categories[position] = category
+                # Packed results come from a shorter head of the text, so they are cached apart from single ones.
+                self._cache_category(content_hashes[position], category, packed=True)
+
+    # This function perfom a simmilar request in openai playground
+    def detect_via_chat_service(self, prompt: str, max_completion_tokens: int = 10):
+        logger.error('Trying to retreive category using openai playground')
+        chat_service = get_chat_service()
         payload = {
             'messages': [
                 {
@@ -130,7 +340,7 @@ class DocumentClassifier:
                 },
             ],
             'temperature': 0.5,
-            'max_completion_tokens': 10,
+            'max_completion_tokens': max_completion_tokens,
             'top_p': 1,
             'frequency_penalty': 0,
             'presence_penalty': 0,
@@ -0,0 +1,38 @@
+import threading
+from typing import Dict, Tuple
+
+from app.detection.shared_resources import get_encoder
+
+
+class PromptTemplate:
+    """Fixed parts of the classification prompts and their token counts, computed once per model and process so
+    building a prompt only has to tokenize the document itself."""
+
+    def __init__(
+        self, model: str, system_message: str, user_message_prefix: str, packed_prompt: str, packed_document_header: str
+    ) -> None:
+        encoder = get_encoder(model)
+        self.model = model
+        self.system_message = system_message
+        self.user_message_prefix = user_message_prefix
+        self.system_tokens = len(encoder.encode(system_message))
+        self.user_message_prefix_tokens = len(encoder.encode(user_message_prefix))
+        # The packed prompt without documents, and the header added around each packed document.
+        self.packed_overhead_tokens = self.system_tokens + len(encoder.encode(packed_prompt))
+        self.packed_document_overhead_tokens = len(encoder.encode(packed_document_header))
+
+
+_templates: Dict[Tuple[str, ...], PromptTemplate] = {}
+_templates_lock = threading.Lock()
+
+
+def get_prompt_template(
+    model: str, system_message: str, user_message_prefix: str, packed_prompt: str, packed_document_header: str
+) -> PromptTemplate:
+    key = (model, system_message, user_message_prefix, packed_prompt, packed_document_header)
+    template = _templates.get(key)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(key) or PromptTemplate(*key)
+            _templates[key] = template
+    return template
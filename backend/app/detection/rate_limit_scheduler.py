@@ -0,0 +1,164 @@
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+from app.utils.latency_stats import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Transient failures the OpenAI client would otherwise retry itself: rate limits, connection errors and timeouts
+# (``APITimeoutError`` is an ``APIConnectionError``) and 5xx responses.
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+class TokenBucket:
+    """Budget of ``capacity`` units refilled continuously over one minute."""
+
+    def __init__(self, capacity: float, clock: Callable[[], float]) -> None:
+        self.capacity = capacity
+        self._clock = clock
+        self._available = capacity
+        self._updated_at = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._available = min(self.capacity, self._available + (now - self._updated_at) * self.capacity / 60.0)
+        self._updated_at = now
+
+    def seconds_until_available(self, amount: float) -> float:
+        self._refill()
+        missing = min(amount, self.capacity) - self._available
+        return max(0.0, missing * 60.0 / self.capacity)
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self._available -= min(amount, self.capacity)
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._available
+
+
+class RateLimitScheduler:
+    """Client-side pacing for OpenAI calls.
+
+    Every call first waits until both the requests-per-minute and the tokens-per-minute budgets can cover it, so
+    concurrent workers queue up here instead of bursting into the API limit. Calls that are still rate limited, or
+    fail with a connection error, a timeout or a 5xx response, are retried with jittered exponential backoff, honoring
+    the ``Retry-After`` header when the API sends one.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = 500,
+        tokens_per_minute: int = 200000,
+        max_retries: int = 4,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(requests_per_minute, clock)
+        self._tokens = TokenBucket(tokens_per_minute, clock)
+        self._queue_depth = 0
+        self._max_queue_depth = 0
+        self._rate_limited = 0
+        self._transient_errors = 0
+        self._retries = 0
+        self._wait_stats = LatencyStats()
+
+    def acquire(self, tokens: int) -> float:
+        """Blocks until a call of ``tokens`` tokens fits both budgets, reserves it and returns the seconds waited."""
+        started = self._clock()
+        with self._lock:
+            self._queue_depth += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue_depth)
+        try:
+            while True:
+                with self._lock:
+                    wait = max(
+                        self._requests.seconds_until_available(1),
+                        self._tokens.seconds_until_available(tokens),
+                    )
+                    if wait <= 0:
+                        self._requests.consume(1)
+                        self._tokens.consume(tokens)
+                        break
+                self._sleep(wait)
+        finally:
+            with self._lock:
+                self._queue_depth -= 1
+
+        waited = self._clock() - started
+        self._wait_stats.record('wait', waited)
+        return waited
+
+    def run(self, call: Callable[[], T], tokens: int) -> T:
+        """Runs ``call`` within the budgets, retrying it while the API answers with a rate limit or transient error."""
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                return call()
+            except RETRYABLE_ERRORS as e:
+                with self._lock:
+                    if isinstance(e, RateLimitError):
+                        self._rate_limited += 1
+                    else:
+                        self._transient_errors += 1
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                attempt += 1
+                with self._lock:
+                    self._retries += 1
+                logger.warning(
+                    'OpenAI call failed (%s), retry %s/%s in %.2fs', type(e).__name__, attempt, self.max_retries, delay
+                )
+                self._sleep(delay)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        retry_after = self._parse_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # Full jitter: spreads retries of concurrent workers instead of having them collide again.
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    @staticmethod
+    def _parse_retry_after(error: Exception) -> Optional[float]:
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        try:
+            if headers.get('retry-after-ms') is not None:
+                return float(headers['retry-after-ms']) / 1000
+            if headers.get('retry-after') is not None:
+                return float(headers['retry-after'])
+        except (TypeError, ValueError):
+            return None
+        return None
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = {
+                'queue_depth': self._queue_depth,
+                'max_queue_depth': self._max_queue_depth,
+                'rate_limited': self._rate_limited,
+                'transient_errors': self._transient_errors,
+                'retries': self._retries,
+                'available_requests': round(self._requests.available, 2),
+                'available_tokens': round(self._tokens.available, 2),
+            }
+        metrics['wait'] = self._wait_stats.snapshot().get('wait')
+        return metrics
@@ -0,0 +1,71 @@
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+import tiktoken
+from openai import OpenAI
+
+from app.detection.openai_chat_service import OpenAIChatService
+from app.detection.openai_config import OpenAIConfig
+
+logger = logging.getLogger(__name__)
+
+# Deployment packages ship tiktoken's BPE files here (see the warm-tiktoken-cache command), so cold starts read them
+# from disk instead of downloading them.
+BUNDLED_TIKTOKEN_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'tiktoken_cache'))
+
+_lock = threading.Lock()
+_encoders: Dict[str, tiktoken.Encoding] = {}
+_openai_clients: Dict[str, OpenAI] = {}
+_chat_service: Optional[OpenAIChatService] = None
+
+
+def configure_tiktoken_cache(cache_dir: str = BUNDLED_TIKTOKEN_CACHE_DIR) -> None:
+    """Points tiktoken at ``cache_dir`` unless ``TIKTOKEN_CACHE_DIR`` is already set or no files were bundled."""
+    if os.environ.get('TIKTOKEN_CACHE_DIR') or not os.path.isdir(cache_dir):
+        return
+    if not any(not name.startswith('.') for name in os.listdir(cache_dir)):
+        return
+    os.environ['TIKTOKEN_CACHE_DIR'] = cache_dir
+    logger.info('Loading tiktoken encodings from %s', cache_dir)
+
+
+def get_encoder(model: str) -> tiktoken.Encoding:
+    """Returns the process-wide tokenizer of ``model``, loading it on first use."""
+    encoder = _encoders.get(model)
+    if encoder is not None:
+        return encoder
+    with _lock:
+        if model not in _encoders:
+            configure_tiktoken_cache()
+            try:
+                _encoders[model] = tiktoken.encoding_for_model(model)
+            except Exception as e:
+                logger.error('Failed to load tokenizer for model %s: %s', model, e)
+                raise
+        return _encoders[model]
+
+
+def get_openai_client(api_key: str) -> OpenAI:
+    """Returns the process-wide OpenAI client of ``api_key``; clients are thread-safe and pool their connections."""
+    with _lock:
+        if api_key not in _openai_clients:
+            # Retries of rate limits, connection errors, timeouts and 5xx responses are left to the scheduler, which
+            # paces them against the shared rate limit budgets.
+            _openai_clients[api_key] = OpenAI(api_key=api_key, max_retries=0)
+        return _openai_clients[api_key]
+
+
+def get_chat_service() -> OpenAIChatService:
+    """Returns the process-wide playground chat service used as a fallback when the API is rate limited."""
+    global _chat_service
+    with _lock:
+        if _chat_service is None:
+            config = OpenAIConfig(
+                api_key='PLAYGROUND API REQUEST',
+                organization='PLAYGROUND API REQUEST',
+                project='PLAYGROUND API REQUEST',
+            )
+            _chat_service = OpenAIChatService(config)
+        return _chat_service
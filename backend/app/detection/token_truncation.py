@@ -0,0 +1,69 @@
+from typing import Tuple
+
+# English prose averages about four characters per token; the estimate only sizes the first prefix to encode.
+CHARS_PER_TOKEN_ESTIMATE = 4.0
+# Tokens next to a cut can differ from the tokenization of the whole text, so that many are discarded there.
+BOUNDARY_TOKENS = 8
+HEAD_TAIL_SEPARATOR = '\n...\n'
+
+TRUNCATION_STRATEGIES = ('head', 'head_tail')
+
+
+def _encode_head(encoder, text: str, max_tokens: int) -> Tuple[list, bool]:
+    """Returns at least ``max_tokens`` leading tokens of ``text`` (all of them if there are fewer) and whether they
+    cover the whole text. Only a character prefix is encoded: it starts from the characters-per-token estimate and
+    grows with the ratio observed so far until it holds enough tokens."""
+    prefix_chars = int((max_tokens + BOUNDARY_TOKENS) * CHARS_PER_TOKEN_ESTIMATE * 1.1) + 1
+    while True:
+        if prefix_chars >= len(text):
+            return encoder.encode(text), True
+        tokens = encoder.encode(text[:prefix_chars])
+        if len(tokens) - BOUNDARY_TOKENS >= max_tokens:
+            return tokens[: len(tokens) - BOUNDARY_TOKENS], False
+        chars_per_token = prefix_chars / max(1, len(tokens))
+        wanted = int((max_tokens + 2 * BOUNDARY_TOKENS) * chars_per_token * 1.1) + 1
+        prefix_chars = max(wanted, int(prefix_chars * 1.25) + 1)
+
+
+def _encode_tail(encoder, text: str, max_tokens: int) -> list:
+    """Returns at least ``max_tokens`` trailing tokens of ``text``, encoding only a character suffix."""
+    suffix_chars = int((max_tokens + BOUNDARY_TOKENS) * CHARS_PER_TOKEN_ESTIMATE * 1.1) + 1
+    while True:
+        if suffix_chars >= len(text):
+            return encoder.encode(text)
+        tokens = encoder.encode(text[-suffix_chars:])
+        if len(tokens) - BOUNDARY_TOKENS >= max_tokens:
+            return tokens[BOUNDARY_TOKENS:]
+        chars_per_token = suffix_chars / max(1, len(tokens))
+        wanted = int((max_tokens + 2 * BOUNDARY_TOKENS) * chars_per_token * 1.1) + 1
+        suffix_chars = max(wanted, int(suffix_chars * 1.25) + 1)
+
+
+def truncate_to_tokens(encoder, text: str, max_tokens: int, strategy: str = 'head') -> Tuple[str, int]:
+    """Truncates ``text`` to at most ``max_tokens`` tokens and returns it with its token count.
+
+    Unlike encoding the whole text and slicing, the cost depends on ``max_tokens`` rather than on the length of the
+    text. ``head`` keeps the beginning of the text; ``head_tail`` keeps its first two thirds of the budget from the
+    beginning and the rest from the end, where totals and signatures usually are.
+    """
+    if strategy not in TRUNCATION_STRATEGIES:
+        raise ValueError(f'Unsupported truncation strategy: {strategy}')
+    if max_tokens <= 0:
+        return '', 0
+
+    head_tokens, complete = _encode_head(encoder, text, max_tokens)
+    if complete and len(head_tokens) <= max_tokens:
+        return text, len(head_tokens)
+    if strategy == 'head':
+        return encoder.decode(head_tokens[:max_tokens]), max_tokens
+
+    separator_tokens = len(encoder.encode(HEAD_TAIL_SEPARATOR))
+    tail_budget = (max_tokens - separator_tokens) // 3
+    head_budget = max_tokens - separator_tokens - tail_budget
+    if tail_budget <= 0:
+        return encoder.decode(head_tokens[:max_tokens]), max_tokens
+    tail_tokens = _encode_tail(encoder, text, tail_budget)
+    truncated = (
+        encoder.decode(head_tokens[:head_budget]) + HEAD_TAIL_SEPARATOR + encoder.decode(tail_tokens[-tail_budget:])
+    )
+    return truncated, head_budget + separator_tokens + tail_budget
@@ -1,21 +1,20 @@
+import importlib
 from typing import Optional
 
-from app.processors.docx_processor import DOCXFileProcessor
-from app.processors.pdf_processor import PDFFileProcessor
-from app.processors.text_processor import TextFileProcessor
-from app.processors.xlsx_processor import XLSXFileProcessor
+# Processor classes by extension, imported only when a document of that type is processed: each one pulls in its
+# parsing library (PyPDF2, python-docx, openpyxl).
+PROCESSORS = {
+    'txt': ('app.processors.text_processor', 'TextFileProcessor'),
+    'pdf': ('app.processors.pdf_processor', 'PDFFileProcessor'),
+    'docx': ('app.processors.docx_processor', 'DOCXFileProcessor'),
+    'xlsx': ('app.processors.xlsx_processor', 'XLSXFileProcessor'),
+}
 
 
 class DocumentProcessorFactory:
     @staticmethod
     def get_processor(file_extension: str) -> Optional[type]:
-        if file_extension == 'txt':
-            return TextFileProcessor()
-        elif file_extension == 'pdf':
-            return PDFFileProcessor()
-        elif file_extension == 'docx':
-            return DOCXFileProcessor()
-        elif file_extension == 'xlsx':
-            return XLSXFileProcessor()
-        else:
+        if file_extension not in PROCESSORS:
             raise ValueError(f'Unsupported file extension: {file_extension}')
+        module_name, class_name = PROCESSORS[file_extension]
+        return getattr(importlib.import_module(module_name), class_name)()
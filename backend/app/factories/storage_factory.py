@@ -0,0 +1,18 @@
+import importlib
+
+from app.storage.document_storage_interface import IDocumentStorage
+
+# Storage classes by backend name, imported only when selected: the S3 backend pulls in boto3.
+STORAGE_BACKENDS = {
+    's3': ('app.storage.s3_file_storage', 'S3FileStorage'),
+    'local': ('app.storage.local_file_storage', 'LocalFileStorage'),
+}
+
+
+class DocumentStorageFactory:
+    @staticmethod
+    def create_storage(backend: str) -> IDocumentStorage:
+        if backend not in STORAGE_BACKENDS:
+            raise ValueError(f'Unsupported storage backend: {backend}')
+        module_name, class_name = STORAGE_BACKENDS[backend]
+        return getattr(importlib.import_module(module_name), class_name)()
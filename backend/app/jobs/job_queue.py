@@ -0,0 +1,204 @@
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteJobQueue:
+    """File-backed FIFO job queue.
+
+    Jobs move from ``queued`` to ``running`` to ``succeeded`` or ``failed``. Claiming is a single atomic
+    ``UPDATE ... RETURNING`` statement, so several worker threads or processes can drain the same database file.
+
+    A claimed job is leased for ``lease_seconds``, and its worker renews the lease while it runs. Jobs whose lease
+    expired, because their process died, are claimed again, up to ``max_attempts`` times in all. Every claim gets a
+    new lease token, which renewing and finishing the job require, so a worker that lost its lease cannot overwrite
+    the outcome of the worker that claimed the job after it.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    def __init__(self, db_path: str, lease_seconds: float = 60.0, max_attempts: int = 3) -> None:
+        self.lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    lease_expires_at REAL,
+                    lease_token TEXT
+                )
+                """
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at)')
+
+    def enqueue(self, kind: str, payload: Dict[str, Any]) -> str:
+        job_id = str(uuid.uuid4())
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO jobs (id, kind, payload, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                (job_id, kind, json.dumps(payload), self.QUEUED, time.time()),
+            )
+        logger.info('Queued %s job %s', kind, job_id)
+        return job_id
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Marks the oldest queued job, or job whose lease expired, as running and returns it, or returns None when
+        there is none."""
+        now = time.time()
+        with self._lock, self._connection:
+            # Jobs that keep losing their worker (a handler crashing the process, say) are not retried forever.
+            self._connection.execute(
+                """
+                UPDATE jobs SET status = ?, error = ?, finished_at = ?
+                WHERE status = ? AND COALESCE(lease_expires_at, 0) < ? AND attempts >= ?
+                """,
+                (
+                    self.FAILED,
+                    f'Abandoned after {self._max_attempts} attempts',
+                    now,
+                    self.RUNNING,
+                    now,
+                    self._max_attempts,
+                ),
+            )
+            row = self._connection.execute(
+                """
+                UPDATE jobs
+                SET status = ?, started_at = ?, lease_expires_at = ?, lease_token = ?, attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE status = ? OR (status = ? AND COALESCE(lease_expires_at, 0) < ?)
+                    ORDER BY created_at LIMIT 1
+                )
+                AND (status = ? OR (status = ? AND COALESCE(lease_expires_at, 0) < ?))
+                RETURNING id, kind, payload, lease_token
+                """,
+                (
+                    self.RUNNING,
+                    now,
+                    now + self.lease_seconds,
+                    str(uuid.uuid4()),
+                    self.QUEUED,
+                    self.RUNNING,
+                    now,
+                    self.QUEUED,
+                    self.RUNNING,
+                    now,
+                ),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'payload': json.loads(row['payload']),
+            'lease_token': row['lease_token'],
+        }
+
+    def has_pending(self) -> bool:
+        """Whether a job waits for a worker: queued, or running under a lease that expired."""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT 1 FROM jobs WHERE status = ? OR (status = ? AND COALESCE(lease_expires_at, 0) < ?) LIMIT 1',
+                (self.QUEUED, self.RUNNING, time.time()),
+            ).fetchone()
+        return row is not None
+
+    def renew(self, leases: Iterable[Tuple[str, str]]) -> None:
+        """Extends the leases, given as ``(job_id, lease_token)`` pairs, of running jobs, so that no other worker
+        claims them while they are being worked on. Leases that were lost already are left alone."""
+        leases = list(leases)
+        if not leases:
+            return
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND lease_token = ? AND status = ?',
+                [(time.time() + self.lease_seconds, job_id, token, self.RUNNING) for job_id, token in leases],
+            )
+
+    def complete(self, job_id: str, lease_token: str, result: Any) -> bool:
+        return self._finish(job_id, lease_token, self.SUCCEEDED, result=json.dumps(result))
+
+    def fail(self, job_id: str, lease_token: str, error: str) -> bool:
+        return self._finish(job_id, lease_token, self.FAILED, error=error)
+
+    def _finish(
+        self, job_id: str, lease_token: str, status: str, result: Optional[str] = None, error: Optional[str] = None
+    ) -> bool:
+        """Records the outcome of a job. Returns False, recording nothing, when the lease was lost to another
+        claim."""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires_at = NULL '
+                'WHERE id = ? AND lease_token = ? AND status = ?',
+                (status, result, error, time.time(), job_id, lease_token, self.RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def prune(self, older_than_seconds: float) -> int:
+        """Deletes jobs that finished more than ``older_than_seconds`` ago, with their payloads and results."""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                'DELETE FROM jobs WHERE finished_at < ? AND status IN (?, ?)',
+                (time.time() - older_than_seconds, self.SUCCEEDED, self.FAILED),
+            )
+        return cursor.rowcount
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'result': json.loads(row['result']) if row['result'] is not None else None,
+            'error': row['error'],
+            'attempts': row['attempts'],
+            'created_at': self._isoformat(row['created_at']),
+            'started_at': self._isoformat(row['started_at']),
+            'finished_at': self._isoformat(row['finished_at']),
+        }
+
+    @staticmethod
+    def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+        if timestamp is None:
+            return None
+        return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).isoformat()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._connection.execute('SELECT status, COUNT(*) AS total FROM jobs GROUP BY status').fetchall()
+        counts = {self.QUEUED: 0, self.RUNNING: 0, self.SUCCEEDED: 0, self.FAILED: 0}
+        counts.update({row['status']: row['total'] for row in rows})
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
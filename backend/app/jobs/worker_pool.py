@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from app.jobs.job_queue import SQLiteJobQueue
+
+logger = logging.getLogger(__name__)
+
+PRUNE_INTERVAL_SECONDS = 60 * 60
+
+
+class JobWorkerPool:
+    """Background threads draining a job queue, dispatching each job to the handler registered for its kind.
+
+    Workers are started on the first submitted job, or by ``start`` when the app finds jobs already waiting, so
+    importing or constructing the pool costs nothing.
+    A handler returns the job result; raising marks the job as failed with the exception message.
+
+    Another thread renews the leases of the jobs being run, so pools of other processes sharing the queue do not
+    claim them, and deletes jobs finished more than ``retention_seconds`` ago.
+    """
+
+    def __init__(
+        self,
+        queue: SQLiteJobQueue,
+        handlers: Dict[str, Callable[[Dict[str, Any]], Any]],
+        workers: int = 4,
+        poll_interval: float = 1.0,
+        retention_seconds: float = 24 * 60 * 60,
+    ) -> None:
+        self.queue = queue
+        self._handlers = handlers
+        self._workers = max(1, workers)
+        self._poll_interval = poll_interval
+        self._retention_seconds = retention_seconds
+        self._threads: List[threading.Thread] = []
+        # Lease tokens of the jobs being run, by job id.
+        self._running_jobs: Dict[str, str] = {}
+        self._running_jobs_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        if kind not in self._handlers:
+            raise ValueError(f'No handler registered for job kind: {kind}')
+        job_id = self.queue.enqueue(kind, payload)
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for position in range(self._workers):
+                thread = threading.Thread(target=self._run, name=f'job-worker-{position}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._keep_leases, name='job-leases', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._start_lock:
+            self._stopping.set()
+            self._wakeup.set()
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self._wakeup.wait(self._poll_interval)
+                self._wakeup.clear()
+                continue
+            self._process(job)
+
+    def _keep_leases(self) -> None:
+        pruned_at = 0.0
+        while not self._stopping.wait(self.queue.lease_seconds / 3):
+            with self._running_jobs_lock:
+                leases = list(self._running_jobs.items())
+            try:
+                self.queue.renew(leases)
+                if time.monotonic() - pruned_at > PRUNE_INTERVAL_SECONDS:
+                    pruned_at = time.monotonic()
+                    pruned = self.queue.prune(self._retention_seconds)
+                    if pruned:
+                        logger.info('Deleted %s finished jobs', pruned)
+            except Exception as e:
+                logger.exception('Error maintaining the job queue: %s', e)
+
+    def _process(self, job: Dict[str, Any]) -> None:
+        logger.info('Running %s job %s', job['kind'], job['job_id'])
+        with self._running_jobs_lock:
+            self._running_jobs[job['job_id']] = job['lease_token']
+        try:
+            result = self._handlers[job['kind']](job['payload'])
+        except Exception as e:
+            logger.exception('Job %s failed: %s', job['job_id'], e)
+            recorded = self.queue.fail(job['job_id'], job['lease_token'], str(e))
+        else:
+            recorded = self.queue.complete(job['job_id'], job['lease_token'], result)
+        finally:
+            with self._running_jobs_lock:
+                self._running_jobs.pop(job['job_id'], None)
+        if not recorded:
+            logger.warning('Job %s lost its lease to another worker; its outcome was discarded', job['job_id'])
@@ -1,7 +1,22 @@
+import io
 from abc import ABC, abstractmethod
+from typing import BinaryIO, Iterator, Union
+
+
+def open_stream(file_content: Union[bytes, BinaryIO]) -> BinaryIO:
+    """Processors accept either the document bytes or a seekable binary file object, such as a lazily fetching S3
+    object reader; parsers work on the stream so they only read the parts of the file they need."""
+    if isinstance(file_content, (bytes, bytearray)):
+        return io.BytesIO(file_content)
+    return file_content
 
 
 class DocumentProcessor(ABC):
     @abstractmethod
-    def extract_text(self, file_content) -> str:
+    def iter_text(self, file_content) -> Iterator[str]:
+        """Yields the document text in reading order, one chunk (page, paragraph, row...) at a time, so callers
+        that only need the beginning of a document can stop parsing early."""
         pass
+
+    def extract_text(self, file_content) -> str:
+        return ''.join(self.iter_text(file_content))
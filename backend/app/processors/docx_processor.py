@@ -1,14 +1,12 @@
-import io
+from typing import Iterator
 
 from docx import Document
 
-from app.processors.document_processor import DocumentProcessor
+from app.processors.document_processor import DocumentProcessor, open_stream
 
 
 class DOCXFileProcessor(DocumentProcessor):
-    def extract_text(self, file_content) -> str:
-        doc = Document(io.BytesIO(file_content))
-        text = ''
+    def iter_text(self, file_content) -> Iterator[str]:
+        doc = Document(open_stream(file_content))
         for para in doc.paragraphs:
-            text += para.text + '\n'
-        return text
+            yield para.text + '\n'
@@ -0,0 +1,239 @@
+import contextlib
+import hashlib
+import io
+import logging
+import math
+import multiprocessing
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from PyPDF2 import PdfReader
+
+from app.config import Config
+from app.processors.document_processor import open_stream
+
+logger = logging.getLogger(__name__)
+
+
+def select_pages(page_count: int, first_pages: Optional[int] = None, last_pages: Optional[int] = None) -> List[int]:
+    """Zero-based page numbers to extract: all pages, or the first ``first_pages`` plus the last ``last_pages``, which
+    is where invoices and contracts carry their parties, totals and signatures."""
+    if first_pages is None and last_pages is None:
+        return list(range(page_count))
+    head = range(min(first_pages or 0, page_count))
+    tail = range(max(len(head), page_count - (last_pages or 0)), page_count)
+    return list(head) + list(tail)
+
+
+class PageTimeout(BaseException):
+    """Raised in a worker when a page exceeds its time limit. A BaseException, so PyPDF2 cannot swallow it."""
+
+
+@contextlib.contextmanager
+def time_limit(seconds: Optional[float]) -> Iterator[None]:
+    """Interrupts the block with PageTimeout after ``seconds``, counted from when it starts. Only enforced in the main
+    thread of a process on platforms with interval timers, which is where pool workers run their tasks."""
+    if not seconds or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def on_timeout(signum, frame):
+        raise PageTimeout()
+
+    previous_handler = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+# Worker processes keep the reader of the last document they worked on, so the ranges of one document parse it once.
+_worker_reader: Tuple[Optional[str], Optional[PdfReader]] = (None, None)
+
+
+def _get_reader(file_content: bytes, document_key: Optional[str]) -> PdfReader:
+    global _worker_reader
+    cached_key, cached_reader = _worker_reader
+    if document_key is not None and cached_key == document_key:
+        return cached_reader
+    pdf_reader = PdfReader(io.BytesIO(file_content))
+    _worker_reader = (document_key, pdf_reader)
+    return pdf_reader
+
+
+def _extract_pages(pdf_reader: PdfReader, page_numbers: Sequence[int], page_timeout: Optional[float]) -> List[str]:
+    texts = []
+    for page_number in page_numbers:
+        try:
+            with time_limit(page_timeout):
+                texts.append(pdf_reader.pages[page_number].extract_text())
+        except PageTimeout:
+            logger.error('PDF page %s timed out after %.1fs', page_number, page_timeout)
+            texts.append('')
+        except Exception as e:
+            logger.error('Failed to extract text from PDF page %s: %s', page_number, e)
+            texts.append('')
+    return texts
+
+
+def extract_page_range(
+    file_content: bytes,
+    page_numbers: Sequence[int],
+    page_timeout: Optional[float] = None,
+    document_key: Optional[str] = None,
+) -> List[str]:
+    """Runs in a worker process: opens one PDF and extracts the given pages of it, each step within ``page_timeout``
+    seconds."""
+    try:
+        # Opening reads the trailer and cross-reference table, which a malformed file can make hang as well.
+        with time_limit(page_timeout):
+            pdf_reader = _get_reader(file_content, document_key)
+    except PageTimeout:
+        logger.error('PDF did not open within %.1fs', page_timeout)
+        return [''] * len(page_numbers)
+    return _extract_pages(pdf_reader, page_numbers, page_timeout)
+
+
+def _pool_context():
+    # Forking a multithreaded server (job workers, S3 pools, SQLite connections) can copy locks held by other threads
+    # into the child; workers are started from a clean forkserver process instead, or spawned where there is none.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class PDFExtractionEngine:
+    """Extracts PDF text in a pool of worker processes, since PyPDF2 page extraction is CPU-bound and holds the GIL.
+
+    Pages are dispatched in ranges of ``pages_per_task``; a worker parses each document once for all of its ranges.
+    Workers give up on a page that takes more than ``page_timeout`` seconds from when they started it (the page
+    comes back empty), so a pathological PDF cannot keep a worker busy. Should a worker hang regardless, callers stop
+    waiting once every task could have run out its time limits, and the pool is replaced. With ``max_workers`` of 0
+    or 1, or where process pools are unavailable (AWS Lambda has no /dev/shm), pages are extracted lazily in the
+    calling thread instead, without timeouts.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 0,
+        first_pages: Optional[int] = None,
+        last_pages: Optional[int] = None,
+        page_timeout: float = 10.0,
+        pages_per_task: int = 4,
+    ) -> None:
+        self.max_workers = max_workers
+        self.first_pages = first_pages
+        self.last_pages = last_pages
+        self.page_timeout = page_timeout
+        self.pages_per_task = pages_per_task
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._pool_unavailable = False
+
+    @property
+    def is_parallel(self) -> bool:
+        return self.max_workers > 1 and not self._pool_unavailable
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        with self._pool_lock:
+            if self._pool is None and not self._pool_unavailable:
+                try:
+                    self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_pool_context())
+                except (OSError, NotImplementedError) as e:
+                    logger.warning('Process pool unavailable, extracting PDF pages in-process: %s', e)
+                    self._pool_unavailable = True
+            return self._pool
+
+    def _reset_pool(self) -> None:
+        """Cancels the pending tasks and kills the workers; the next call starts a fresh pool."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        # A worker stuck inside PyPDF2's C code never sees its alarm and would outlive a plain shutdown.
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.kill()
+
+    def _deadline(self, task_seconds: float, task_count: int) -> float:
+        """When ``task_count`` tasks of at most ``task_seconds`` each must have finished, spread over the workers."""
+        return time.monotonic() + task_seconds * math.ceil(task_count / self.max_workers)
+
+    def close(self) -> None:
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def iter_pages(self, file_content) -> Iterator[str]:
+        """Yields the text of the selected pages in order; ``file_content`` is bytes or a seekable file object."""
+        pdf_reader = PdfReader(open_stream(file_content))
+        page_numbers = select_pages(len(pdf_reader.pages), self.first_pages, self.last_pages)
+        pool = self._get_pool() if self.is_parallel and len(page_numbers) > 1 else None
+        if pool is None:
+            # Pages are parsed on access, so stopping early skips the rest of the document.
+            for page_number in page_numbers:
+                yield pdf_reader.pages[page_number].extract_text()
+            return
+
+        if not isinstance(file_content, bytes):
+            # Worker processes need the whole document.
+            file_content.seek(0)
+            file_content = file_content.read()
+        ranges = [
+            page_numbers[start : start + self.pages_per_task]
+            for start in range(0, len(page_numbers), self.pages_per_task)
+        ]
+        document_key = hashlib.sha256(file_content).hexdigest()
+        futures = [
+            pool.submit(extract_page_range, file_content, page_range, self.page_timeout, document_key)
+            for page_range in ranges
+        ]
+        deadline = self._deadline(self.page_timeout * self.pages_per_task, len(ranges))
+        timed_out = False
+        try:
+            for page_range, future in zip(ranges, futures):
+                try:
+                    texts = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                except FutureTimeoutError:
+                    logger.error('PDF pages %s did not come back from their worker in time', page_range)
+                    timed_out = True
+                    texts = [''] * len(page_range)
+                except Exception as e:
+                    logger.error('Failed to extract text from PDF pages %s: %s', page_range, e)
+                    texts = [''] * len(page_range)
+                yield from texts
+        finally:
+            # The consumer may stop early once it has enough text; drop the ranges it no longer needs.
+            for future in futures:
+                future.cancel()
+            if timed_out:
+                self._reset_pool()
+
+    def extract_text(self, file_content) -> str:
+        return ''.join(self.iter_pages(file_content))
+
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+
+def get_default_engine() -> PDFExtractionEngine:
+    """The process-wide engine configured by the ``PDF_*`` environment variables."""
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            config = Config()
+            _default_engine = PDFExtractionEngine(
+                max_workers=config._pdf_extraction_workers,
+                first_pages=config._pdf_first_pages,
+                last_pages=config._pdf_last_pages,
+                page_timeout=config._pdf_page_timeout_seconds,
+            )
+        return _default_engine
@@ -1,14 +1,12 @@
-import io
-
-from PyPDF2 import PdfReader
+from typing import Iterator, Optional
 
 from app.processors.document_processor import DocumentProcessor
+from app.processors.pdf_extraction_engine import PDFExtractionEngine, get_default_engine
 
 
 class PDFFileProcessor(DocumentProcessor):
-    def extract_text(self, file_content) -> str:
-        pdf_reader = PdfReader(io.BytesIO(file_content))
-        text = ''
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return text
+    def __init__(self, engine: Optional[PDFExtractionEngine] = None) -> None:
+        self.engine = engine or get_default_engine()
+
+    def iter_text(self, file_content) -> Iterator[str]:
+        yield from self.engine.iter_pages(file_content)
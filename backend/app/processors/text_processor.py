@@ -1,6 +1,25 @@
+import codecs
+from typing import Iterator
+
 from app.processors.document_processor import DocumentProcessor
 
 
 class TextFileProcessor(DocumentProcessor):
-    def extract_text(self, file_content) -> str:
-        return file_content
+    # Plain text is yielded in slices of this many characters so callers can stop early.
+    CHUNK_SIZE = 16 * 1024
+
+    def iter_text(self, file_content) -> Iterator[str]:
+        if hasattr(file_content, 'read'):
+            # Read a file object chunk by chunk, so stopping early also stops the download.
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            while True:
+                data = file_content.read(self.CHUNK_SIZE)
+                text = decoder.decode(data, final=not data)
+                if text:
+                    yield text
+                if not data:
+                    return
+        if isinstance(file_content, bytes):
+            file_content = file_content.decode('utf-8', errors='replace')
+        for start in range(0, len(file_content), self.CHUNK_SIZE):
+            yield file_content[start : start + self.CHUNK_SIZE]
@@ -1,16 +1,39 @@
-import io
+from itertools import islice
+from typing import Iterator, Optional
 
 import openpyxl
 
-from app.processors.document_processor import DocumentProcessor
+from app.processors.document_processor import DocumentProcessor, open_stream
 
 
 class XLSXFileProcessor(DocumentProcessor):
-    def extract_text(self, file_content) -> str:
-        workbook = openpyxl.load_workbook(io.BytesIO(file_content))
-        text = ''
-        for sheet in workbook.sheetnames:
-            worksheet = workbook[sheet]
-            for row in worksheet.iter_rows(values_only=True):
-                text += ' '.join([str(cell) for cell in row]) + '\n'
-        return text
+    """Streams workbook rows in openpyxl's read-only mode, which parses the sheet XML lazily instead of building every
+    cell object up front. Rows are sampled across sheets in round-robin blocks, so the first few thousand tokens cover
+    every sheet rather than only the first one, and each sheet is capped at ``max_rows_per_sheet`` rows."""
+
+    MAX_ROWS_PER_SHEET = 1000
+    ROWS_PER_BLOCK = 50
+
+    def __init__(self, max_rows_per_sheet: Optional[int] = MAX_ROWS_PER_SHEET, rows_per_block: int = ROWS_PER_BLOCK):
+        self.max_rows_per_sheet = max_rows_per_sheet
+        self.rows_per_block = rows_per_block
+
+    def iter_text(self, file_content) -> Iterator[str]:
+        workbook = openpyxl.load_workbook(open_stream(file_content), read_only=True, data_only=True)
+        try:
+            sheet_rows = [
+                islice(workbook[sheet].iter_rows(values_only=True), self.max_rows_per_sheet)
+                for sheet in workbook.sheetnames
+            ]
+            while sheet_rows:
+                for rows in list(sheet_rows):
+                    block = list(islice(rows, self.rows_per_block))
+                    if len(block) < self.rows_per_block:
+                        sheet_rows.remove(rows)
+                    for row in block:
+                        # Skip empty cells, and rows made only of empty cells.
+                        cells = [str(cell) for cell in row if cell is not None and cell != '']
+                        if cells:
+                            yield ' '.join(cells) + '\n'
+        finally:
+            workbook.close()
@@ -1,9 +1,20 @@
+import datetime
+import itertools
+import json
 import logging
+import zipfile
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 
-from app.services.document_service import DocumentService
-from app.utils.document_utils import allowed_file, is_file_size_exceeded
+from app.storage.metadata_index import SORT_FIELDS
+from app.utils.document_utils import (
+    MAX_FILE_SIZE_MB,
+    ArchiveTooLargeError,
+    allowed_file,
+    extract_zip_documents,
+    is_file_size_exceeded,
+)
+from app.utils.lazy_proxy import LazyProxy
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -13,9 +24,28 @@ main_bp = Blueprint('documents', __name__)
 upload_bp = Blueprint('upload', __name__)
 detect_bp = Blueprint('detect', __name__)
 delete_bp = Blueprint('delete', __name__)
+metrics_bp = Blueprint('metrics', __name__)
+jobs_bp = Blueprint('jobs', __name__)
+search_bp = Blueprint('search', __name__)
 
-# Initialize Document Service
-document_service = DocumentService()
+# S3 returns at most 1,000 keys per listing call.
+MAX_PAGE_SIZE = 1000
+MAX_DETECT_BATCH_SIZE = 1000
+MAX_UPLOAD_BATCH_SIZE = 1000
+MAX_SEARCH_RESULTS = 100
+# Deleted in DeleteObjects requests of 1,000 keys, sent concurrently.
+MAX_DELETE_BATCH_SIZE = 10000
+
+
+def _create_document_service():
+    # Imported here: the service pulls in boto3, and detection the OpenAI and parsing stack.
+    from app.services.document_service import DocumentService
+
+    return DocumentService()
+
+
+# Initialize Document Service on the first request that uses it, so importing the app stays cheap.
+document_service = LazyProxy(_create_document_service)
 
 
 @upload_bp.route('/upload', methods=['POST'])
@@ -33,9 +63,22 @@ def upload_document():
         return jsonify({'error': 'Selected document not allowed'}), 400
 
     if is_file_size_exceeded(file, file_name):
-        return jsonify({'error': 'Selected document is very heavy: Max 2MB'}), 400
+        return jsonify({'error': f'Selected document is very heavy: Max {MAX_FILE_SIZE_MB}MB'}), 400
 
     try:
+        if request.values.get('classify', '').lower() in ('true', '1'):
+            # The request already holds the bytes: classify them off the request path and store the document once.
+            document_data = document_service.upload_and_classify_document(file.read(), file_name)
+            if document_data['job_id'] is None:
+                return jsonify({'message': 'File already uploaded', 'document': document_data['document_id']}), 200
+            return jsonify(
+                {
+                    'message': 'File accepted for classification',
+                    'document': document_data['document_id'],
+                    'job_id': document_data['job_id'],
+                }
+            ), 202
+
         document_data = document_service.upload_document(file, file_name)
         return jsonify({'message': 'File uploaded successfully', 'document': document_data}), 200
     except Exception as e:
@@ -43,16 +86,173 @@ def upload_document():
         return jsonify({'error': 'Internal server error'}), 500
 
 
+@upload_bp.route('/upload/batch', methods=['POST'])
+def upload_documents():
+    """Uploads many documents in one request, sent as several `files` fields and/or zip `archive` fields."""
+    files = [(file.filename, file) for file in request.files.getlist('files')]
+    try:
+        for archive in request.files.getlist('archive'):
+            files.extend(extract_zip_documents(archive, max_documents=max(MAX_UPLOAD_BATCH_SIZE - len(files), 0)))
+        return _upload_batch(files)
+    except zipfile.BadZipFile:
+        return jsonify({'error': 'archive is not a valid zip file'}), 400
+    except ArchiveTooLargeError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        # Archive entries are spooled to temporary files; release them once the batch is stored.
+        for _, file in files:
+            if file is not None:
+                file.close()
+
+
+def _upload_batch(files):
+    if not files:
+        return jsonify({'error': 'No files in the request'}), 400
+    if len(files) > MAX_UPLOAD_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_UPLOAD_BATCH_SIZE} documents can be uploaded per request'}), 400
+
+    # Invalid files are reported in place; the valid ones are uploaded together.
+    results, accepted = [], []
+    for file_name, file in files:
+        if not file_name or not allowed_file(file_name):
+            results.append({'file_name': file_name, 'error': 'Selected document not allowed'})
+        elif file is None or is_file_size_exceeded(file, file_name):
+            results.append(
+                {'file_name': file_name, 'error': f'Selected document is very heavy: Max {MAX_FILE_SIZE_MB}MB'}
+            )
+        else:
+            results.append(None)
+            accepted.append((file, file_name))
+
+    try:
+        logger.info('Uploading %s of %s documents', len(accepted), len(files))
+        upload = document_service.upload_documents(accepted)
+    except Exception as e:
+        logger.exception('Error uploading files: %s', e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+    uploaded = iter(upload['results'])
+    results = [result or next(uploaded) for result in results]
+    failed = sum(1 for result in results if 'error' in result)
+    return jsonify(
+        {'results': results, 'succeeded': len(results) - failed, 'failed': failed, 'timings': upload['timings']}
+    ), 200
+
+
+@upload_bp.route('/upload/presigned', methods=['POST'])
+def create_presigned_upload():
+    """Returns a presigned POST so the client uploads the document straight to S3, whatever its size."""
+    payload = request.get_json(silent=True) or {}
+    file_name = payload.get('file_name')
+    size = payload.get('size')
+    if not file_name or not allowed_file(file_name):
+        return jsonify({'error': 'Selected document not allowed'}), 400
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+        return jsonify({'error': 'size must be a positive number of bytes'}), 400
+
+    try:
+        presigned_upload = document_service.create_presigned_upload(file_name, size)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except NotImplementedError as e:
+        return jsonify({'error': str(e)}), 501
+    except Exception as e:
+        logger.exception('Error creating presigned upload: %s', e)
+        return jsonify({'error': 'Internal server error'}), 500
+    return jsonify(presigned_upload), 200
+
+
+def _stream_json_array(items):
+    """Serializes an iterable as a JSON array one item at a time.
+
+    The status line is sent before later items are read, so a failure while streaming cannot become a 500 anymore:
+    the array is left unclosed instead, and clients fail to parse the truncated body rather than take it for a
+    complete listing.
+    """
+    yield '['
+    separator = ''
+    try:
+        for item in items:
+            yield separator + json.dumps(item)
+            separator = ','
+    except Exception as e:
+        logger.exception('Error while streaming documents, the listing is truncated: %s', e)
+        return
+    yield ']'
+
+
+def _prefetch_first(items):
+    """Reads the first item of an iterable, so that the first page is fetched before a response is started and its
+    errors are still reported with a proper status code."""
+    items = iter(items)
+    for first in items:
+        return itertools.chain([first], items)
+    return iter(())
+
+
+def _parse_upload_time(value):
+    try:
+        upload_time = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid date: {value}') from None
+    if upload_time.tzinfo is not None:
+        # Upload times are stored as naive UTC timestamps.
+        upload_time = upload_time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return upload_time.isoformat()
+
+
+def _parse_document_filters(args):
+    """Reads the `category`, `name_prefix`, `uploaded_after`, `uploaded_before` and `sort` listing parameters."""
+    filters = {}
+    for name in ('category', 'name_prefix'):
+        if args.get(name):
+            filters[name] = args[name]
+    for name in ('uploaded_after', 'uploaded_before'):
+        if args.get(name):
+            filters[name] = _parse_upload_time(args[name])
+    sort = args.get('sort')
+    if sort:
+        field = sort.lstrip('-')
+        if field not in SORT_FIELDS:
+            raise ValueError(f'sort must be one of {", ".join(SORT_FIELDS)}, optionally prefixed with "-"')
+        filters['sort'] = field
+        filters['descending'] = sort.startswith('-')
+    return filters
+
+
 @main_bp.route('/documents', methods=['GET'])
 def list_documents():
-    """Lists all documents stored in S3."""
+    """Lists documents stored in S3, a page at a time when a limit is given. Filter and sort parameters are answered
+    from the metadata index."""
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor') or None
+    if limit is not None:
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_PAGE_SIZE:
+            return jsonify({'error': f'limit must be an integer between 1 and {MAX_PAGE_SIZE}'}), 400
+        limit = int(limit)
+
     try:
-        document_list = document_service.list_documents()
-        return jsonify(document_list), 200
+        filters = _parse_document_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        if filters:
+            documents, next_cursor = document_service.query_documents(limit=limit, cursor=cursor, **filters)
+        else:
+            documents, next_cursor = document_service.list_documents(limit=limit, cursor=cursor)
+        documents = _prefetch_first(documents)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.exception('Error listing documents: %s', e)
         return jsonify({'error': 'Internal server error'}), 500
 
+    response = Response(stream_with_context(_stream_json_array(documents)), mimetype='application/json')
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
 
 @main_bp.route('/detect', methods=['POST'])
 def detect_document_category():
@@ -62,6 +262,11 @@ def detect_document_category():
         if not document_id:
             return jsonify({'error': 'Missing document_id'}), 400
 
+        if request.json.get('async'):
+            job_id = document_service.enqueue_detection(document_id)
+            logger.info('Queued category detection for document %s as job %s', document_id, job_id)
+            return jsonify({'document_id': document_id, 'job_id': job_id, 'status': 'queued'}), 202
+
         logger.info('Detecting category for document %s', document_id)
 
         result = document_service.detect_and_update_category(document_id)
@@ -76,6 +281,63 @@ def detect_document_category():
         return jsonify({'error': 'Internal server error'}), 500
 
 
+@detect_bp.route('/detect/batch', methods=['POST'])
+def detect_document_categories():
+    """Detects and updates the categories of many documents in one request."""
+    document_ids = (request.get_json(silent=True) or {}).get('document_ids')
+    if not isinstance(document_ids, list) or not document_ids:
+        return jsonify({'error': 'Missing document_ids'}), 400
+    if not all(isinstance(document_id, str) and document_id for document_id in document_ids):
+        return jsonify({'error': 'document_ids must be a list of non-empty strings'}), 400
+    if len(document_ids) > MAX_DETECT_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_DETECT_BATCH_SIZE} documents can be detected per request'}), 400
+
+    try:
+        pack = bool(request.json.get('pack', False))
+        logger.info('Detecting categories for %s documents (packed: %s)', len(document_ids), pack)
+        return jsonify(document_service.detect_and_update_categories(document_ids, pack=pack)), 200
+    except Exception as e:
+        logger.exception('Error detecting/updating categories for documents: %s', e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@search_bp.route('/search', methods=['GET'])
+def search_documents():
+    """Full-text search over the names and extracted text of documents, best matches first."""
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', '20')
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_SEARCH_RESULTS:
+        return jsonify({'error': f'limit must be an integer between 1 and {MAX_SEARCH_RESULTS}'}), 400
+
+    try:
+        results, next_cursor = document_service.search_documents(
+            query, limit=int(limit), cursor=request.args.get('cursor') or None
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception('Error searching documents: %s', e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+    response = jsonify(results)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Reports the status of a queued job, with its result or error once finished."""
+    try:
+        job = document_service.get_job(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job), 200
+    except Exception as e:
+        logger.exception('Error retrieving job %s: %s', job_id, e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
 @delete_bp.route('/delete/<document_id>', methods=['DELETE'])
 def delete_document(document_id):
     try:
@@ -94,3 +356,32 @@ def delete_document(document_id):
     except Exception as e:
         logger.exception('Error detecting/updating category for document: %s', e)
         return jsonify({'error': 'Internal server error'}), 500
+
+
+@delete_bp.route('/delete/batch', methods=['POST'])
+def delete_documents():
+    """Deletes many documents, with their index entries and derived objects, in one request."""
+    document_ids = (request.get_json(silent=True) or {}).get('document_ids')
+    if not isinstance(document_ids, list) or not document_ids:
+        return jsonify({'error': 'Missing document_ids'}), 400
+    if not all(isinstance(document_id, str) and document_id for document_id in document_ids):
+        return jsonify({'error': 'document_ids must be a list of non-empty strings'}), 400
+    if len(document_ids) > MAX_DELETE_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_DELETE_BATCH_SIZE} documents can be deleted per request'}), 400
+
+    try:
+        logger.info('Deleting %s documents', len(document_ids))
+        return jsonify(document_service.delete_documents(document_ids)), 200
+    except Exception as e:
+        logger.exception('Error deleting documents: %s', e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Reports cache counters, S3 call latencies, OpenAI scheduling and job queue statistics."""
+    try:
+        return jsonify(document_service.get_metrics()), 200
+    except Exception as e:
+        logger.exception('Error collecting metrics: %s', e)
+        return jsonify({'error': 'Internal server error'}), 500
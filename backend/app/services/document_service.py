@@ -1,39 +1,215 @@
+import io
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from app.detection.document_classifier import DocumentClassifier
-from app.storage.s3_file_storage import S3FileStorage
+from app.config import Config
+from app.detection.classification_cache import create_classification_cache, hash_content
+from app.factories.processor_factory import DocumentProcessorFactory
+from app.factories.storage_factory import DocumentStorageFactory
+from app.jobs.job_queue import SQLiteJobQueue
+from app.jobs.worker_pool import JobWorkerPool
+from app.storage.search_index import SearchIndex
+from app.utils.document_utils import retreive_file_size
+from app.utils.pagination import offset_page
 
 logger = logging.getLogger(__name__)
 
 
 class DocumentService:
     def __init__(self):
-        self.storage = S3FileStorage()
-        self.classifier = DocumentClassifier()
+        self._config = Config()
+        self.storage = DocumentStorageFactory.create_storage(self._config._storage_backend)
+        self.search_index = SearchIndex(self._config._search_index_path)
+        self._classifier = None
+        self._classifier_lock = threading.Lock()
+        self.jobs = JobWorkerPool(
+            SQLiteJobQueue(self._config._job_queue_path, lease_seconds=self._config._job_lease_seconds),
+            handlers={
+                'detect': self._run_detect_job,
+                'classify_upload': self._run_classify_upload_job,
+                'index': self._run_index_job,
+            },
+            workers=self._config._job_workers,
+            retention_seconds=self._config._job_retention_seconds,
+        )
+
+    @property
+    def classifier(self):
+        """The document classifier, built on first use: it imports the OpenAI client and the parsing stack, which
+        listing, uploading or deleting documents never need."""
+        if self._classifier is None:
+            with self._classifier_lock:
+                if self._classifier is None:
+                    from app.detection.document_classifier import DocumentClassifier
+                    from app.detection.rate_limit_scheduler import RateLimitScheduler
+
+                    self._classifier = DocumentClassifier(
+                        cache=create_classification_cache(self._config),
+                        scheduler=RateLimitScheduler(
+                            requests_per_minute=self._config._openai_requests_per_minute,
+                            tokens_per_minute=self._config._openai_tokens_per_minute,
+                            max_retries=self._config._openai_max_retries,
+                        ),
+                        truncation_strategy=self._config._prompt_truncation_strategy,
+                    )
+        return self._classifier
 
     def upload_document(self, file, file_name):
         """Uploads a document to S3."""
-        document = self.storage.upload_file(file=file, file_name=file_name)
+        document, stored = self.storage.upload_or_find_file(file=file, file_name=file_name)
         logger.info(f'File {file_name} uploaded successfully.')
+        # A duplicate resolves to a document that is indexed already, under its own name.
+        if stored:
+            self._enqueue_indexing(document, file_name)
         return document
 
-    def list_documents(self):
-        """Retrieves a list of documents from S3."""
-        return self.storage.retrieve_s3_objects()
+    def upload_documents(self, files):
+        """Uploads many ``(file, file_name)`` pairs concurrently and reports per-file results and throughput."""
+        files = list(files)
+        total_bytes = sum(retreive_file_size(file, file_name) for file, file_name in files)
+        started = time.perf_counter()
+        outcomes = self.storage.upload_files(files)
+        elapsed = time.perf_counter() - started
+
+        results = [{'file_name': file_name, **outcome} for (_, file_name), outcome in zip(files, outcomes)]
+        for result in results:
+            if 'document_id' in result and not result.get('duplicate'):
+                self._enqueue_indexing(result['document_id'], result['file_name'])
+        failed = sum(1 for result in results if 'error' in result)
+        logger.info(f'Uploaded {len(results) - failed}/{len(results)} files ({total_bytes} bytes) in {elapsed:.2f}s')
+        return {
+            'results': results,
+            'succeeded': len(results) - failed,
+            'failed': failed,
+            'timings': {
+                'total_seconds': round(elapsed, 3),
+                'files_per_second': round(len(results) / elapsed, 2) if elapsed else None,
+                'megabytes_per_second': round(total_bytes / 2**20 / elapsed, 3) if elapsed else None,
+            },
+        }
+
+    def create_presigned_upload(self, file_name, size):
+        """Prepares a direct upload to S3 for a client, returning the document id, the URL and the form fields."""
+        presigned_upload = self.storage.generate_presigned_upload(file_name=file_name, size=size)
+        logger.info(f'Presigned upload created for {file_name} as {presigned_upload["document_id"]}.')
+        return presigned_upload
+
+    def upload_and_classify_document(self, content, file_name):
+        """Stores the uploaded bytes right away, without a category, and queues a job that classifies the document
+        and then sets its category. Returns the document id and the job id; with upload deduplication, content that
+        is already stored returns the existing document id and no job."""
+        if self._config._upload_deduplication:
+            existing_document_id = self.storage.find_document_by_sha256(hash_content(content))
+            if existing_document_id:
+                logger.info(f'File {file_name} duplicates document {existing_document_id}, it is not classified again.')
+                return {'document_id': existing_document_id, 'job_id': None}
+
+        # Stored before it is classified, so a failing classification never loses an accepted document. The job
+        # only carries the id: the text is read back from storage (ranged) and kept in the extracted text sidecar.
+        # The classification job also indexes the document's text, so no separate indexing job is queued.
+        document_id = self.storage.upload_file(file=io.BytesIO(content), file_name=file_name)
+        job_id = self.jobs.submit('classify_upload', {'document_id': document_id, 'file_name': file_name})
+        logger.info(f'File {file_name} stored as {document_id} and queued for classification as job {job_id}.')
+        return {'document_id': document_id, 'job_id': job_id}
+
+    def _run_classify_upload_job(self, payload):
+        if not self._config._search_index_on_upload:
+            return self._run_detect_job(payload)
+
+        # The full text is extracted once: it is indexed for search and, truncated, becomes the prompt text.
+        document_id = payload['document_id']
+        document = self.storage.open_document(document_id)
+        text = self._index_document(document_id, payload['file_name'], document)
+        if text is None:
+            return self._run_detect_job(payload)
+        file_content = self.classifier.truncate_prompt_text(text)
+        content_hash = self._get_content_hash(document_id, document)
+        self._store_extracted_text(document_id, file_content, content_hash)
+        return self._classify_and_update(document_id, file_content, content_hash)
+
+    def _enqueue_indexing(self, document_id, file_name):
+        """Queues the extraction of an uploaded document's full text into the search index."""
+        if self._config._search_index_on_upload:
+            self.jobs.submit('index', {'document_id': document_id, 'file_name': file_name})
+
+    def _run_index_job(self, payload):
+        document = self.storage.open_document(payload['document_id'])
+        self._index_document(payload['document_id'], payload['file_name'], document)
+        return {'document_id': payload['document_id']}
+
+    def _index_document(self, document_id, file_name, content):
+        """Indexes the full text of a document and returns it, or None when it could not be extracted."""
+        try:
+            file_extension = file_name.split('.')[-1].lower()
+            text = DocumentProcessorFactory.get_processor(file_extension).extract_text(content)
+        except Exception as e:
+            # The document can still be found by its name.
+            logger.warning(f'Could not extract the text of {file_name} for the search index: {e}')
+            text = None
+        self.search_index.upsert(document_id, file_name, text or '')
+        return text
+
+    def rebuild_search_index(self, max_workers=None):
+        """Extracts the full text of every stored document into the search index and drops the entries of documents
+        that no longer exist. Returns the number of indexed documents."""
+        documents = {
+            document['filename']: document['metadata'].get('original_name') or document['filename'].split('_', 1)[-1]
+            for document in self.storage.retrieve_s3_objects()
+        }
+
+        def index(document_id):
+            try:
+                self._index_document(document_id, documents[document_id], self.storage.open_document(document_id))
+                return True
+            except Exception as e:
+                logger.error(f'Could not index document {document_id}: {e}')
+                return False
+
+        with ThreadPoolExecutor(max_workers=max_workers or self._config._detect_batch_concurrency) as executor:
+            indexed = sum(executor.map(index, documents))
+        self.search_index.delete_many(set(self.search_index.document_ids()) - set(documents))
+        logger.info(f'Search index rebuilt with {indexed} of {len(documents)} documents')
+        return indexed
+
+    def search_documents(self, query, limit=20, cursor=None):
+        """Searches the extracted text and names of documents. Returns the best matches with snippets, and the cursor
+        of the next page when there is one."""
+        return offset_page(
+            lambda page_limit, offset: self.search_index.search(query, limit=page_limit, offset=offset), limit, cursor
+        )
+
+    def list_documents(self, limit=None, cursor=None):
+        """Retrieves documents from S3 lazily, along with the cursor of the next page when limited."""
+        return self.storage.retrieve_s3_objects_page(limit=limit, cursor=cursor)
+
+    def query_documents(self, limit=None, cursor=None, **filters):
+        """Filters and sorts documents by category, original name prefix and upload time using the metadata index."""
+        return self.storage.query_documents(limit=limit, cursor=cursor, **filters)
 
     def detect_and_update_category(self, document_id):
         """Detects document category and updates metadata in S3."""
-        document_object = self.storage.find_file_object_by_document_id(document_id)
+        content_hash = self.storage.get_content_sha256(document_id)
+        category = self._get_cached_category(document_id, content_hash)
+        if category:
+            self.storage.update_document_category(document_key=document_id, category=category)
+            return {'document_id': document_id, 'detected_category': category}
+
+        document_text = self._get_document_text(document_id, content_hash)
 
-        if not document_object:
+        if not document_text:
             logger.error(f'Document {document_id} has no content.')
             return {'error': 'Document not found'}
 
-        # Read document content
-        document_content = document_object['Body'].read()
+        file_content, content_hash = document_text
+        return self._classify_and_update(document_id, file_content, content_hash)
 
+    def _classify_and_update(self, document_id, file_content, content_hash):
         # Detect document category
-        category = self.classifier.detect_category(file_name=document_id, content=document_content)
+        category = self.classifier.detect_category_from_text(
+            file_name=document_id, file_content=file_content, content_hash=content_hash
+        )
         # Update document metadata with detected category
         self.storage.update_document_category(document_key=document_id, category=category)
 
@@ -41,8 +217,229 @@ class DocumentService:
 
         return {'document_id': document_id, 'detected_category': category}
 
+    def _get_cached_category(self, document_id, content_hash):
+        """Returns the cached category of a document whose hash is on record, without reading the document."""
+        category = self.classifier.get_cached_category(content_hash) if content_hash else None
+        if category:
+            logger.info(f'Document {document_id} category served from cache: {category}')
+        return category
+
+    def _get_document_text(self, document_id, content_hash=None):
+        """Returns the prompt text of a document and the hash of its bytes. The text is read from the extracted
+        text sidecar when one covers the current token budget; otherwise the document is downloaded and parsed
+        once, and the sidecar is written for later detections. ``content_hash`` is the recorded hash, when the
+        caller has looked it up already."""
+        budget = self.classifier.document_token_budget
+        extracted = self.storage.get_extracted_text(document_id)
+        if self._covers_budget(extracted, budget):
+            logger.info(f'Document {document_id} text served from the extracted text sidecar')
+            return extracted['text'], extracted['content_sha256']
+
+        # Ranged reads pull only the parts of the document the processor parses before the budget is met.
+        document = self.storage.open_document(document_id)
+        file_content = self.classifier.extract_prompt_text(document_id, document)
+        content_hash = content_hash or self._get_content_hash(document_id, document)
+        self._store_extracted_text(document_id, file_content, content_hash)
+        return file_content, content_hash
+
+    def _get_content_hash(self, document_id, document):
+        content_hash = document.metadata.get('sha256') or self.storage.get_content_sha256(document_id)
+        # Documents uploaded without a recorded hash (presigned or older uploads) are hashed from a streamed read.
+        return content_hash or self.storage.compute_content_sha256(document_id)
+
+    def _covers_budget(self, extracted, budget):
+        if not extracted or not extracted['content_sha256']:
+            return False
+        if extracted['truncation'] != self.classifier.truncation_strategy:
+            return False
+        # A longer head still yields the same prompt; a head and tail cut for another budget does not.
+        if extracted['truncation'] == 'head':
+            return extracted['max_tokens'] >= budget
+        return extracted['max_tokens'] == budget
+
+    def _store_extracted_text(self, document_id, file_content, content_hash):
+        if not self.search_index.contains(document_id):
+            # Documents indexed on upload have their full text indexed already; the prompt text is a fallback.
+            self.search_index.upsert(document_id, document_id.split('_', 1)[-1], file_content)
+        try:
+            self.storage.put_extracted_text(
+                document_id,
+                file_content,
+                content_hash,
+                max_tokens=self.classifier.document_token_budget,
+                truncation=self.classifier.truncation_strategy,
+            )
+        except Exception as e:
+            logger.warning(f'Could not store extracted text of document {document_id}: {e}')
+
+    def enqueue_detection(self, document_id):
+        """Queues category detection for a document and returns the job id to poll."""
+        return self.jobs.submit('detect', {'document_id': document_id})
+
+    def _run_detect_job(self, payload):
+        result = self.detect_and_update_category(payload['document_id'])
+        if 'error' in result:
+            raise Exception(result['error'])
+        return result
+
+    def get_job(self, job_id):
+        """Returns the status and, once finished, the result or error of a queued job."""
+        return self.jobs.queue.get(job_id)
+
+    def detect_and_update_categories(self, document_ids, max_workers=None, pack=False):
+        """Detects and stores the categories of many documents, running each one's fetch, detection and update
+        pipeline concurrently with the others. With ``pack`` several documents share each classification request.
+        Failures are reported per document instead of aborting the batch."""
+        document_ids = list(dict.fromkeys(document_ids))
+        max_workers = max_workers or self._config._detect_batch_concurrency
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(document_ids)) or 1) as executor:
+            if pack:
+                results, stage_seconds = self._detect_and_update_packed(document_ids, executor, max_workers)
+            else:
+                outcomes = list(executor.map(self._detect_and_update_with_timings, document_ids))
+                results = [result for result, _ in outcomes]
+                stage_seconds = {}
+                for _, timings in outcomes:
+                    for stage, seconds in timings.items():
+                        stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+        elapsed = time.perf_counter() - started
+
+        failed = sum(1 for result in results if 'error' in result)
+        logger.info(f'Detected categories for {len(results) - failed}/{len(results)} documents in {elapsed:.2f}s')
+
+        return {
+            'results': results,
+            'succeeded': len(results) - failed,
+            'failed': failed,
+            'timings': {
+                'total_seconds': round(elapsed, 3),
+                'documents_per_second': round(len(results) / elapsed, 2) if elapsed else None,
+                'stage_seconds': {stage: round(seconds, 3) for stage, seconds in stage_seconds.items()},
+            },
+        }
+
+    def _fetch_document_text(self, document_id):
+        try:
+            return self._get_document_text(document_id)
+        except Exception as e:
+            logger.error(f'Error fetching document {document_id}: {e}')
+            return e
+
+    def _update_document_category(self, document_id_and_category):
+        document_id, category = document_id_and_category
+        try:
+            self.storage.update_document_category(document_key=document_id, category=category)
+            return {'document_id': document_id, 'detected_category': category}
+        except Exception as e:
+            logger.error(f'Error updating category for document {document_id}: {e}')
+            return {'document_id': document_id, 'error': str(e)}
+
+    def _detect_and_update_packed(self, document_ids, executor, max_workers):
+        """Runs the batch stage by stage: concurrent fetches, packed classification, then concurrent updates. Texts
+        come from the extracted text sidecars, or are extracted and stored in them, like single detections."""
+        results = {}
+        stage_seconds = {}
+
+        started = time.perf_counter()
+        fetched = dict(zip(document_ids, executor.map(self._fetch_document_text, document_ids)))
+        stage_seconds['fetch'] = time.perf_counter() - started
+        for document_id, document_text in fetched.items():
+            if isinstance(document_text, Exception):
+                results[document_id] = {'document_id': document_id, 'error': str(document_text)}
+        documents = [
+            (document_id, document_text) for document_id, document_text in fetched.items() if document_id not in results
+        ]
+
+        started = time.perf_counter()
+        categories = self.classifier.detect_categories_from_texts(
+            [document_text for _, document_text in documents], max_workers=max_workers
+        )
+        stage_seconds['detect'] = time.perf_counter() - started
+
+        detected = []
+        for (document_id, _), category in zip(documents, categories):
+            if category:
+                detected.append((document_id, category))
+            else:
+                results[document_id] = {'document_id': document_id, 'error': 'Category could not be detected'}
+
+        started = time.perf_counter()
+        for result in executor.map(self._update_document_category, detected):
+            results[result['document_id']] = result
+        stage_seconds['update'] = time.perf_counter() - started
+
+        return [results[document_id] for document_id in document_ids], stage_seconds
+
+    def _detect_and_update_with_timings(self, document_id):
+        timings = {}
+        try:
+            started = time.perf_counter()
+            content_hash = self.storage.get_content_sha256(document_id)
+            category = self._get_cached_category(document_id, content_hash)
+            if not category:
+                # Covers the download and extraction, or just the sidecar read once the document was extracted before.
+                file_content, content_hash = self._get_document_text(document_id, content_hash)
+                timings['fetch'] = time.perf_counter() - started
+
+                started = time.perf_counter()
+                category = self.classifier.detect_category_from_text(
+                    file_name=document_id, file_content=file_content, content_hash=content_hash
+                )
+            timings['detect'] = time.perf_counter() - started
+            if not category:
+                return {'document_id': document_id, 'error': 'Category could not be detected'}, timings
+
+            started = time.perf_counter()
+            self.storage.update_document_category(document_key=document_id, category=category)
+            timings['update'] = time.perf_counter() - started
+        except Exception as e:
+            logger.error(f'Error detecting category for document {document_id}: {e}')
+            return {'document_id': document_id, 'error': str(e)}, timings
+
+        return {'document_id': document_id, 'detected_category': category}, timings
+
+    def get_metrics(self):
+        """Collects cache counters, S3 call latencies, OpenAI scheduling and job queue statistics."""
+        # Before the first detection there is no classifier yet, and nothing to report for it.
+        classifier = self._classifier
+        cache = classifier.cache if classifier is not None else None
+        return {
+            'classification_cache': cache.stats() if cache is not None else None,
+            's3_latency': self.storage.latency_stats.snapshot(),
+            'openai_scheduler': classifier.scheduler.metrics() if classifier is not None else None,
+            'jobs': self.jobs.queue.stats(),
+        }
+
     def delete_document(self, document_id):
         """Delete a document from S3."""
         deleted = self.storage.remove_file_object_by_document_id(document_id=document_id)
+        if deleted:
+            self.search_index.delete(document_id)
         logger.info(f'File {document_id} uploaded successfully.')
         return {'message': 'Document deleted' if deleted else 'Error while deleting document'}
+
+    def delete_documents(self, document_ids):
+        """Deletes many documents from storage and the search index, and reports per-document results."""
+        started = time.perf_counter()
+        deleted = self.storage.remove_file_objects_by_document_ids(document_ids)
+        self.search_index.delete_many([document_id for document_id, removed in deleted.items() if removed])
+        elapsed = time.perf_counter() - started
+
+        results = [
+            {'document_id': document_id, 'deleted': True}
+            if removed
+            else {'document_id': document_id, 'error': 'Error while deleting document'}
+            for document_id, removed in deleted.items()
+        ]
+        failed = sum(1 for result in results if 'error' in result)
+        logger.info(f'Deleted {len(results) - failed}/{len(results)} documents in {elapsed:.2f}s')
+        return {
+            'results': results,
+            'succeeded': len(results) - failed,
+            'failed': failed,
+            'timings': {
+                'total_seconds': round(elapsed, 3),
+                'documents_per_second': round(len(results) / elapsed, 2) if elapsed else None,
+            },
+        }
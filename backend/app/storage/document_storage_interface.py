@@ -1,12 +1,163 @@
+import logging
+import threading
+import uuid
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from werkzeug.utils import secure_filename
+
+from app.utils.document_utils import retrieve_file_sha256
+
+logger = logging.getLogger(__name__)
+
+# Metadata fields that may change after upload. Backends keep them apart from the document's own metadata, which S3
+# can only change by copying the whole object.
+MUTABLE_METADATA = ('category',)
 
 
 class IDocumentStorage(ABC):
+    """Stores documents under ``documents/<document id>`` together with their metadata, their mutable metadata and
+    the text extracted from them. Implementations set ``self._config`` and ``self.latency_stats``.
+
+    Batch operations run one document at a time unless an implementation overrides ``_map_concurrently``.
+    """
+
+    def __init__(self) -> None:
+        self._dedup_locks = [threading.Lock() for _ in range(64)]
+
+    @staticmethod
+    def generate_document_id(file_name: str) -> str:
+        return f'{str(uuid.uuid4())}_{secure_filename(file_name)}'
+
+    def _map_concurrently(self, function: Callable, items: Iterable) -> List[Any]:
+        return [function(item) for item in items]
+
+    def close(self) -> None:
+        pass
+
+    def upload_file(self, file, file_name: str, document_id: Optional[str] = None, category: str = 'none') -> str:
+        """Stores a document and returns its id. With upload deduplication, content that is already stored returns
+        the id of the existing document instead."""
+        return self.upload_or_find_file(file, file_name, document_id, category)[0]
+
+    def upload_or_find_file(
+        self, file, file_name: str, document_id: Optional[str] = None, category: str = 'none'
+    ) -> Tuple[str, bool]:
+        """Like ``upload_file``, also telling whether the file was stored (False when it duplicates a document)."""
+        if not self._config._upload_deduplication or document_id is not None:
+            return self._upload_file(file, file_name, document_id, category), True
+
+        # Deduplication needs the hash before anything is stored, so the (already local) file is hashed first.
+        content_sha256 = retrieve_file_sha256(file)
+        # Identical files uploaded concurrently wait for each other, so only the first one is stored.
+        with self._dedup_locks[int(content_sha256[:8], 16) % len(self._dedup_locks)]:
+            existing_document_id = self.find_document_by_sha256(content_sha256)
+            if existing_document_id:
+                logger.info(f'File "{file_name}" duplicates document {existing_document_id}, it is not stored again.')
+                return existing_document_id, False
+            return self._upload_file(file, file_name, None, category, content_sha256=content_sha256), True
+
+    @abstractmethod
+    def _upload_file(
+        self, file, file_name: str, document_id: Optional[str], category: str, content_sha256: Optional[str] = None
+    ) -> str:
+        pass
+
+    def upload_files(self, files: Iterable[Tuple[Any, str]]) -> List[Dict[str, Any]]:
+        """Uploads many ``(file, file_name)`` pairs. Returns, in order, ``{document_id}`` for each stored file,
+        ``{document_id, duplicate: True}`` for each that duplicates a stored document, or ``{error}`` for each that
+        failed."""
+
+        def upload_or_error(file_and_name):
+            file, file_name = file_and_name
+            try:
+                document_id, stored = self.upload_or_find_file(file, file_name)
+            except Exception as e:
+                return {'error': str(e)}
+            return {'document_id': document_id} if stored else {'document_id': document_id, 'duplicate': True}
+
+        return self._map_concurrently(upload_or_error, files)
+
+    def generate_presigned_upload(self, file_name: str, size: int, category: str = 'none') -> Dict[str, Any]:
+        raise NotImplementedError('Presigned uploads are not supported by this storage backend')
+
     @abstractmethod
-    def upload_file(self, file, file_name: str) -> bool:
+    def find_document_by_sha256(self, sha256: str) -> Optional[str]:
         pass
 
     @abstractmethod
-    def retrieve_s3_objects(self, prefix: str) -> Dict[str, Any]:
+    def get_content_sha256(self, document_id: str) -> Optional[str]:
         pass
+
+    def compute_content_sha256(self, document_id: str) -> str:
+        """Hashes the content of a document that has no recorded hash, reading it in chunks."""
+        return retrieve_file_sha256(self.open_document(document_id))
+
+    def retrieve_s3_objects(self, prefix: str = 'documents') -> list:
+        documents, _ = self.retrieve_s3_objects_page(prefix=prefix)
+        return list(documents)
+
+    @abstractmethod
+    def retrieve_s3_objects_page(
+        self, prefix: str = 'documents', limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> Tuple[Iterator[dict], Optional[str]]:
+        """Lists documents, all of them or a page of at most ``limit`` together with the cursor of the next page.
+        Raises ValueError for a cursor the backend did not issue."""
+
+    @abstractmethod
+    def query_documents(
+        self,
+        category: Optional[str] = None,
+        name_prefix: Optional[str] = None,
+        uploaded_after: Optional[str] = None,
+        uploaded_before: Optional[str] = None,
+        sort: str = 'key',
+        descending: bool = False,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        pass
+
+    @abstractmethod
+    def rebuild_metadata_index(self, prefix: str = 'documents') -> int:
+        pass
+
+    @abstractmethod
+    def find_file_object_by_document_id(self, document_id: str) -> Dict[str, Any]:
+        """Returns ``{'Body': <file object>, 'Metadata': {...}}`` for a document; raises if it does not exist."""
+
+    @abstractmethod
+    def open_document(self, document_id: str):
+        """Opens a document as a seekable, read-only file object whose ``metadata`` attribute holds its metadata."""
+
+    @abstractmethod
+    def get_extracted_text(self, document_id: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def put_extracted_text(
+        self, document_id: str, text: str, content_sha256: str, max_tokens: int, truncation: str = 'head'
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def update_document_metadata(self, document_id: str, updates: Dict[str, str]) -> None:
+        """Changes fields of ``MUTABLE_METADATA``; raises ValueError for any other field."""
+
+    def update_document_category(self, document_key: str, category: str):
+        try:
+            self.update_document_metadata(document_key, {'category': category})
+            logger.info(f'Category of document {document_key} updated to {category}')
+        except Exception as e:
+            logger.error(f'Error updating the category of document {document_key}: {e}')
+
+    @abstractmethod
+    def remove_file_object_by_document_id(self, document_id: str) -> bool:
+        """Deletes a document with its extracted text and mutable metadata. Deletes are idempotent, like on S3: a
+        document that does not exist counts as deleted, and False means the document may still be there."""
+
+    def remove_file_objects_by_document_ids(self, document_ids: Iterable[str]) -> Dict[str, bool]:
+        """Deletes many documents with their extracted text and mutable metadata; maps each id to whether it was
+        deleted, with documents that do not exist counting as deleted."""
+        document_ids = list(dict.fromkeys(document_ids))
+        return dict(zip(document_ids, self._map_concurrently(self.remove_file_object_by_document_id, document_ids)))
@@ -0,0 +1,52 @@
+import hashlib
+import io
+from typing import Optional
+
+
+class HashingReader(io.RawIOBase):
+    """Wraps a readable file object and hashes its content with SHA-256 as it is being read, e.g. by an upload.
+
+    Bytes read again after a seek back (a retried part) are not hashed twice. If the reader ever skips bytes it has
+    not hashed, ``hexdigest`` returns None and the caller has to hash the content separately.
+    """
+
+    def __init__(self, file) -> None:
+        super().__init__()
+        self._file = file
+        self._digest = hashlib.sha256()
+        self._hashed_until = file.tell() if file.seekable() else 0
+        self._complete = True
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._file.seekable()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        position = self._file.tell() if self._file.seekable() else self._hashed_until
+        data = self._file.read(size)
+        if position > self._hashed_until:
+            self._complete = False
+        elif position + len(data) > self._hashed_until:
+            self._digest.update(data[self._hashed_until - position :])
+            self._hashed_until = position + len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    @property
+    def bytes_hashed(self) -> int:
+        return self._hashed_until
+
+    def hexdigest(self) -> Optional[str]:
+        return self._digest.hexdigest() if self._complete else None
@@ -0,0 +1,288 @@
+import datetime
+import io
+import json
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.config import Config
+from app.storage.document_storage_interface import MUTABLE_METADATA, IDocumentStorage
+from app.storage.hashing_reader import HashingReader
+from app.storage.metadata_index import MetadataIndex
+from app.utils.document_utils import extract_metadata, normalize_metadata, retrieve_file_sha256
+from app.utils.latency_stats import LatencyStats
+from app.utils.pagination import offset_page
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class MappedDocument(io.RawIOBase):
+    """Seekable, read-only file object over a memory-mapped file: reads copy straight out of the page cache.
+
+    The file is mapped once when opened, so a document replaced by an atomic rename afterwards keeps being read as it
+    was. ``metadata`` holds the document's metadata, like ``S3ObjectReader``.
+    """
+
+    def __init__(self, path: str, metadata: Dict[str, Any]) -> None:
+        super().__init__()
+        self.metadata = metadata
+        with open(path, 'rb') as file:
+            self.size = os.fstat(file.fileno()).st_size
+            # Empty files cannot be mapped.
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self._view = memoryview(self._map) if self._map is not None else memoryview(b'')
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f'Invalid whence: {whence}')
+        if position < 0:
+            raise ValueError(f'Negative seek position {position}')
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        count = max(0, min(len(buffer), self.size - self._position))
+        buffer[:count] = self._view[self._position : self._position + count]
+        self._position += count
+        return count
+
+    def readall(self) -> bytes:
+        data = bytes(self._view[self._position :])
+        self._position = max(self._position, self.size)
+        return data
+
+    def close(self) -> None:
+        if not self.closed:
+            self._view.release()
+            if self._map is not None:
+                self._map.close()
+        super().close()
+
+
+class LocalFileStorage(IDocumentStorage):
+    """Keeps documents in a local directory, for development, tests and load tests that should not depend on S3.
+
+    ``documents/<id>`` holds the content and ``metadata/<id>.json`` its metadata, mutable fields included; extracted
+    text is kept in ``extracted/<id>.json``. Every file is written to a temporary file and renamed into place, so
+    readers never see a partial write. Documents are read through memory maps, and listings and queries are answered by
+    a metadata index stored next to them.
+    """
+
+    def __init__(self, root: Optional[str] = None) -> None:
+        super().__init__()
+        self._config = Config()
+        self._root = os.path.abspath(root or self._config._local_storage_path)
+        for directory in ('documents', 'metadata', 'extracted'):
+            os.makedirs(os.path.join(self._root, directory), exist_ok=True)
+        self.latency_stats = LatencyStats()
+        self._metadata_lock = threading.Lock()
+        self._index = MetadataIndex(os.path.join(self._root, 'index.sqlite3'))
+
+    def close(self) -> None:
+        self._index.close()
+
+    def _path(self, directory: str, document_id: str, suffix: str = '') -> str:
+        # Document ids come from requests; they must not reach outside the storage directory.
+        if not document_id or os.path.basename(document_id) != document_id or document_id in ('.', '..'):
+            raise ValueError(f'Invalid document id: {document_id}')
+        return os.path.join(self._root, directory, document_id + suffix)
+
+    @staticmethod
+    def _write_atomically(path: str, write: Callable[[Any], None]) -> None:
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                write(file)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def _write_json(self, path: str, value: Dict[str, Any]) -> None:
+        self._write_atomically(path, lambda file: file.write(json.dumps(value).encode('utf-8')))
+
+    @staticmethod
+    def _read_json(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'rb') as file:
+                return json.loads(file.read())
+        except FileNotFoundError:
+            return None
+
+    def _read_metadata(self, document_id: str) -> Dict[str, Any]:
+        metadata = self._read_json(self._path('metadata', document_id, '.json'))
+        if metadata is None:
+            raise FileNotFoundError(f'Document {document_id} does not exist')
+        return metadata
+
+    @staticmethod
+    def _last_modified(path: str) -> str:
+        return datetime.datetime.fromtimestamp(os.stat(path).st_mtime, tz=datetime.timezone.utc).isoformat()
+
+    def _to_document(self, key: str, record: Dict[str, Any]) -> dict:
+        return {
+            'filename': key.split('/')[-1],
+            'file_url': 'file://' + os.path.join(self._root, key),
+            'metadata': record['metadata'],
+            'size': record['size'],
+            'last_modified': record['last_modified'],
+        }
+
+    def _upload_file(
+        self, file, file_name: str, document_id: Optional[str], category: str, content_sha256: Optional[str] = None
+    ) -> str:
+        document_id = document_id or self.generate_document_id(file_name)
+        path = self._path('documents', document_id)
+        metadata = extract_metadata(
+            file_multipart=file, file_name=file_name, document_id=document_id, category=category
+        )
+        reader = file if content_sha256 else HashingReader(file)
+        self._write_atomically(path, lambda output: shutil.copyfileobj(reader, output, COPY_CHUNK_SIZE))
+        metadata['sha256'] = content_sha256 or reader.hexdigest() or retrieve_file_sha256(file)
+        self._write_json(self._path('metadata', document_id, '.json'), metadata)
+        self._index.upsert(
+            f'documents/{document_id}',
+            metadata,
+            size=int(metadata['filesize']),
+            last_modified=self._last_modified(path),
+        )
+        logger.info(f'File "{file_name}" has been stored in {self._root}.')
+        return document_id
+
+    def find_document_by_sha256(self, sha256: str) -> Optional[str]:
+        while True:
+            key = self._index.find_by_sha256(sha256)
+            if key is None:
+                return None
+            if os.path.exists(os.path.join(self._root, key)):
+                return key[len('documents/') :]
+            self._index.delete(key)
+
+    def get_content_sha256(self, document_id: str) -> Optional[str]:
+        record = self._index.get(f'documents/{document_id}')
+        if record and record['sha256']:
+            return record['sha256']
+        try:
+            return self._read_metadata(document_id).get('sha256')
+        except FileNotFoundError:
+            return None
+
+    def _query_page(self, limit: Optional[int], cursor: Optional[str], **filters) -> Tuple[List[dict], Optional[str]]:
+        records, next_cursor = offset_page(
+            lambda page_limit, offset: self._index.query(limit=page_limit, offset=offset, **filters), limit, cursor
+        )
+        return [self._to_document(key, record) for key, record in records], next_cursor
+
+    def retrieve_s3_objects_page(
+        self, prefix: str = 'documents', limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> Tuple[Iterator[dict], Optional[str]]:
+        documents, next_cursor = self._query_page(limit, cursor, prefix=prefix)
+        return iter(documents), next_cursor
+
+    def query_documents(
+        self,
+        category: Optional[str] = None,
+        name_prefix: Optional[str] = None,
+        uploaded_after: Optional[str] = None,
+        uploaded_before: Optional[str] = None,
+        sort: str = 'key',
+        descending: bool = False,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        return self._query_page(
+            limit,
+            cursor,
+            prefix='documents/',
+            category=category,
+            name_prefix=name_prefix,
+            uploaded_after=uploaded_after,
+            uploaded_before=uploaded_before,
+            sort=sort,
+            descending=descending,
+        )
+
+    def rebuild_metadata_index(self, prefix: str = 'documents') -> int:
+        """Re-reads the metadata of every stored document and replaces the index with it."""
+        records = []
+        with os.scandir(os.path.join(self._root, 'documents')) as entries:
+            for entry in entries:
+                key = f'documents/{entry.name}'
+                if entry.name.startswith('.tmp-') or not key.startswith(prefix):
+                    continue
+                metadata = self._read_json(self._path('metadata', entry.name, '.json')) or {}
+                records.append((key, metadata, entry.stat().st_size, self._last_modified(entry.path)))
+        return self._index.replace_all(records, prefix=prefix)
+
+    def find_file_object_by_document_id(self, document_id: str) -> Dict[str, Any]:
+        document = self.open_document(document_id)
+        return {'Body': document, 'Metadata': document.metadata, 'ContentLength': document.size}
+
+    def open_document(self, document_id: str) -> MappedDocument:
+        return MappedDocument(self._path('documents', document_id), self._read_metadata(document_id))
+
+    def get_extracted_text(self, document_id: str) -> Optional[Dict[str, Any]]:
+        return self._read_json(self._path('extracted', document_id, '.json'))
+
+    def put_extracted_text(
+        self, document_id: str, text: str, content_sha256: str, max_tokens: int, truncation: str = 'head'
+    ) -> None:
+        self._write_json(
+            self._path('extracted', document_id, '.json'),
+            {'text': text, 'content_sha256': content_sha256, 'max_tokens': max_tokens, 'truncation': truncation},
+        )
+
+    def update_document_metadata(self, document_id: str, updates: Dict[str, str]) -> None:
+        unknown = set(updates) - set(MUTABLE_METADATA)
+        if unknown:
+            raise ValueError(f'Metadata fields cannot be updated: {", ".join(sorted(unknown))}')
+        document_key = f'documents/{document_id}'
+        with self._metadata_lock:
+            metadata = {**self._read_metadata(document_id), **normalize_metadata(updates)}
+            self._write_json(self._path('metadata', document_id, '.json'), metadata)
+            record = self._index.get(document_key)
+            self._index.upsert(
+                document_key,
+                metadata,
+                size=record['size'] if record else int(metadata.get('filesize', 0)),
+                last_modified=record['last_modified'] if record else None,
+            )
+
+    def remove_file_object_by_document_id(self, document_id: str) -> bool:
+        try:
+            os.remove(self._path('documents', document_id))
+        except FileNotFoundError:
+            # Nothing to delete, but an index entry or sidecars left behind by an interrupted delete still go.
+            logger.info('Document id %s was already removed', document_id)
+        except ValueError as e:
+            logger.error('Error removing document id %s: %s', document_id, e)
+            return False
+        self._index.delete(f'documents/{document_id}')
+        for path in (self._path('metadata', document_id, '.json'), self._path('extracted', document_id, '.json')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return True
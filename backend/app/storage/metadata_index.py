@@ -0,0 +1,247 @@
+import json
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Queryable metadata fields, kept in columns of their own next to the metadata JSON.
+QUERY_FIELDS = ('category', 'upload_time', 'original_name')
+SORT_FIELDS = ('key', 'size', 'last_modified') + QUERY_FIELDS
+
+
+def _metadata_value(metadata: Dict[str, Any], name: str) -> Optional[str]:
+    # Some S3-compatible stores return user metadata names with underscores turned into hyphens.
+    return metadata.get(name, metadata.get(name.replace('_', '-')))
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """The smallest string greater than every string starting with ``prefix``, for index range scans."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class MetadataIndex:
+    """Local SQLite manifest of document metadata, keyed by S3 object key.
+
+    Each record mirrors what a ``head_object`` call would return for the object, together with the
+    ``LastModified`` timestamps it was read at (of the object and of its mutable metadata object), so callers can
+    detect entries that went stale. The SHA-256 of the
+    content, when known, is kept in its own indexed column so duplicate uploads can be found by hash, and the
+    category, upload time and original name are too, so listings can be filtered and sorted without touching S3.
+    """
+
+    # SQLite caps the number of bound parameters per statement; stay well below the limit.
+    QUERY_CHUNK_SIZE = 500
+
+    def __init__(self, db_path: str) -> None:
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    key TEXT PRIMARY KEY,
+                    metadata TEXT NOT NULL,
+                    size INTEGER,
+                    last_modified TEXT,
+                    sha256 TEXT,
+                    category TEXT,
+                    upload_time TEXT,
+                    original_name TEXT,
+                    mutable_last_modified TEXT
+                )
+                """
+            )
+            # When each prefix was last fully synced with the bucket, so a process knows whether the index is cold.
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS syncs (prefix TEXT PRIMARY KEY, synced_at REAL NOT NULL)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS documents_category ON documents (category, upload_time)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS documents_upload_time ON documents (upload_time)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS documents_original_name ON documents (original_name)')
+
+    # HEAD responses of presigned uploads carry no hash, so refreshing such an entry keeps the hash it already had.
+    _UPSERT_SQL = """
+        INSERT INTO documents (
+            key, metadata, size, last_modified, sha256, category, upload_time, original_name, mutable_last_modified
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET
+            metadata = excluded.metadata,
+            size = excluded.size,
+            last_modified = excluded.last_modified,
+            sha256 = COALESCE(excluded.sha256, documents.sha256),
+            category = excluded.category,
+            upload_time = excluded.upload_time,
+            original_name = excluded.original_name,
+            mutable_last_modified = excluded.mutable_last_modified
+    """
+
+    _RECORD_COLUMNS = 'key, metadata, size, last_modified, sha256, mutable_last_modified'
+
+    @staticmethod
+    def _to_rows(records: Iterable[tuple]) -> List[tuple]:
+        """Records are ``(key, metadata, size, last_modified)``, optionally followed by the ``LastModified`` of the
+        document's mutable metadata object."""
+        rows = []
+        for key, metadata, size, last_modified, *mutable_last_modified in records:
+            rows.append(
+                (key, json.dumps(metadata), size, last_modified, metadata.get('sha256'))
+                + tuple(_metadata_value(metadata, field) for field in QUERY_FIELDS)
+                + (mutable_last_modified[0] if mutable_last_modified else None,)
+            )
+        return rows
+
+    @staticmethod
+    def _row_to_record(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'metadata': json.loads(row['metadata']),
+            'size': row['size'],
+            'last_modified': row['last_modified'],
+            'sha256': row['sha256'],
+            'mutable_last_modified': row['mutable_last_modified'],
+        }
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Returns the indexed records for the given keys; keys missing from the index are omitted."""
+        keys = list(keys)
+        records = {}
+        with self._lock:
+            for start in range(0, len(keys), self.QUERY_CHUNK_SIZE):
+                chunk = keys[start : start + self.QUERY_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._connection.execute(
+                    f'SELECT {self._RECORD_COLUMNS} FROM documents WHERE key IN ({placeholders})',
+                    chunk,
+                ).fetchall()
+                for row in rows:
+                    records[row['key']] = self._row_to_record(row)
+        return records
+
+    def upsert(
+        self,
+        key: str,
+        metadata: Dict[str, Any],
+        size: Optional[int] = None,
+        last_modified: Optional[str] = None,
+        mutable_last_modified: Optional[str] = None,
+    ) -> None:
+        self.upsert_many([(key, metadata, size, last_modified, mutable_last_modified)])
+
+    def upsert_many(self, records: Iterable[tuple]) -> None:
+        """Inserts or replaces records (see ``_to_rows``) in a single transaction."""
+        rows = self._to_rows(records)
+        with self._lock, self._connection:
+            self._connection.executemany(self._UPSERT_SQL, rows)
+
+    def find_by_sha256(self, sha256: str) -> Optional[str]:
+        """Returns the key of a document whose content hashes to ``sha256``, or None."""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT key FROM documents WHERE sha256 = ? ORDER BY key LIMIT 1', (sha256,)
+            ).fetchone()
+        return row['key'] if row else None
+
+    def query(
+        self,
+        prefix: str = '',
+        category: Optional[str] = None,
+        name_prefix: Optional[str] = None,
+        uploaded_after: Optional[str] = None,
+        uploaded_before: Optional[str] = None,
+        sort: str = 'key',
+        descending: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """Returns ``(key, record)`` pairs under ``prefix`` matching every given filter, sorted by ``sort``.
+
+        Upload times are ISO 8601 strings, so ``uploaded_after`` (inclusive) and ``uploaded_before`` (exclusive)
+        compare as text. Prefix filters are range scans, so they use the indexes, and are case-sensitive.
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f'Unsupported sort field: {sort}')
+        conditions, parameters = [], []
+        for column, value in (('key', prefix), ('original_name', name_prefix)):
+            if value:
+                conditions.append(f'{column} >= ? AND {column} < ?')
+                parameters.extend((value, _prefix_upper_bound(value)))
+        if category is not None:
+            conditions.append('category = ?')
+            parameters.append(category)
+        if uploaded_after:
+            conditions.append('upload_time >= ?')
+            parameters.append(uploaded_after)
+        if uploaded_before:
+            conditions.append('upload_time < ?')
+            parameters.append(uploaded_before)
+
+        direction = 'DESC' if descending else 'ASC'
+        sql = f'SELECT {self._RECORD_COLUMNS} FROM documents'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        # The key breaks ties, so pages of equal sort values are stable.
+        sql += f' ORDER BY {sort} {direction}, key {direction} LIMIT ? OFFSET ?'
+        parameters.extend((limit if limit is not None else -1, offset))
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        return [(row['key'], self._row_to_record(row)) for row in rows]
+
+    def delete(self, key: str) -> None:
+        self.delete_many([key])
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany('DELETE FROM documents WHERE key = ?', [(key,) for key in keys])
+
+    def replace_all(self, records: Iterable[tuple], prefix: str = '') -> int:
+        """Drops every entry under ``prefix`` and loads ``records`` in their place, atomically."""
+        rows = self._to_rows(records)
+        with self._lock, self._connection:
+            known_hashes = {
+                row['key']: row['sha256']
+                for row in self._connection.execute(
+                    'SELECT key, sha256 FROM documents WHERE substr(key, 1, ?) = ? AND sha256 IS NOT NULL',
+                    (len(prefix), prefix),
+                )
+            }
+            rows = [row[:4] + (row[4] or known_hashes.get(row[0]),) + row[5:] for row in rows]
+            self._connection.execute('DELETE FROM documents WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+            self._connection.executemany(self._UPSERT_SQL, rows)
+        logger.info('Metadata index rebuilt with %s entries under prefix "%s"', len(rows), prefix)
+        return len(rows)
+
+    def get_synced_at(self, prefix: str) -> Optional[float]:
+        """Returns the time (seconds since the epoch) ``prefix`` was last fully synced, or None if it never was."""
+        with self._lock:
+            row = self._connection.execute('SELECT synced_at FROM syncs WHERE prefix = ?', (prefix,)).fetchone()
+        return row['synced_at'] if row else None
+
+    def set_synced_at(self, prefix: str, synced_at: float) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO syncs (prefix, synced_at) VALUES (?, ?) '
+                'ON CONFLICT (prefix) DO UPDATE SET synced_at = excluded.synced_at',
+                (prefix, synced_at),
+            )
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return [row['key'] for row in self._connection.execute('SELECT key FROM documents ORDER BY key')]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -1,22 +1,56 @@
+import datetime
+import hashlib
+import json
 import logging
-import uuid
-from typing import Any, Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError
-from werkzeug.utils import secure_filename
 
 from app.config import Config
-from app.storage.document_storage_interface import IDocumentStorage
-from app.utils.document_utils import extract_metadata
+from app.storage.document_storage_interface import MUTABLE_METADATA, IDocumentStorage
+from app.storage.metadata_index import MetadataIndex
+from app.storage.s3_object_reader import S3ObjectReader
+from app.utils.document_utils import extract_metadata, normalize_metadata, retrieve_file_sha256
+from app.utils.latency_stats import LatencyStats
+from app.utils.pagination import offset_page
 
 logger = logging.getLogger(__name__)
 
+# S3 deletes at most 1,000 keys per DeleteObjects request.
+DELETE_OBJECTS_MAX_KEYS = 1000
+HASH_CHUNK_SIZE = 1024 * 1024
+
 
 class S3FileStorage(IDocumentStorage):
-    def __init__(self):
+    """Keeps documents in an S3 bucket, with a local metadata index answering listings and queries. Mutable metadata
+    is kept in ``metadata/<document id>.json``."""
+
+    def __init__(self, max_concurrency: Optional[int] = None):
+        super().__init__()
         self._config = Config()
+        self._max_concurrency = max(1, max_concurrency or self._config._s3_max_concurrency)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.latency_stats = LatencyStats()
         self._client = self._create_client()
+        # Files above the threshold are sent as multipart uploads, several parts at a time. The transfer manager is
+        # shared by every upload, so concurrent uploads share its worker threads and connection pool.
+        self._transfer_manager = None
+        self._transfer_config = TransferConfig(
+            multipart_threshold=self._config._s3_multipart_threshold_mb * 1024 * 1024,
+            multipart_chunksize=self._config._s3_multipart_chunksize_mb * 1024 * 1024,
+            max_concurrency=self._config._s3_upload_max_concurrency,
+        )
+        self._index = MetadataIndex(self._config._metadata_index_path)
+        self._index_sync_attempted_at = None
+        self._index_sync_lock = threading.Lock()
+        self._index_sync_thread = None
 
     def _create_client(self):
         aws_access_key_id = self._config._aws_access_key
@@ -28,32 +62,93 @@ class S3FileStorage(IDocumentStorage):
             raise ValueError('AWS credentials are not set in the environment.')
 
         try:
-            return boto3.client(
+            client = boto3.client(
                 's3',
                 region_name=region_name,
                 aws_access_key_id=aws_access_key_id,
                 aws_secret_access_key=aws_secret_access_key,
+                endpoint_url=self._config._s3_endpoint_url,
+                # One pooled connection per worker thread, never fewer than botocore's default of 10.
+                config=BotoConfig(max_pool_connections=max(10, self._max_concurrency)),
             )
+            self._register_latency_hooks(client)
+            return client
         except Exception as e:
             logger.error(f'Error while trying to connect to AWS: {e}')
 
-    def upload_file(self, file, file_name: str) -> Dict[str, Any]:
+    def _register_latency_hooks(self, client) -> None:
+        """Times every S3 API call, retries included, into ``self.latency_stats``."""
+
+        def start_timer(context, **kwargs):
+            context['latency_start'] = time.perf_counter()
+
+        def stop_timer(model, context, error, **kwargs):
+            started = context.pop('latency_start', None)
+            if started is not None:
+                self.latency_stats.record(model.name, time.perf_counter() - started, error=error)
+
+        client.meta.events.register('before-call.s3', start_timer)
+        client.meta.events.register(
+            'after-call.s3',
+            lambda parsed, **kwargs: stop_timer(error='Error' in parsed, **kwargs),
+        )
+        client.meta.events.register('after-call-error.s3', lambda **kwargs: stop_timer(error=True, **kwargs))
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_concurrency, thread_name_prefix='s3-storage')
+            return self._executor
+
+    def _map_concurrently(self, function: Callable, items: Iterable) -> List[Any]:
+        """Applies ``function`` to every item on the storage thread pool, preserving the input order."""
+        items = list(items)
+        if self._max_concurrency == 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        return list(self._get_executor().map(function, items))
+
+    def _get_transfer_manager(self):
+        with self._executor_lock:
+            if self._transfer_manager is None:
+                self._transfer_manager = create_transfer_manager(self._client, self._transfer_config)
+            return self._transfer_manager
+
+    def close(self) -> None:
+        if self._index_sync_thread is not None:
+            self._index_sync_thread.join()
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            if self._transfer_manager is not None:
+                self._transfer_manager.shutdown()
+                self._transfer_manager = None
+        self._index.close()
+
+    def _upload_file(
+        self,
+        file,
+        file_name: str,
+        document_id: Optional[str],
+        category: str,
+        content_sha256: Optional[str] = None,
+    ) -> str:
         try:
-            document_id = f'{str(uuid.uuid4())}_{secure_filename(file_name)}'
+            document_id = document_id or self.generate_document_id(file_name)
             s3_key = f'documents/{document_id}'
-            self._client.upload_fileobj(
-                file,
-                self._bucket,
-                s3_key,
-                ExtraArgs={
-                    'Metadata': extract_metadata(
-                        file_multipart=file,
-                        file_name=file_name,
-                        document_id=document_id,
-                    )
-                },
+            metadata = extract_metadata(
+                file_multipart=file,
+                file_name=file_name,
+                document_id=document_id,
+                category=category,
             )
+            # The hash is kept in the object's user metadata, so every HEAD response (listings, syncs, rebuilds in any
+            # process) carries it. It has to be known before the upload starts, so the local file is hashed first.
+            metadata['sha256'] = content_sha256 or retrieve_file_sha256(file)
+            self._get_transfer_manager().upload(file, self._bucket, s3_key, extra_args={'Metadata': metadata}).result()
             logger.info(f'File "{file_name}" has been uploaded to bucket "{self._bucket}".')
+            # LastModified is only known to S3; the first listing validates the entry with a single HEAD.
+            self._index.upsert(s3_key, metadata, size=int(metadata['filesize']))
             return document_id
 
         except ClientError as e:
@@ -63,24 +158,164 @@ class S3FileStorage(IDocumentStorage):
             logger.error(f'Unexpected error uploading file: {e}')
             raise Exception('Unexpected error uploading file', e)
 
-    def retrieve_s3_objects(self, prefix: str = 'documents') -> list:
+    def generate_presigned_upload(self, file_name: str, size: int, category: str = 'none') -> Dict[str, Any]:
+        """Returns a presigned POST that lets a client upload a document of exactly ``size`` bytes straight to S3,
+        bypassing this process. The document's metadata is fixed by the signed form fields."""
+        if size > self._config._presigned_upload_max_size_mb * 1024 * 1024:
+            raise ValueError(f'Documents are limited to {self._config._presigned_upload_max_size_mb}MB')
+        document_id = self.generate_document_id(file_name)
+        metadata = normalize_metadata(
+            {
+                'original_name': file_name,
+                'filesize': str(size),
+                'upload_time': datetime.datetime.utcnow().isoformat(),
+                'key': document_id,
+                'category': category,
+            }
+        )
+        fields = {f'x-amz-meta-{name}': value for name, value in metadata.items()}
+        conditions = [{name: value} for name, value in fields.items()]
+        conditions.append(['content-length-range', size, size])
+        presigned_post = self._client.generate_presigned_post(
+            Bucket=self._bucket,
+            Key=f'documents/{document_id}',
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=self._config._presigned_upload_expires_seconds,
+        )
+        return {'document_id': document_id, 'url': presigned_post['url'], 'fields': presigned_post['fields']}
+
+    def find_document_by_sha256(self, sha256: str) -> Optional[str]:
+        """Returns the id of a stored document whose content hashes to ``sha256``, or None. Index entries of documents
+        that no longer exist are dropped on the way."""
+        while True:
+            key = self._index.find_by_sha256(sha256)
+            if key is None:
+                return None
+            try:
+                self._client.head_object(Bucket=self._bucket, Key=key)
+                return key[len('documents/') :]
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                    logger.error('Error checking duplicate document %s: %s', key, e)
+                    return None
+                self._index.delete(key)
+
+    def get_content_sha256(self, document_id: str) -> Optional[str]:
+        """Returns the SHA-256 recorded for a document at upload, from the index or the object's metadata."""
+        key = f'documents/{document_id}'
+        record = self._index.get(key)
+        if record and record['sha256']:
+            return record['sha256']
         try:
-            logger.info(f'Listing objects in bucket "{self._bucket}" with prefix "{prefix}"')
-            response = self._client.list_objects_v2(Bucket=self._bucket, Prefix=prefix)
-            # If there are no objects, return an empty list
-            if 'Contents' not in response:
-                return []
-            # Build file details for each object found
-            return [self._build_file_data(obj) for obj in response['Contents']]
+            return self._client.head_object(Bucket=self._bucket, Key=key).get('Metadata', {}).get('sha256')
+        except ClientError as e:
+            logger.error('Error retrieving the hash of document id %s: %s', document_id, e)
+            return None
+
+    def compute_content_sha256(self, document_id: str) -> str:
+        """Hashes a document from a single streamed GET, without keeping its blocks like ``open_document`` does."""
+        digest = hashlib.sha256()
+        body = self._client.get_object(Bucket=self._bucket, Key=f'documents/{document_id}')['Body']
+        for chunk in body.iter_chunks(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def retrieve_s3_objects_page(
+        self, prefix: str = 'documents', limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> Tuple[Iterator[dict], Optional[str]]:
+        """Lists documents lazily, one S3 page at a time.
+
+        With a ``limit`` a single page of at most ``limit`` documents is returned together with the continuation
+        token of the next page (``None`` on the last page). Without one, every page from ``cursor`` onwards is
+        walked and no cursor is returned.
+        """
+        request_params = {'Bucket': self._bucket, 'Prefix': prefix}
+        if limit:
+            request_params['MaxKeys'] = limit
+        if cursor:
+            request_params['ContinuationToken'] = cursor
 
+        try:
+            logger.info(f'Listing objects in bucket "{self._bucket}" with prefix "{prefix}"')
+            response = self._client.list_objects_v2(**request_params)
+        except ClientError as e:
+            if cursor and e.response.get('Error', {}).get('Code') == 'InvalidArgument':
+                raise ValueError('Invalid cursor') from e
+            logger.error('Error retrieving S3 objects', exc_info=e)
+            raise
         except Exception as e:
             logger.error('Error retrieving S3 objects', exc_info=e)
             raise
 
-    def _build_file_data(self, obj) -> dict:
+        next_cursor = response.get('NextContinuationToken') if response.get('IsTruncated') else None
+        if limit:
+            return iter(self._build_files_data(response.get('Contents', []))), next_cursor
+        return self._iter_s3_pages(request_params, response), None
+
+    def _iter_s3_pages(self, request_params: Dict[str, Any], response: Dict[str, Any]) -> Iterator[dict]:
+        while True:
+            # Build file details for each object found, a page at a time
+            yield from self._build_files_data(response.get('Contents', []))
+            if not response.get('IsTruncated'):
+                return
+            request_params = {**request_params, 'ContinuationToken': response['NextContinuationToken']}
+            response = self._client.list_objects_v2(**request_params)
+
+    def _build_files_data(self, objects: list) -> list:
+        """Builds file details from the metadata index, issuing HEAD requests only for unindexed or stale keys."""
+        metadata_by_key = self._refresh_index_entries(objects)
+        return [self._build_file_data(obj, metadata_by_key[obj['Key']]) for obj in objects]
+
+    def _refresh_index_entries(self, objects: list) -> Dict[str, Dict[str, Any]]:
+        """Re-reads the metadata of listed objects that are unindexed or stale, and returns everyone's metadata."""
+        indexed = self._index.get_many(obj['Key'] for obj in objects)
+        refreshed, metadata_by_key = self._read_index_records(objects, indexed)
+        if refreshed:
+            logger.info('Refreshing %s metadata index entries from S3', len(refreshed))
+            self._index.upsert_many(refreshed)
+        return metadata_by_key
+
+    def _read_index_records(self, objects: list, indexed: Dict[str, Dict[str, Any]]) -> Tuple[list, Dict[str, Any]]:
+        """Compares listed objects, and their mutable metadata objects, with their ``indexed`` records. Objects that
+        changed are read with HEAD requests, and changed mutable metadata with GETs. Returns the index records to
+        write and the metadata of every object."""
+        mutable_versions = self._list_mutable_metadata_versions(objects)
+        changed, stale = [], []
+        for obj in objects:
+            record = indexed.get(obj['Key'])
+            if record is None or record['last_modified'] != obj['LastModified'].isoformat():
+                changed.append(obj)
+                stale.append(obj)
+            elif record['mutable_last_modified'] != mutable_versions.get(obj['Key']):
+                stale.append(obj)
+        fetched = self.get_s3_files_metadata(obj['Key'] for obj in changed)
+        mutable_keys = [obj['Key'] for obj in stale if obj['Key'] in mutable_versions]
+        mutable = dict(zip(mutable_keys, self._map_concurrently(self._get_mutable_metadata_of_key, mutable_keys)))
+
+        metadata_by_key = {key: record['metadata'] for key, record in indexed.items()}
+        metadata_by_key.update(fetched)
+        records = []
+        for obj in stale:
+            metadata = metadata_by_key[obj['Key']]
+            if 'error' in metadata:
+                continue
+            metadata = {**metadata, **mutable.get(obj['Key'], {})}
+            metadata_by_key[obj['Key']] = metadata
+            records.append(
+                (
+                    obj['Key'],
+                    metadata,
+                    obj['Size'],
+                    obj['LastModified'].isoformat(),
+                    mutable_versions.get(obj['Key']),
+                )
+            )
+        return records, metadata_by_key
+
+    def _build_file_data(self, obj, metadata: Dict[str, Any]) -> dict:
         file_key = obj['Key']
         file_url = f'https://{self._bucket}.s3.amazonaws.com/{file_key}'
-        metadata = self.get_s3_file_metadata(file_key)
 
         return {
             'filename': file_key.split('/')[-1],
@@ -90,6 +325,102 @@ class S3FileStorage(IDocumentStorage):
             'last_modified': obj['LastModified'].isoformat(),
         }
 
+    def sync_metadata_index(self, prefix: str = 'documents') -> int:
+        """Brings the index in line with the bucket using LIST calls: objects that are new or changed are read with
+        HEAD requests, entries of objects that no longer exist are dropped. Returns the number of listed objects."""
+        started_at = time.time()
+        # Entries added while the bucket is walked may be missing from the listing; only older ones are pruned.
+        known_keys = {key for key in self._index.keys() if key.startswith(prefix)}
+        listed_keys = set()
+        paginator = self._client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket, Prefix=prefix):
+            objects = page.get('Contents', [])
+            self._refresh_index_entries(objects)
+            listed_keys.update(obj['Key'] for obj in objects)
+        removed_keys = known_keys - listed_keys
+        if removed_keys:
+            logger.info('Dropping %s metadata index entries of deleted objects', len(removed_keys))
+            self._index.delete_many(removed_keys)
+        self._index.set_synced_at(prefix, started_at)
+        return len(listed_keys)
+
+    def _sync_index_if_due(self) -> None:
+        """Keeps the index in line with the bucket for queries. An index that was never synced has nothing to answer
+        from, so the query waits for a full sync. An index that was not synced within
+        ``METADATA_INDEX_MAX_AGE_SECONDS`` is answered as it is while a sync runs in the background, so later queries
+        also see documents that other processes uploaded or deleted."""
+        synced_at = self._index.get_synced_at('documents')
+        if synced_at is None:
+            with self._index_sync_lock:
+                if self._index.get_synced_at('documents') is None:
+                    self.sync_metadata_index()
+            return
+
+        with self._index_sync_lock:
+            if time.time() - synced_at < self._config._metadata_index_max_age_seconds:
+                return
+            if self._index_sync_thread is not None and self._index_sync_thread.is_alive():
+                return
+            # A failed sync is retried once the index is due again rather than on every query.
+            attempted_at = self._index_sync_attempted_at
+            if (
+                attempted_at is not None
+                and time.monotonic() - attempted_at < self._config._metadata_index_max_age_seconds
+            ):
+                return
+            self._index_sync_attempted_at = time.monotonic()
+            self._index_sync_thread = threading.Thread(
+                target=self._sync_index_in_background, name='metadata-index-sync', daemon=True
+            )
+            self._index_sync_thread.start()
+
+    def _sync_index_in_background(self) -> None:
+        try:
+            self.sync_metadata_index()
+        except Exception:
+            logger.exception('Background metadata index sync failed')
+
+    def query_documents(
+        self,
+        category: Optional[str] = None,
+        name_prefix: Optional[str] = None,
+        uploaded_after: Optional[str] = None,
+        uploaded_before: Optional[str] = None,
+        sort: str = 'key',
+        descending: bool = False,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Filters and sorts documents by their metadata, answered by the metadata index alone. Returns the matching
+        documents, at most ``limit`` of them, and the cursor of the next page when there is one."""
+        self._sync_index_if_due()
+        records, next_cursor = offset_page(
+            lambda page_limit, offset: self._index.query(
+                prefix='documents/',
+                category=category,
+                name_prefix=name_prefix,
+                uploaded_after=uploaded_after,
+                uploaded_before=uploaded_before,
+                sort=sort,
+                descending=descending,
+                limit=page_limit,
+                offset=offset,
+            ),
+            limit,
+            cursor,
+        )
+        documents = [
+            {
+                'filename': key.split('/')[-1],
+                'file_url': f'https://{self._bucket}.s3.amazonaws.com/{key}',
+                'metadata': record['metadata'],
+                'size': record['size'],
+                'last_modified': record['last_modified'],
+            }
+            for key, record in records
+        ]
+        return documents, next_cursor
+
     def get_s3_file_metadata(self, file_key: str) -> Dict[str, Any]:
         logger.debug('Getting metadata for file key: %s', file_key)
         try:
@@ -101,6 +432,24 @@ class S3FileStorage(IDocumentStorage):
             logger.error('Error retrieving metadata for file key %s: %s', file_key, e)
             return {'error': str(e)}
 
+    def get_s3_files_metadata(self, file_keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetches the metadata of many keys with concurrent HEAD requests."""
+        file_keys = list(file_keys)
+        return dict(zip(file_keys, self._map_concurrently(self.get_s3_file_metadata, file_keys)))
+
+    def rebuild_metadata_index(self, prefix: str = 'documents') -> int:
+        """Re-reads the metadata of every object under ``prefix`` from S3 and replaces the index with it."""
+        logger.info(f'Rebuilding metadata index from bucket "{self._bucket}" with prefix "{prefix}"')
+        started_at = time.time()
+        records = []
+        paginator = self._client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket, Prefix=prefix):
+            page_records, _ = self._read_index_records(page.get('Contents', []), indexed={})
+            records.extend(page_records)
+        indexed = self._index.replace_all(records, prefix=prefix)
+        self._index.set_synced_at(prefix, started_at)
+        return indexed
+
     def find_file_object_by_document_id(self, document_id: str) -> Dict[str, Any]:
         logger.debug('Searching for document with id: %s', document_id)
         prefix = f'documents/{document_id}'
@@ -116,27 +465,146 @@ class S3FileStorage(IDocumentStorage):
             raise Exception(f'Error listing objects for document id {document_id}') from e
         return object_content
 
-    def update_document_category(self, document_key: str, category: str):
-        document_key = f'documents/{document_key}'
+    def get_object_range(self, document_id: str, start: int, end: int) -> Dict[str, Any]:
+        """GETs the inclusive byte range ``start``-``end`` of a document."""
+        key = f'documents/{document_id}'
         try:
-            head_response = self._client.head_object(Bucket=self._bucket, Key=document_key)
-            current_metadata = head_response.get('Metadata', {})
-        except Exception as e:
-            logger.error(f'Error retrieving metadata for {self._bucket}/{document_key}: {e}')
-            return
-        current_metadata['category'] = category
+            return self._client.get_object(Bucket=self._bucket, Key=key, Range=f'bytes={start}-{end}')
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'InvalidRange':
+                raise
+            # Empty objects have no satisfiable range.
+            return self._client.get_object(Bucket=self._bucket, Key=key)
+
+    def open_document(self, document_id: str, block_size: int = S3ObjectReader.DEFAULT_BLOCK_SIZE) -> S3ObjectReader:
+        """Opens a document as a seekable file object that downloads only the byte ranges it is read at."""
+        return S3ObjectReader(lambda start, end: self.get_object_range(document_id, start, end), block_size=block_size)
 
+    @staticmethod
+    def _extracted_text_key(document_id: str) -> str:
+        return f'extracted/{document_id}.txt'
+
+    def get_extracted_text(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the extracted text sidecar of a document as ``{text, content_sha256, max_tokens, truncation}``, or
+        None."""
         try:
-            self._client.copy_object(
-                Bucket=self._bucket,
-                Key=document_key,
-                CopySource={'Bucket': self._bucket, 'Key': document_key},
-                Metadata=current_metadata,
-                MetadataDirective='REPLACE',
-            )
-            logger.info(f'Metadata for {self._bucket}/{document_key} updated successfully!')
+            response = self._client.get_object(Bucket=self._bucket, Key=self._extracted_text_key(document_id))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                logger.error('Error retrieving extracted text for document id %s: %s', document_id, e)
+            return None
+        metadata = response.get('Metadata', {})
+        return {
+            'text': response['Body'].read().decode('utf-8'),
+            'content_sha256': metadata.get('content-sha256'),
+            'max_tokens': int(metadata.get('max-tokens', 0)),
+            'truncation': metadata.get('truncation', 'head'),
+        }
+
+    def put_extracted_text(
+        self, document_id: str, text: str, content_sha256: str, max_tokens: int, truncation: str = 'head'
+    ) -> None:
+        """Stores the text extracted from a document, along with the hash of the bytes it was extracted from."""
+        self._client.put_object(
+            Bucket=self._bucket,
+            Key=self._extracted_text_key(document_id),
+            Body=text.encode('utf-8'),
+            ContentType='text/plain; charset=utf-8',
+            Metadata={'content-sha256': content_sha256, 'max-tokens': str(max_tokens), 'truncation': truncation},
+        )
+
+    @staticmethod
+    def _mutable_metadata_key(document_id: str) -> str:
+        return f'metadata/{document_id}.json'
+
+    def _list_mutable_metadata_versions(self, objects: list) -> Dict[str, str]:
+        """Returns the ``LastModified`` of the mutable metadata objects of listed documents, by document key.
+
+        Listings are sorted, so the mutable metadata of a page of documents is one key range of ``metadata/``, read
+        with a single LIST call in the common case."""
+        document_ids = {
+            obj['Key'][len('documents/') :]: obj['Key'] for obj in objects if obj['Key'].startswith('documents/')
+        }
+        if not document_ids:
+            return {}
+        last_key = self._mutable_metadata_key(max(document_ids))
+        versions = {}
+        paginator = self._client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=self._bucket, Prefix='metadata/', StartAfter=f'metadata/{min(document_ids)}')
+        for page in pages:
+            for obj in page.get('Contents', []):
+                if obj['Key'] > last_key:
+                    return versions
+                document_key = document_ids.get(obj['Key'][len('metadata/') : -len('.json')])
+                if document_key:
+                    versions[document_key] = obj['LastModified'].isoformat()
+        return versions
+
+    def get_mutable_metadata(self, document_id: str) -> Dict[str, str]:
+        """Returns the metadata of a document that was changed after upload, such as its category."""
+        try:
+            response = self._client.get_object(Bucket=self._bucket, Key=self._mutable_metadata_key(document_id))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                raise
+            return {}
+        return json.loads(response['Body'].read())
+
+    def _get_mutable_metadata_of_key(self, document_key: str) -> Dict[str, str]:
+        try:
+            return self.get_mutable_metadata(document_key[len('documents/') :])
         except Exception as e:
-            logger.error(f'Error updating metadata for {self._bucket}/{document_key}: {e}')
+            logger.error('Error retrieving mutable metadata for %s: %s', document_key, e)
+            return {}
+
+    def update_document_metadata(self, document_id: str, updates: Dict[str, str]) -> None:
+        """Changes mutable metadata fields of a document. They are kept in a small JSON object next to the document,
+        so an update is a single PUT whatever the size of the document, which is never rewritten."""
+        unknown = set(updates) - set(MUTABLE_METADATA)
+        if unknown:
+            raise ValueError(f'Metadata fields cannot be updated: {", ".join(sorted(unknown))}')
+        # The object holds every mutable field, so a partial update merges with the current values first.
+        mutable = dict(updates)
+        if set(updates) != set(MUTABLE_METADATA):
+            mutable = {**self.get_mutable_metadata(document_id), **updates}
+        mutable = normalize_metadata(mutable)
+        self._client.put_object(
+            Bucket=self._bucket,
+            Key=self._mutable_metadata_key(document_id),
+            Body=json.dumps(mutable).encode('utf-8'),
+            ContentType='application/json',
+        )
+
+        document_key = f'documents/{document_id}'
+        record = self._index.get(document_key)
+        if record is not None:
+            # PUT responses carry no LastModified, so the next listing re-reads the mutable metadata once.
+            self._index.upsert(
+                document_key,
+                {**record['metadata'], **mutable},
+                size=record['size'],
+                last_modified=record['last_modified'],
+            )
+
+    def migrate_mutable_metadata(self, prefix: str = 'documents', dry_run: bool = False) -> Dict[str, int]:
+        """Moves the mutable fields of documents stored before they had a mutable metadata object, such as categories
+        set by the object copies earlier versions made, into one. Documents that have one already are skipped."""
+        scanned, migrated = 0, 0
+        paginator = self._client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket, Prefix=prefix):
+            objects = page.get('Contents', [])
+            scanned += len(objects)
+            mutable_versions = self._list_mutable_metadata_versions(objects)
+            keys = [obj['Key'] for obj in objects if obj['Key'] not in mutable_versions]
+            for key, metadata in self.get_s3_files_metadata(keys).items():
+                mutable = {name: metadata[name] for name in MUTABLE_METADATA if metadata.get(name, 'none') != 'none'}
+                if 'error' in metadata or not mutable:
+                    continue
+                migrated += 1
+                if not dry_run:
+                    self.update_document_metadata(key[len('documents/') :], mutable)
+        logger.info('Migrated the mutable metadata of %s of %s documents', migrated, scanned)
+        return {'scanned': scanned, 'migrated': migrated}
 
     def remove_file_object_by_document_id(self, document_id: str) -> Dict[str, Any]:
         logger.debug('Attempting to remove file object for document id: %s', document_id)
@@ -151,4 +619,53 @@ class S3FileStorage(IDocumentStorage):
         except Exception as e:
             logger.error('Error removing file object for document id %s: %s', document_id, e)
             return False
+        self._index.delete(object_key)
+        self._delete_sidecars(document_id)
         return True
+
+    def remove_file_objects_by_document_ids(self, document_ids: Iterable[str]) -> Dict[str, bool]:
+        """Deletes many documents with DeleteObjects requests of up to 1,000 keys, sent concurrently, then drops their
+        index entries in one transaction and removes their extracted text and mutable metadata objects the same way."""
+        document_ids = list(dict.fromkeys(document_ids))
+        failed = self._delete_objects([f'documents/{document_id}' for document_id in document_ids])
+        deleted_ids = [document_id for document_id in document_ids if f'documents/{document_id}' not in failed]
+        self._index.delete_many([f'documents/{document_id}' for document_id in deleted_ids])
+        # Sidecars of documents that could not be deleted are kept: the mutable metadata holds their category.
+        sidecar_keys = [
+            key
+            for document_id in deleted_ids
+            for key in (self._extracted_text_key(document_id), self._mutable_metadata_key(document_id))
+        ]
+        self._delete_objects(sidecar_keys)
+        logger.info('Removed %s of %s documents', len(deleted_ids), len(document_ids))
+        return {document_id: f'documents/{document_id}' not in failed for document_id in document_ids}
+
+    def _delete_objects(self, keys: List[str]) -> Dict[str, str]:
+        """Deletes keys in concurrent DeleteObjects requests and returns the error of each key that was not deleted."""
+
+        def delete_chunk(chunk):
+            try:
+                response = self._client.delete_objects(
+                    Bucket=self._bucket, Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True}
+                )
+            except Exception as e:
+                logger.error('Error removing %s objects: %s', len(chunk), e)
+                return {key: str(e) for key in chunk}
+            # Quiet requests only report the keys that failed.
+            return {
+                error['Key']: f'{error.get("Code")}: {error.get("Message")}' for error in response.get('Errors', [])
+            }
+
+        chunks = [
+            keys[start : start + DELETE_OBJECTS_MAX_KEYS] for start in range(0, len(keys), DELETE_OBJECTS_MAX_KEYS)
+        ]
+        failed = {}
+        for chunk_errors in self._map_concurrently(delete_chunk, chunks):
+            failed.update(chunk_errors)
+        for key, error in failed.items():
+            logger.error('Error removing object %s: %s', key, error)
+        return failed
+
+    def _delete_sidecars(self, document_id: str) -> None:
+        """Removes the extracted text and mutable metadata objects of a document with a single request."""
+        self._delete_objects([self._extracted_text_key(document_id), self._mutable_metadata_key(document_id)])
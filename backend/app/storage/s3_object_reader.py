@@ -0,0 +1,99 @@
+import io
+from typing import Any, Callable, Dict
+
+
+class S3ObjectReader(io.RawIOBase):
+    """Seekable, read-only file object over an S3 object that downloads only the blocks that are actually read.
+
+    ``fetch_range(start, end)`` must return a ``get_object`` response for the inclusive byte range. Blocks of
+    ``block_size`` bytes are kept once fetched, and runs of missing blocks are fetched with a single ranged GET, so
+    parsers that seek around (PDF cross-reference tables, ZIP central directories) only pull the parts they touch.
+    """
+
+    DEFAULT_BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, fetch_range: Callable[[int, int], Dict[str, Any]], block_size: int = DEFAULT_BLOCK_SIZE):
+        super().__init__()
+        self._fetch_range = fetch_range
+        self._block_size = block_size
+        self._blocks = {}
+        self._position = 0
+        self._size = None
+        self.metadata = {}
+        self.etag = None
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            # The first block is needed by every format anyway; its Content-Range reveals the object size.
+            self._fetch_blocks(0, 0)
+        return self._size
+
+    def _fetch_blocks(self, first_block: int, last_block: int) -> None:
+        start = first_block * self._block_size
+        end = (last_block + 1) * self._block_size - 1
+        if self._size is not None:
+            end = min(end, self._size - 1)
+        response = self._fetch_range(start, end)
+        data = response['Body'].read()
+        self.requests += 1
+        self.bytes_fetched += len(data)
+
+        if self._size is None:
+            # ContentRange looks like "bytes 0-65535/1048576"; a response to an empty object carries no range.
+            content_range = response.get('ContentRange')
+            self._size = int(content_range.rsplit('/', 1)[1]) if content_range else len(data)
+            self.metadata = response.get('Metadata', {})
+            self.etag = response.get('ETag')
+        for block in range(first_block, last_block + 1):
+            offset = (block - first_block) * self._block_size
+            self._blocks[block] = data[offset : offset + self._block_size]
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f'Invalid whence: {whence}')
+        if position < 0:
+            raise ValueError(f'Negative seek position {position}')
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        end = min(self._position + len(buffer), self.size)
+        if end <= self._position:
+            return 0
+
+        first_block, last_block = self._position // self._block_size, (end - 1) // self._block_size
+        missing = None
+        for block in range(first_block, last_block + 2):
+            if block <= last_block and block not in self._blocks:
+                missing = block if missing is None else missing
+            elif missing is not None:
+                self._fetch_blocks(missing, block - 1)
+                missing = None
+
+        data = b''.join(self._blocks[block] for block in range(first_block, last_block + 1))
+        offset = self._position - first_block * self._block_size
+        count = end - self._position
+        buffer[:count] = data[offset : offset + count]
+        self._position = end
+        return count
+
+    def readall(self) -> bytes:
+        return self.read(max(0, self.size - self._position))
@@ -0,0 +1,139 @@
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List
+
+SNIPPET_TOKENS = 16
+SNIPPET_MARKERS = ('[', ']')
+
+
+def build_match_expression(query: str) -> str:
+    """Turns free text into an FTS5 query matching documents that contain every word, the last one as a prefix so
+    results follow the user while they type. FTS5 operators in the input are treated as plain words."""
+    words = re.findall(r'\w+', query)
+    if not words:
+        raise ValueError('Missing search query')
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class SearchIndex:
+    """Local SQLite FTS5 full-text index over the text extracted from documents.
+
+    ``documents`` maps document ids to the rowids of the FTS table, so replacing or deleting the text of a document
+    is a lookup by rowid rather than a scan of the full-text table. Results are ranked with BM25, the file name
+    weighing more than the text.
+    """
+
+    NAME_WEIGHT = 2.0
+    TEXT_WEIGHT = 1.0
+
+    def __init__(self, db_path: str) -> None:
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    document_id TEXT UNIQUE NOT NULL,
+                    original_name TEXT
+                )
+                """
+            )
+            # Prefix indexes keep the prefix match of the last query word from scanning every term.
+            self._connection.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS document_text USING fts5(
+                    original_name, text, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+                )
+                """
+            )
+
+    def _find_rowid(self, document_id: str):
+        row = self._connection.execute('SELECT id FROM documents WHERE document_id = ?', (document_id,)).fetchone()
+        return row['id'] if row else None
+
+    def upsert(self, document_id: str, original_name: str, text: str) -> None:
+        """Indexes the text of a document, replacing whatever was indexed for it before."""
+        self.upsert_many([(document_id, original_name, text)])
+
+    def upsert_many(self, records: Iterable[tuple]) -> None:
+        """Indexes ``(document_id, original_name, text)`` records in a single transaction."""
+        with self._lock, self._connection:
+            for document_id, original_name, text in records:
+                rowid = self._find_rowid(document_id)
+                if rowid is None:
+                    rowid = self._connection.execute(
+                        'INSERT INTO documents (document_id, original_name) VALUES (?, ?)', (document_id, original_name)
+                    ).lastrowid
+                else:
+                    self._connection.execute(
+                        'UPDATE documents SET original_name = ? WHERE id = ?', (original_name, rowid)
+                    )
+                    self._connection.execute('DELETE FROM document_text WHERE rowid = ?', (rowid,))
+                self._connection.execute(
+                    'INSERT INTO document_text (rowid, original_name, text) VALUES (?, ?, ?)',
+                    (rowid, original_name, text),
+                )
+
+    def contains(self, document_id: str) -> bool:
+        with self._lock:
+            return self._find_rowid(document_id) is not None
+
+    def delete(self, document_id: str) -> None:
+        self.delete_many([document_id])
+
+    def delete_many(self, document_ids: Iterable[str]) -> None:
+        with self._lock, self._connection:
+            for document_id in document_ids:
+                rowid = self._find_rowid(document_id)
+                if rowid is not None:
+                    self._connection.execute('DELETE FROM document_text WHERE rowid = ?', (rowid,))
+                    self._connection.execute('DELETE FROM documents WHERE id = ?', (rowid,))
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """Returns the documents matching ``query``, best first, with their relevance score and a snippet of the
+        text around the matched words (marked with square brackets)."""
+        with self._lock:
+            rows = self._connection.execute(
+                f"""
+                SELECT documents.document_id, documents.original_name,
+                       bm25(document_text, {self.NAME_WEIGHT}, {self.TEXT_WEIGHT}) AS rank,
+                       snippet(document_text, 1, ?, ?, '...', {SNIPPET_TOKENS}) AS snippet
+                FROM document_text JOIN documents ON documents.id = document_text.rowid
+                WHERE document_text MATCH ?
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+                """,
+                (*SNIPPET_MARKERS, build_match_expression(query), limit, offset),
+            ).fetchall()
+        # BM25 ranks better matches lower; scores are reported the other way round.
+        return [
+            {
+                'document_id': row['document_id'],
+                'original_name': row['original_name'],
+                'score': -row['rank'],
+                'snippet': row['snippet'],
+            }
+            for row in rows
+        ]
+
+    def document_ids(self) -> List[str]:
+        with self._lock:
+            return [row['document_id'] for row in self._connection.execute('SELECT document_id FROM documents')]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -1,13 +1,29 @@
 import datetime
+import hashlib
 import logging
+import os
+import shutil
+import tempfile
 import unicodedata
-from typing import Dict
+import zipfile
+from typing import IO, Dict, List, Optional, Tuple
+
+from app.config import Config
 
 ALLOWED_EXTENSIONS = {'xls', 'xlxs', 'pdf', 'docx', 'doc', 'txt'}
 
 logger = logging.getLogger(__name__)
-MAX_FILE_SIZE_MB = 2
+# Uploads through the API are spooled by Werkzeug; larger files go straight to S3 with a presigned upload.
+MAX_FILE_SIZE_MB = Config()._max_upload_size_mb
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+MAX_ARCHIVE_SIZE_MB = Config()._max_archive_size_mb
+MAX_ARCHIVE_SIZE_BYTES = MAX_ARCHIVE_SIZE_MB * 1024 * 1024
+# Archive entries are inflated into temporary files that only move to disk past this size.
+ARCHIVE_SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class ArchiveTooLargeError(ValueError):
+    """Raised when a zip archive holds more documents or more bytes than one request may upload."""
 
 
 def allowed_file(file_name: str) -> bool:
@@ -38,6 +54,16 @@ def retreive_file_size(file_multipart, file_name) -> int:
     return file_size
 
 
+def retrieve_file_sha256(file_multipart, chunk_size: int = 1024 * 1024) -> str:
+    """Hashes the whole file content, leaving the file at its start."""
+    digest = hashlib.sha256()
+    file_multipart.seek(0)
+    for chunk in iter(lambda: file_multipart.read(chunk_size), b''):
+        digest.update(chunk)
+    file_multipart.seek(0)
+    return digest.hexdigest()
+
+
 def is_file_size_exceeded(file_multipart, file_name: str) -> bool:
     file_size = retreive_file_size(file_multipart, file_name)
     return file_size > MAX_FILE_SIZE_BYTES
@@ -55,3 +81,41 @@ def normalize_metadata(metadata: Dict[str, str]) -> Dict[str, str]:
 
 def normalize_text(text: str) -> str:
     return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+
+
+def extract_zip_documents(
+    archive, max_documents: int, max_total_bytes: int = MAX_ARCHIVE_SIZE_BYTES
+) -> List[Tuple[str, Optional[IO[bytes]]]]:
+    """Returns the ``(file_name, file)`` documents of a zip archive, skipping folders, hidden files and macOS
+    resource forks. Entries larger than the upload limit are not inflated; their file is None. The entry count and
+    the inflated size are checked from the central directory before any entry is read."""
+    with zipfile.ZipFile(archive) as zip_file:
+        entries = [entry for entry in zip_file.infolist() if _is_document_entry(entry)]
+        if len(entries) > max_documents:
+            raise ArchiveTooLargeError(f'At most {max_documents} more documents can be uploaded in this request')
+        total_bytes = sum(entry.file_size for entry in entries if entry.file_size <= MAX_FILE_SIZE_BYTES)
+        if total_bytes > max_total_bytes:
+            raise ArchiveTooLargeError(f'Archive documents may not exceed {max_total_bytes // 2**20}MB in total')
+
+        documents = []
+        for entry in entries:
+            file_name = os.path.basename(entry.filename)
+            if entry.file_size > MAX_FILE_SIZE_BYTES:
+                documents.append((file_name, None))
+            else:
+                documents.append((file_name, _spool_entry(zip_file, entry)))
+    return documents
+
+
+def _is_document_entry(entry: zipfile.ZipInfo) -> bool:
+    file_name = os.path.basename(entry.filename)
+    return not (entry.is_dir() or not file_name or file_name.startswith('.') or entry.filename.startswith('__MACOSX/'))
+
+
+def _spool_entry(zip_file: zipfile.ZipFile, entry: zipfile.ZipInfo) -> IO[bytes]:
+    # Zip reads stop at the size the entry declares, so an entry cannot inflate past the checked total.
+    spool = tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_MAX_SIZE)
+    with zip_file.open(entry) as source:
+        shutil.copyfileobj(source, spool)
+    spool.seek(0)
+    return spool
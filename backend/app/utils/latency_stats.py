@@ -0,0 +1,54 @@
+import statistics
+import threading
+from collections import defaultdict, deque
+from typing import Any, Dict
+
+
+class LatencyStats:
+    """Thread-safe per-operation latency recorder.
+
+    Counts and totals cover every call; percentiles are computed over the most recent ``window`` samples so memory
+    stays bounded on long-lived workers.
+    """
+
+    def __init__(self, window: int = 1000) -> None:
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples = defaultdict(lambda: deque(maxlen=self._window))
+        self._counts = defaultdict(int)
+        self._errors = defaultdict(int)
+        self._totals = defaultdict(float)
+
+    def record(self, operation: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            self._samples[operation].append(seconds)
+            self._counts[operation] += 1
+            self._totals[operation] += seconds
+            if error:
+                self._errors[operation] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Returns ``{operation: {count, errors, mean_ms, p50_ms, p95_ms, max_ms}}`` for every recorded operation."""
+        with self._lock:
+            operations = {name: list(samples) for name, samples in self._samples.items()}
+            counts, errors, totals = dict(self._counts), dict(self._errors), dict(self._totals)
+
+        snapshot = {}
+        for name, samples in operations.items():
+            ordered = sorted(samples)
+            snapshot[name] = {
+                'count': counts[name],
+                'errors': errors.get(name, 0),
+                'mean_ms': round(totals[name] / counts[name] * 1000, 3),
+                'p50_ms': round(statistics.median(ordered) * 1000, 3),
+                'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+                'max_ms': round(ordered[-1] * 1000, 3),
+            }
+        return snapshot
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._errors.clear()
+            self._totals.clear()
@@ -0,0 +1,24 @@
+import threading
+from typing import Any, Callable
+
+
+class LazyProxy:
+    """Stands in for an object that is only built, by ``factory``, when one of its attributes is first used.
+
+    Attributes set on the proxy itself (e.g. by ``monkeypatch.setattr``) take precedence over the object's own.
+    """
+
+    def __init__(self, factory: Callable[[], Any]) -> None:
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_lock', threading.Lock())
+        object.__setattr__(self, '_instance', None)
+
+    def _get_instance(self) -> Any:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    object.__setattr__(self, '_instance', self._factory())
+        return self._instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._get_instance(), name)
@@ -0,0 +1,19 @@
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+def offset_page(
+    fetch: Callable[[Optional[int], int], List[T]], limit: Optional[int], cursor: Optional[str]
+) -> Tuple[List[T], Optional[str]]:
+    """Pages through results by offset. ``fetch(limit, offset)`` returns at most ``limit`` results from ``offset``,
+    or all of them for no limit. Returns the page and the cursor of the next one when there is one; raises ValueError
+    for a cursor this function did not issue."""
+    if cursor is not None and not cursor.isdigit():
+        raise ValueError('Invalid cursor')
+    offset = int(cursor or 0)
+    # One extra result tells whether another page follows.
+    results = fetch(limit + 1 if limit else None, offset)
+    if limit and len(results) > limit:
+        return results[:limit], str(offset + limit)
+    return results, None
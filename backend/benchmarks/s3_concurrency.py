@@ -0,0 +1,100 @@
+"""Throughput of batched S3FileStorage HEAD/GET/DELETE calls against concurrency.
+
+Runs against a local moto server by default (a MinIO-style stand-in that needs no credentials), or against any
+S3-compatible endpoint given with ``--endpoint-url``. Loopback calls return in well under a millisecond, so
+``--latency-ms`` adds a simulated network round trip to every request to make the effect of fanning out visible.
+
+    python -m benchmarks.s3_concurrency --objects 200 --latency-ms 20 --concurrency 1 4 16 32
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+BUCKET = 'benchmark-documents'
+
+
+def start_local_server(port: int) -> str:
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(port=port, verbose=False)
+    server.start()
+    return f'http://127.0.0.1:{port}'
+
+
+def create_storage(concurrency: int, latency_ms: float, index_dir: str):
+    from app.storage.s3_file_storage import S3FileStorage
+
+    os.environ['S3_MAX_CONCURRENCY'] = str(concurrency)
+    os.environ['METADATA_INDEX_PATH'] = os.path.join(index_dir, f'index-{uuid.uuid4().hex}.sqlite3')
+    storage = S3FileStorage()
+    if latency_ms:
+        storage._client.meta.events.register('before-send.s3', lambda **kwargs: time.sleep(latency_ms / 1000))
+    return storage
+
+
+def run(args) -> None:
+    endpoint_url = args.endpoint_url or start_local_server(args.port)
+    os.environ.setdefault('MY_AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('MY_AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ['MY_AWS_DEFAULT_REGION'] = args.region
+    os.environ['MY_AWS_STORAGE_BUCKET_NAME'] = args.bucket
+    os.environ['S3_ENDPOINT_URL'] = endpoint_url
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        seed = create_storage(32, 0, index_dir)
+        try:
+            seed._client.create_bucket(Bucket=args.bucket)
+        except seed._client.exceptions.BucketAlreadyOwnedByYou:
+            pass
+
+        print(f'endpoint={endpoint_url} objects={args.objects} simulated_latency={args.latency_ms}ms')
+        print(f'{"concurrency":>11} {"operation":>10} {"seconds":>8} {"ops/s":>9} {"p50 ms":>8} {"p95 ms":>8}')
+        for concurrency in args.concurrency:
+            document_ids = [f'bench-{uuid.uuid4().hex}.txt' for _ in range(args.objects)]
+            seed._map_concurrently(
+                lambda document_id: seed._client.put_object(
+                    Bucket=args.bucket, Key=f'documents/{document_id}', Body=b'x' * args.object_size
+                ),
+                document_ids,
+            )
+
+            storage = create_storage(concurrency, args.latency_ms, index_dir)
+            batches = [
+                ('HEAD', lambda: storage.get_s3_files_metadata(f'documents/{d}' for d in document_ids), 'HeadObject'),
+                (
+                    'GET',
+                    lambda: storage._map_concurrently(storage.find_file_object_by_document_id, document_ids),
+                    'GetObject',
+                ),
+                ('DELETE', lambda: storage.remove_file_objects_by_document_ids(document_ids), 'DeleteObjects'),
+            ]
+            for label, batch, operation in batches:
+                started = time.perf_counter()
+                batch()
+                elapsed = time.perf_counter() - started
+                stats = storage.latency_stats.snapshot()[operation]
+                print(
+                    f'{concurrency:>11} {label:>10} {elapsed:>8.3f} {args.objects / elapsed:>9.1f} '
+                    f'{stats["p50_ms"]:>8.2f} {stats["p95_ms"]:>8.2f}'
+                )
+            storage.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint-url', help='S3-compatible endpoint; a local moto server is started if omitted.')
+    parser.add_argument('--port', type=int, default=5055, help='Port of the local moto server.')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--bucket', default=BUCKET)
+    parser.add_argument('--objects', type=int, default=200)
+    parser.add_argument('--object-size', type=int, default=1024)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Query latency of the full-text search index as it grows.
+
+Indexes synthetic documents of a few hundred words in batches and, at each size, times a mix of rare-word, common-word,
+multi-word and prefix queries.
+
+    python -m benchmarks.search_index --documents 1000 10000 100000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from app.storage.search_index import SearchIndex
+
+COMMON_WORDS = (
+    'invoice contract total amount due payment terms party agreement signature date services tax net gross '
+    'client supplier delivery order period notice clause liability confidential employee salary report'
+).split()
+QUERIES = ['invoice', 'liability clause', 'payment terms net', 'confid', 'zq7rare']
+
+
+def generate_document(generator: random.Random, words: int) -> str:
+    text = [generator.choice(COMMON_WORDS) for _ in range(words)]
+    text.extend(f'w{generator.randrange(50000)}' for _ in range(words // 10))
+    if generator.random() < 0.001:
+        text.append('zq7rare')
+    generator.shuffle(text)
+    return ' '.join(text)
+
+
+def time_queries(index: SearchIndex, repeat: int) -> dict:
+    latencies = {}
+    for query in QUERIES:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            index.search(query, limit=20)
+            samples.append(time.perf_counter() - started)
+        latencies[query] = samples
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--words', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    generator = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        index = SearchIndex(os.path.join(directory, 'search.sqlite3'))
+        indexed = 0
+        print(f'{"documents":>10} {"index s":>9} {"query":>20} {"p50 ms":>8} {"p95 ms":>8}')
+        for target in sorted(args.documents):
+            started = time.perf_counter()
+            while indexed < target:
+                batch = range(indexed, min(target, indexed + args.batch_size))
+                index.upsert_many(
+                    (f'{position}_doc.txt', f'doc-{position}.txt', generate_document(generator, args.words))
+                    for position in batch
+                )
+                indexed = batch.stop
+            index_seconds = time.perf_counter() - started
+
+            for query, samples in time_queries(index, args.repeat).items():
+                samples.sort()
+                p50 = statistics.median(samples) * 1000
+                p95 = samples[int(len(samples) * 0.95) - 1] * 1000
+                print(f'{target:>10} {index_seconds:>9.1f} {query:>20} {p50:>8.2f} {p95:>8.2f}')
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
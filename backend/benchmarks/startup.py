@@ -0,0 +1,78 @@
+"""Import time of the WSGI entry point, measured in fresh interpreters with ``python -X importtime``.
+
+Lambda pays this on every cold start, so the app avoids importing boto3, OpenAI, tiktoken and the document parsers
+until a request needs them. Prints the total and the modules with the largest cumulative import time.
+
+    python -m benchmarks.startup --repeat 5 --top 15
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Modules that only detection, storage or parsing need; none of them should load at startup.
+HEAVY_MODULES = ('boto3', 'openai', 'tiktoken', 'PyPDF2', 'docx', 'openpyxl')
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+def run_python(code: str, *options: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *options, '-c', code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+
+
+def measure_import_time(module: str = 'wsgi') -> Tuple[float, Dict[str, float]]:
+    """Returns the seconds ``module`` takes to import in a fresh interpreter, and the cumulative seconds of every
+    top-level package it imported."""
+    result = run_python(f'import {module}', '-X', 'importtime')
+    # Nested imports are printed, indented, before the module that triggered them.
+    nested = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)) / 1e6, len(match.group(3)), match.group(4)
+        if indent > 1:
+            nested.append((name, cumulative))
+        elif name != module:
+            nested = []
+        else:
+            packages = {}
+            for nested_name, nested_cumulative in nested:
+                package = nested_name.split('.')[0]
+                packages[package] = max(packages.get(package, 0.0), nested_cumulative)
+            return cumulative, packages
+    raise RuntimeError(f'No import time reported for {module}')
+
+
+def imported_heavy_modules(module: str = 'wsgi') -> List[str]:
+    """Returns the heavy modules that importing ``module`` loads in a fresh interpreter."""
+    code = f'import sys, {module}; print(" ".join(name for name in {HEAVY_MODULES!r} if name in sys.modules))'
+    return run_python(code).stdout.split()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='wsgi')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [measure_import_time(args.module) for _ in range(args.repeat)]
+    totals = [total for total, _ in runs]
+    print(f'import {args.module}: median {statistics.median(totals) * 1000:.1f} ms, min {min(totals) * 1000:.1f} ms')
+    print(f'heavy modules loaded: {", ".join(imported_heavy_modules(args.module)) or "none"}')
+
+    _, packages = min(runs, key=lambda run: run[0])
+    print(f'{"package":>30} {"ms":>8}')
+    for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[: args.top]:
+        print(f'{package:>30} {seconds * 1000:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Latency of truncating documents of growing size to the prompt token budget.
+
+Compares encoding the whole text and slicing the tokens, which is what prompt building used to do, with
+``truncate_to_tokens``, which only encodes a prefix (and a suffix for ``head_tail``) sized from a characters-per-token
+estimate. Needs the model's tiktoken encoding, downloaded or bundled (see ``warm-tiktoken-cache``).
+
+    python -m benchmarks.token_truncation --sizes-kb 10 100 1000 5000 --max-tokens 4000
+"""
+
+import argparse
+import random
+import time
+
+from app.detection.shared_resources import get_encoder
+from app.detection.token_truncation import truncate_to_tokens
+
+WORDS = 'invoice contract total amount due payment terms party agreement signature date services 2024 EUR'.split()
+
+
+def generate_text(size_kb: int) -> str:
+    generator = random.Random(size_kb)
+    words, length = [], 0
+    while length < size_kb * 1024:
+        word = generator.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def full_encoding(encoder, text: str, max_tokens: int) -> str:
+    return encoder.decode(encoder.encode(text)[:max_tokens])
+
+
+def measure(function, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes-kb', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--max-tokens', type=int, default=4000)
+    parser.add_argument('--model', default='gpt-4o-mini')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    encoder = get_encoder(args.model)
+    strategies = [
+        ('full encode', lambda text: full_encoding(encoder, text, args.max_tokens)),
+        ('head', lambda text: truncate_to_tokens(encoder, text, args.max_tokens)),
+        ('head_tail', lambda text: truncate_to_tokens(encoder, text, args.max_tokens, strategy='head_tail')),
+    ]
+
+    print(f'{"size KB":>8} {"strategy":>12} {"ms":>10}')
+    for size_kb in args.sizes_kb:
+        text = generate_text(size_kb)
+        for label, function in strategies:
+            elapsed = measure(lambda: function(text), args.repeat)
+            print(f'{size_kb:>8} {label:>12} {elapsed * 1000:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
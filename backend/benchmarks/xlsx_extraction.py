@@ -0,0 +1,94 @@
+"""Memory and latency of XLSX text extraction on generated workbooks.
+
+Compares the previous full-mode extraction (``openpyxl.load_workbook`` materializing every cell, then concatenating
+every row) with ``XLSXFileProcessor`` in read-only mode, both in full and stopped at a classification-sized budget.
+Peak memory is measured with tracemalloc, which also inflates the absolute timings; compare them relative to each other.
+
+    python -m benchmarks.xlsx_extraction --rows 20000 100000 --columns 10 --sheets 3
+"""
+
+import argparse
+import io
+import time
+import tracemalloc
+
+import openpyxl
+
+from app.processors.xlsx_processor import XLSXFileProcessor
+
+# Roughly what reaches the model: ~4,000 tokens at ~4 characters per token.
+BUDGET_CHARACTERS = 16000
+
+
+def generate_workbook(rows: int, columns: int, sheets: int) -> bytes:
+    # A regular (not write-only) workbook, so the sheets carry the <dimension> element Excel writes.
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for sheet in range(sheets):
+        worksheet = workbook.create_sheet(f'Sheet{sheet}')
+        for row in range(rows // sheets):
+            worksheet.append([f'value {row}-{column}' if column % 2 else row * column for column in range(columns)])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def full_mode_extraction(content: bytes) -> str:
+    workbook = openpyxl.load_workbook(io.BytesIO(content))
+    text = ''
+    for sheet in workbook.sheetnames:
+        worksheet = workbook[sheet]
+        for row in worksheet.iter_rows(values_only=True):
+            text += ' '.join([str(cell) for cell in row]) + '\n'
+    return text
+
+
+def read_only_extraction(content: bytes) -> str:
+    return XLSXFileProcessor(max_rows_per_sheet=None).extract_text(content)
+
+
+def budgeted_extraction(content: bytes) -> str:
+    chunks, collected = [], 0
+    for chunk in XLSXFileProcessor().iter_text(content):
+        chunks.append(chunk)
+        collected += len(chunk)
+        if collected >= BUDGET_CHARACTERS:
+            break
+    return ''.join(chunks)
+
+
+def measure(function, content: bytes):
+    tracemalloc.start()
+    started = time.perf_counter()
+    text = function(content)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, len(text)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--sheets', type=int, default=3)
+    parser.add_argument('--skip-full-mode', action='store_true', help='Skip the slow full-mode baseline.')
+    args = parser.parse_args()
+
+    strategies = [('read-only', read_only_extraction), ('read-only+budget', budgeted_extraction)]
+    if not args.skip_full_mode:
+        strategies.insert(0, ('full mode', full_mode_extraction))
+
+    print(f'{"rows":>8} {"file MB":>8} {"strategy":>17} {"seconds":>8} {"peak MB":>8} {"characters":>11}')
+    for rows in args.rows:
+        content = generate_workbook(rows, args.columns, args.sheets)
+        for label, function in strategies:
+            elapsed, peak, characters = measure(function, content)
+            print(
+                f'{rows:>8} {len(content) / 2**20:>8.1f} {label:>17} {elapsed:>8.3f} {peak / 2**20:>8.1f} '
+                f'{characters:>11}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import pytest
+
+from app.detection.classification_cache import (
+    InMemoryClassificationCache,
+    SQLiteClassificationCache,
+    build_cache_key,
+    hash_content,
+)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_cache(request, tmp_path):
+    def make(**kwargs):
+        if request.param == 'memory':
+            return InMemoryClassificationCache(**kwargs)
+        return SQLiteClassificationCache(str(tmp_path / 'cache.sqlite3'), **kwargs)
+
+    return make
+
+
+class TestClassificationCache:
+    def test_key_depends_on_content_model_and_prompt(self):
+        key = build_cache_key(hash_content(b'invoice'), 'gpt-4o-mini', '1', 'single', 3900, 'head')
+        assert key == build_cache_key(hash_content('invoice'), 'gpt-4o-mini', '1', 'single', 3900, 'head')
+        assert key != build_cache_key(hash_content(b'invoice!'), 'gpt-4o-mini', '1', 'single', 3900, 'head')
+        assert key != build_cache_key(hash_content(b'invoice'), 'gpt-4o', '1', 'single', 3900, 'head')
+        assert key != build_cache_key(hash_content(b'invoice'), 'gpt-4o-mini', '2', 'single', 3900, 'head')
+        assert key != build_cache_key(hash_content(b'invoice'), 'gpt-4o-mini', '1', 'packed', 3900, 'head')
+        assert key != build_cache_key(hash_content(b'invoice'), 'gpt-4o-mini', '1', 'single', 600, 'head')
+        assert key != build_cache_key(hash_content(b'invoice'), 'gpt-4o-mini', '1', 'single', 3900, 'head_tail')
+
+    def test_hits_and_misses_are_counted(self, make_cache):
+        cache = make_cache()
+        assert cache.get('a') is None
+        cache.set('a', 'invoice')
+        assert cache.get('a') == 'invoice'
+        assert cache.get('a') == 'invoice'
+
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['size']) == (2, 1, 1)
+        assert stats['hit_rate'] == pytest.approx(2 / 3, abs=1e-3)
+
+    def test_least_recently_used_entry_is_evicted(self, make_cache):
+        cache = make_cache(max_entries=2)
+        cache.set('a', 'invoice')
+        cache.set('b', 'contract')
+        assert cache.get('a') == 'invoice'
+        cache.set('c', 'report')
+
+        assert cache.get('b') is None
+        assert cache.get('a') == 'invoice'
+        assert cache.get('c') == 'report'
+        assert cache.stats()['evictions'] == 1
+
+    def test_expired_entries_are_ignored(self, make_cache, monkeypatch):
+        cache = make_cache(ttl_seconds=60)
+        now = 1_000_000.0
+        monkeypatch.setattr('app.detection.classification_cache.time.time', lambda: now)
+        cache.set('a', 'invoice')
+        now += 61
+        assert cache.get('a') is None
+        assert len(cache) == 0
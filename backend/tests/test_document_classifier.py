@@ -0,0 +1,165 @@
+import os
+import re
+
+import pytest
+
+from app.detection import shared_resources
+from app.detection.classification_cache import InMemoryClassificationCache, hash_content
+from app.detection.document_classifier import DocumentClassifier
+from app.detection.prompt_template import get_prompt_template
+from app.detection.token_truncation import HEAD_TAIL_SEPARATOR, truncate_to_tokens
+
+
+class CountingEncoder:
+    """Character-level stand-in for a tiktoken encoding that records what it was asked to encode."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, text):
+        self.encoded.append(text)
+        return [ord(character) for character in text]
+
+    def decode(self, tokens):
+        return ''.join(chr(token) for token in tokens)
+
+
+class WordEncoder:
+    """Word-level stand-in for a BPE encoding: a word and its leading whitespace form one token."""
+
+    PIECE = re.compile(r'\s*\S+|\s+')
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.pieces = []
+        self.encoded_characters = 0
+
+    def encode(self, text):
+        self.encoded_characters += len(text)
+        tokens = []
+        for piece in self.PIECE.findall(text):
+            if piece not in self.vocabulary:
+                self.vocabulary[piece] = len(self.pieces)
+                self.pieces.append(piece)
+            tokens.append(self.vocabulary[piece])
+        return tokens
+
+    def decode(self, tokens):
+        return ''.join(self.pieces[token] for token in tokens)
+
+
+@pytest.fixture
+def encoder(monkeypatch):
+    encoder = CountingEncoder()
+    monkeypatch.setitem(shared_resources._encoders, 'test-model', encoder)
+    return encoder
+
+
+class TestSharedResources:
+    def test_construction_loads_neither_tokenizer_nor_client(self, monkeypatch):
+        def unavailable(model):
+            raise AssertionError('tokenizer loaded eagerly')
+
+        monkeypatch.setattr(shared_resources.tiktoken, 'encoding_for_model', unavailable)
+        classifier = DocumentClassifier(api_key='key', model='unloaded-model')
+        assert classifier.model == 'unloaded-model'
+
+    def test_clients_are_shared(self):
+        first = DocumentClassifier(api_key='shared-key')
+        second = DocumentClassifier(api_key='shared-key')
+        assert first._client is second._client
+        assert shared_resources.get_chat_service() is shared_resources.get_chat_service()
+
+    def test_prompt_token_counts_are_computed_once_per_model(self, encoder):
+        first = DocumentClassifier(api_key='key', model='test-model')
+        second = DocumentClassifier(api_key='key', model='test-model')
+        first._build_prompt_messages('Invoice 42')
+        second._build_prompt_messages('Contract')
+        first._pack_documents(['Invoice 42', 'Contract'])
+
+        assert encoder.encoded.count(DocumentClassifier.SYSTEM_MESSAGE) == 1
+        assert encoder.encoded.count(DocumentClassifier.USER_MESSAGE_PREFIX) == 1
+        assert first.prompt_template is second.prompt_template
+        assert first.prompt_template is get_prompt_template(
+            'test-model',
+            DocumentClassifier.SYSTEM_MESSAGE,
+            DocumentClassifier.USER_MESSAGE_PREFIX,
+            first._build_packed_prompt_messages([''])[1]['content'],
+            DocumentClassifier.PACKED_DOCUMENT_HEADER_SAMPLE,
+        )
+
+    def test_bundled_tiktoken_cache_is_used_when_populated(self, monkeypatch, tmp_path):
+        monkeypatch.setenv('TIKTOKEN_CACHE_DIR', '')
+        (tmp_path / '.gitkeep').touch()
+        shared_resources.configure_tiktoken_cache(str(tmp_path))
+        assert os.environ['TIKTOKEN_CACHE_DIR'] == ''
+
+        (tmp_path / 'fb374d419588a4632f3f557e76b4b70aebbca790').write_bytes(b'')
+        shared_resources.configure_tiktoken_cache(str(tmp_path))
+        assert os.environ['TIKTOKEN_CACHE_DIR'] == str(tmp_path)
+
+
+class TestTokenTruncation:
+    TEXT = ' '.join(f'word{position % 97}x{position}' for position in range(200000))
+
+    def test_head_matches_full_encoding_but_encodes_only_a_prefix(self):
+        encoder = WordEncoder()
+        truncated, count = truncate_to_tokens(encoder, self.TEXT, 1000)
+
+        assert encoder.encoded_characters < len(self.TEXT) / 50
+        assert count == 1000
+        assert truncated == encoder.decode(encoder.encode(self.TEXT)[:1000])
+
+    def test_short_text_is_returned_whole(self):
+        assert truncate_to_tokens(WordEncoder(), 'Invoice 42', 1000) == ('Invoice 42', 2)
+
+    def test_head_tail_keeps_the_end(self):
+        encoder = WordEncoder()
+        truncated, count = truncate_to_tokens(encoder, self.TEXT, 1000, strategy='head_tail')
+
+        head, tail = truncated.split(HEAD_TAIL_SEPARATOR)
+        assert self.TEXT.startswith(head)
+        assert self.TEXT.endswith(tail)
+        assert count == 1000
+        assert len(encoder.encode(head)) + len(encoder.encode(tail)) <= 1000
+
+    def test_prefix_grows_when_tokens_are_longer_than_estimated(self):
+        text = ' '.join('x' * 40 for _ in range(10000))
+        truncated, count = truncate_to_tokens(WordEncoder(), text, 100)
+        assert (truncated, count) == (' '.join('x' * 40 for _ in range(100)), 100)
+
+    def test_unknown_strategy(self):
+        with pytest.raises(ValueError):
+            truncate_to_tokens(WordEncoder(), 'text', 10, strategy='middle')
+
+
+class TestClassificationCaching:
+    @pytest.fixture
+    def classifier(self, encoder, monkeypatch):
+        classifier = DocumentClassifier(api_key='key', model='test-model', cache=InMemoryClassificationCache())
+        requests = []
+
+        def request_completion(messages, max_tokens, prompt_tokens):
+            requests.append(messages)
+            return 'contract'
+
+        monkeypatch.setattr(classifier, '_request_completion', request_completion)
+        monkeypatch.setattr(classifier, '_classify_pack', lambda pack_and_tokens: ['invoice'] * len(pack_and_tokens[0]))
+        classifier.requests = requests
+        return classifier
+
+    def test_packed_results_are_not_reused_for_single_documents(self, classifier):
+        content_hash = hash_content(b'Invoice 42, total due 100 EUR')
+        assert classifier.detect_categories_from_texts([('Invoice 42', content_hash)]) == ['invoice']
+        assert classifier.detect_categories_from_texts([('Invoice 42', content_hash)]) == ['invoice']
+
+        assert classifier.detect_category_from_text('a.txt', 'Invoice 42', content_hash) == 'contract'
+        assert classifier.detect_category_from_text('a.txt', 'Invoice 42', content_hash) == 'contract'
+        assert len(classifier.requests) == 1
+
+    def test_truncation_strategy_is_part_of_the_key(self, classifier):
+        content_hash = hash_content(b'Invoice 42')
+        classifier.detect_category_from_text('a.txt', 'Invoice 42', content_hash)
+        classifier.truncation_strategy = 'head_tail'
+        classifier.detect_category_from_text('a.txt', 'Invoice 42', content_hash)
+        assert len(classifier.requests) == 2
@@ -1,4 +1,7 @@
+from types import SimpleNamespace
+
 from app import create_app
+from app.jobs.job_queue import SQLiteJobQueue
 
 
 class TestAppInitialization:
@@ -8,3 +11,19 @@ class TestAppInitialization:
         # Verify that at least one known blueprint is registered (e.g. "upload")
         blueprint_names = [bp.name for bp in app.blueprints.values()]
         assert 'upload' in blueprint_names
+
+    def test_pending_jobs_start_the_workers(self, monkeypatch, tmp_path):
+        db_path = str(tmp_path / 'jobs.sqlite3')
+        monkeypatch.setenv('JOB_QUEUE_PATH', db_path)
+        started = []
+        monkeypatch.setattr(
+            'app.routes.document_service', SimpleNamespace(jobs=SimpleNamespace(start=lambda: started.append(1)))
+        )
+
+        create_app()
+        assert started == []
+
+        # Left behind by a process that stopped before running it.
+        SQLiteJobQueue(db_path).enqueue('detect', {'document_id': 'a'})
+        create_app()
+        assert started == [1]
@@ -0,0 +1,151 @@
+import threading
+import time
+
+import pytest
+
+from app.jobs.job_queue import SQLiteJobQueue
+from app.jobs.worker_pool import JobWorkerPool
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'))
+
+
+def wait_for(queue, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in (SQLiteJobQueue.SUCCEEDED, SQLiteJobQueue.FAILED):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'Job {job_id} did not finish')
+
+
+class TestSQLiteJobQueue:
+    def test_jobs_are_claimed_in_order_once(self, queue):
+        first = queue.enqueue('detect', {'document_id': 'a'})
+        second = queue.enqueue('detect', {'document_id': 'b'})
+
+        assert queue.claim()['job_id'] == first
+        claimed = queue.claim()
+        assert claimed == {
+            'job_id': second,
+            'kind': 'detect',
+            'payload': {'document_id': 'b'},
+            'lease_token': claimed['lease_token'],
+        }
+        assert queue.claim() is None
+        assert queue.get(first)['status'] == SQLiteJobQueue.RUNNING
+
+    def test_finished_jobs_report_result_or_error(self, queue):
+        succeeded = queue.enqueue('detect', {})
+        failed = queue.enqueue('detect', {})
+        first, second = queue.claim(), queue.claim()
+        assert queue.complete(succeeded, first['lease_token'], {'detected_category': 'invoice'})
+        assert queue.fail(failed, second['lease_token'], 'Document not found')
+
+        assert queue.get(succeeded)['result'] == {'detected_category': 'invoice'}
+        assert queue.get(failed)['error'] == 'Document not found'
+        assert queue.stats() == {'queued': 0, 'running': 0, 'succeeded': 1, 'failed': 1}
+        assert queue.get('missing') is None
+
+    def test_jobs_with_an_expired_lease_are_claimed_again(self, tmp_path):
+        queue = SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'), lease_seconds=0.05, max_attempts=2)
+        job_id = queue.enqueue('detect', {})
+        queue.claim()
+        # Still leased: another process must not run it a second time.
+        assert queue.claim() is None
+
+        time.sleep(0.1)
+        assert queue.claim()['job_id'] == job_id
+        assert queue.get(job_id)['attempts'] == 2
+
+        time.sleep(0.1)
+        assert queue.claim() is None
+        assert queue.get(job_id)['status'] == SQLiteJobQueue.FAILED
+        assert queue.get(job_id)['error'] == 'Abandoned after 2 attempts'
+
+    def test_renewed_leases_are_kept(self, tmp_path):
+        queue = SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'), lease_seconds=0.2)
+        queue.enqueue('detect', {})
+        job = queue.claim()
+        for _ in range(3):
+            time.sleep(0.1)
+            queue.renew([(job['job_id'], job['lease_token'])])
+            assert queue.claim() is None
+
+    def test_outcomes_need_the_current_lease(self, tmp_path):
+        queue = SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'), lease_seconds=0.05)
+        job_id = queue.enqueue('detect', {})
+        stale = queue.claim()
+        time.sleep(0.1)
+        current = queue.claim()
+
+        # The first worker lost its lease: it can neither extend it nor overwrite the second worker's outcome.
+        queue.renew([(job_id, stale['lease_token'])])
+        assert not queue.complete(job_id, stale['lease_token'], {'detected_category': 'stale'})
+        assert queue.get(job_id)['status'] == SQLiteJobQueue.RUNNING
+        assert queue.complete(job_id, current['lease_token'], {'detected_category': 'invoice'})
+        assert not queue.fail(job_id, stale['lease_token'], 'Timed out')
+        assert queue.get(job_id)['result'] == {'detected_category': 'invoice'}
+
+    def test_finished_jobs_are_pruned(self, queue):
+        finished = queue.enqueue('detect', {})
+        queued = queue.enqueue('detect', {})
+        queue.complete(finished, queue.claim()['lease_token'], {})
+
+        assert queue.prune(older_than_seconds=60) == 0
+        time.sleep(0.01)
+        assert queue.prune(older_than_seconds=0) == 1
+        assert queue.get(finished) is None
+        assert queue.get(queued)['status'] == SQLiteJobQueue.QUEUED
+
+
+class TestJobWorkerPool:
+    def test_workers_drain_the_queue(self, queue):
+        def detect(payload):
+            if payload['document_id'] == 'missing':
+                raise Exception('Document not found')
+            return {'document_id': payload['document_id'], 'detected_category': 'invoice'}
+
+        pool = JobWorkerPool(queue, handlers={'detect': detect}, workers=3, poll_interval=0.05)
+        try:
+            job_ids = [pool.submit('detect', {'document_id': str(position)}) for position in range(10)]
+            missing = pool.submit('detect', {'document_id': 'missing'})
+
+            assert all(wait_for(queue, job_id)['status'] == SQLiteJobQueue.SUCCEEDED for job_id in job_ids)
+            assert wait_for(queue, missing)['error'] == 'Document not found'
+        finally:
+            pool.stop()
+
+    def test_starting_a_pool_leaves_jobs_of_other_pools_alone(self, queue):
+        queue.enqueue('detect', {'document_id': 'a'})
+        running = queue.claim()['job_id']
+        pool = JobWorkerPool(queue, handlers={'detect': lambda payload: {}}, poll_interval=0.05)
+        try:
+            other = pool.submit('detect', {'document_id': 'b'})
+            assert wait_for(queue, other)['status'] == SQLiteJobQueue.SUCCEEDED
+            assert queue.get(running)['status'] == SQLiteJobQueue.RUNNING
+            assert queue.get(running)['attempts'] == 1
+        finally:
+            pool.stop()
+
+    def test_leases_of_running_jobs_are_renewed(self, tmp_path):
+        queue = SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'), lease_seconds=0.15)
+        release = threading.Event()
+        pool = JobWorkerPool(queue, handlers={'detect': lambda payload: release.wait(5)}, poll_interval=0.05)
+        try:
+            job_id = pool.submit('detect', {})
+            time.sleep(0.5)
+            # The job outlived several leases without being claimed again.
+            assert queue.get(job_id)['attempts'] == 1
+            release.set()
+            assert wait_for(queue, job_id)['status'] == SQLiteJobQueue.SUCCEEDED
+        finally:
+            pool.stop()
+
+    def test_unknown_job_kind_is_rejected(self, queue):
+        pool = JobWorkerPool(queue, handlers={})
+        with pytest.raises(ValueError):
+            pool.submit('detect', {})
@@ -0,0 +1,299 @@
+import hashlib
+import io
+import os
+import time
+
+import pytest
+
+from app.factories.storage_factory import DocumentStorageFactory
+from app.storage.local_file_storage import LocalFileStorage, MappedDocument
+
+
+@pytest.fixture
+def storage(tmp_path):
+    local_storage = LocalFileStorage(str(tmp_path / 'storage'))
+    yield local_storage
+    local_storage.close()
+
+
+class TestLocalFileStorage:
+    def test_upload_find_and_list(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b'content'), 'a.txt', category='invoice')
+
+        document = storage.find_file_object_by_document_id(document_id)
+        assert document['Body'].read() == b'content'
+        assert document['Metadata']['original_name'] == 'a.txt'
+        assert storage.get_content_sha256(document_id) == hashlib.sha256(b'content').hexdigest()
+
+        documents = storage.retrieve_s3_objects()
+        assert [document['filename'] for document in documents] == [document_id]
+        assert documents[0]['metadata']['category'] == 'invoice'
+        assert documents[0]['size'] == 7
+        # Only the document is left in the storage directory, no temporary file.
+        assert os.listdir(os.path.join(storage._root, 'documents')) == [document_id]
+
+    def test_pages(self, storage):
+        document_ids = sorted(storage.upload_file(io.BytesIO(b'x'), f'{position}.txt') for position in range(5))
+        listed, cursor = [], None
+        while True:
+            page, cursor = storage.retrieve_s3_objects_page(limit=2, cursor=cursor)
+            listed.extend(document['filename'] for document in page)
+            if cursor is None:
+                break
+        assert listed == document_ids
+        with pytest.raises(ValueError):
+            storage.retrieve_s3_objects_page(limit=2, cursor='bogus')
+
+    def test_mapped_reads_seek_like_a_file(self, storage):
+        content = bytes(range(256)) * 10
+        document = storage.open_document(storage.upload_file(io.BytesIO(content), 'a.bin'))
+        assert isinstance(document, MappedDocument)
+        assert document.seek(-16, io.SEEK_END) == len(content) - 16
+        assert document.read() == content[-16:]
+        document.seek(100)
+        assert document.read(10) == content[100:110]
+        assert document.metadata['sha256'] == hashlib.sha256(content).hexdigest()
+        document.close()
+
+        empty = storage.open_document(storage.upload_file(io.BytesIO(b''), 'empty.txt'))
+        assert empty.read() == b''
+
+    def test_metadata_updates_and_queries(self, storage):
+        first = storage.upload_file(io.BytesIO(b'1'), 'invoice.pdf')
+        storage.upload_file(io.BytesIO(b'2'), 'contract.pdf')
+        storage.update_document_category(document_key=first, category='invoice')
+
+        documents, _ = storage.query_documents(category='invoice')
+        assert [document['filename'] for document in documents] == [first]
+        assert storage.find_file_object_by_document_id(first)['Metadata']['category'] == 'invoice'
+        with pytest.raises(ValueError):
+            storage.update_document_metadata(first, {'filesize': '1'})
+
+    def test_extracted_text_and_delete(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b'content'), 'a.txt')
+        storage.put_extracted_text(document_id, 'content', 'hash', max_tokens=10)
+        assert storage.get_extracted_text(document_id)['text'] == 'content'
+
+        assert storage.remove_file_objects_by_document_ids([document_id, 'missing.txt']) == {
+            document_id: True,
+            'missing.txt': True,
+        }
+        assert storage.retrieve_s3_objects() == []
+        assert storage.get_extracted_text(document_id) is None
+        with pytest.raises(FileNotFoundError):
+            storage.find_file_object_by_document_id(document_id)
+
+    def test_document_ids_cannot_escape_the_directory(self, storage):
+        for document_id in ('../index.sqlite3', 'a/../../b', '..'):
+            with pytest.raises(ValueError):
+                storage.open_document(document_id)
+            assert storage.remove_file_object_by_document_id(document_id) is False
+
+    def test_deduplication(self, storage, monkeypatch):
+        monkeypatch.setattr(storage._config, '_upload_deduplication', True)
+        document_id = storage.upload_file(io.BytesIO(b'contract'), 'contract.pdf')
+        assert storage.upload_file(io.BytesIO(b'contract'), 'copy.pdf') == document_id
+
+    def test_rebuild_metadata_index(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b'content'), 'a.txt')
+        storage._index.delete(f'documents/{document_id}')
+        assert storage.rebuild_metadata_index() == 1
+        assert storage.retrieve_s3_objects()[0]['metadata']['original_name'] == 'a.txt'
+
+    def test_presigned_uploads_are_not_supported(self, storage):
+        with pytest.raises(NotImplementedError):
+            storage.generate_presigned_upload('a.pdf', 10)
+
+
+def wait_for_job(service, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = service.get_job(job_id)
+        if job['status'] in ('succeeded', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'Job {job_id} did not finish')
+
+
+class TestDocumentServiceOnLocalStorage:
+    @pytest.fixture
+    def service(self, monkeypatch, tmp_path):
+        monkeypatch.setenv('STORAGE_BACKEND', 'local')
+        monkeypatch.setenv('LOCAL_STORAGE_PATH', str(tmp_path / 'storage'))
+        monkeypatch.setenv('JOB_QUEUE_PATH', str(tmp_path / 'jobs.sqlite3'))
+        monkeypatch.setenv('SEARCH_INDEX_PATH', str(tmp_path / 'search.sqlite3'))
+        from app.services.document_service import DocumentService
+
+        document_service = DocumentService()
+        yield document_service
+        document_service.jobs.stop()
+
+    def test_classified_uploads_are_stored_before_classification(self, service):
+        class FailingClassifier:
+            document_token_budget = 100
+            truncation_strategy = 'head'
+
+            def truncate_prompt_text(self, text):
+                return text
+
+            def detect_category_from_text(self, file_name, file_content, content_hash):
+                raise Exception('OpenAI is unavailable')
+
+        service._classifier = FailingClassifier()
+        upload = service.upload_and_classify_document(b'Invoice 42', 'invoice.txt')
+
+        job = wait_for_job(service, upload['job_id'])
+        assert job['status'] == 'failed'
+        assert 'content' not in service.jobs.queue._connection.execute('SELECT payload FROM jobs').fetchone()[0]
+        documents = list(service.list_documents()[0])
+        assert [document['filename'] for document in documents] == [upload['document_id']]
+        assert documents[0]['metadata']['category'] == 'none'
+
+    def test_classified_uploads_extract_their_text_once(self, service):
+        class HeadClassifier:
+            document_token_budget = 100
+            truncation_strategy = 'head'
+
+            def extract_prompt_text(self, file_name, content):
+                raise AssertionError('text extracted again')
+
+            def truncate_prompt_text(self, text):
+                return text[:10]
+
+            def detect_category_from_text(self, file_name, file_content, content_hash):
+                return 'invoice'
+
+        service._classifier = HeadClassifier()
+        upload = service.upload_and_classify_document(b'Invoice 42, total due 100 EUR', 'invoice.txt')
+
+        assert wait_for_job(service, upload['job_id'])['status'] == 'succeeded'
+        assert [tuple(row) for row in service.jobs.queue._connection.execute('SELECT kind FROM jobs')] == [
+            ('classify_upload',)
+        ]
+        results, _ = service.search_documents('total due')
+        assert [result['document_id'] for result in results] == [upload['document_id']]
+        assert service.storage.get_extracted_text(upload['document_id'])['text'] == 'Invoice 42'
+
+    def test_cached_categories_are_served_without_reading_the_document(self, service, monkeypatch):
+        content_hash = hashlib.sha256(b'Invoice 42').hexdigest()
+
+        class CachedClassifier:
+            def get_cached_category(self, cached_hash):
+                return 'invoice' if cached_hash == content_hash else None
+
+        service._classifier = CachedClassifier()
+        document_id = service.storage.upload_file(io.BytesIO(b'Invoice 42'), 'invoice.txt')
+
+        def unexpected_read(document_id):
+            raise AssertionError('document read')
+
+        monkeypatch.setattr(service.storage, 'open_document', unexpected_read)
+        monkeypatch.setattr(service.storage, 'get_extracted_text', unexpected_read)
+        assert service.detect_and_update_category(document_id) == {
+            'document_id': document_id,
+            'detected_category': 'invoice',
+        }
+        assert service.detect_and_update_categories([document_id])['succeeded'] == 1
+        assert list(service.list_documents()[0])[0]['metadata']['category'] == 'invoice'
+
+    def test_duplicate_uploads_keep_the_search_entry_of_the_original(self, service, monkeypatch):
+        monkeypatch.setattr(service.storage._config, '_upload_deduplication', True)
+        document_id = service.upload_document(io.BytesIO(b'Invoice 42'), 'invoice.txt')
+
+        assert service.upload_document(io.BytesIO(b'Invoice 42'), 'copy.txt') == document_id
+        upload = service.upload_documents([(io.BytesIO(b'Invoice 42'), 'other.txt')])
+        assert upload['results'] == [{'file_name': 'other.txt', 'document_id': document_id, 'duplicate': True}]
+
+        kinds = [row['kind'] for row in service.jobs.queue._connection.execute('SELECT kind FROM jobs')]
+        assert kinds == ['index']
+        deadline = time.monotonic() + 5
+        while service.search_index.count() < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        results, _ = service.search_documents('invoice')
+        assert [(result['document_id'], result['original_name']) for result in results] == [
+            (document_id, 'invoice.txt')
+        ]
+
+    def test_rebuild_search_index(self, service):
+        document_ids = [
+            service.storage.upload_file(io.BytesIO(text), name)
+            for text, name in ((b'Invoice total', 'invoice.txt'), (b'Signed contract', 'contract.txt'))
+        ]
+        service.search_index.upsert('deleted.txt', 'deleted.txt', 'Invoice total')
+
+        assert service.rebuild_search_index() == 2
+        assert sorted(service.search_index.document_ids()) == sorted(document_ids)
+        results, _ = service.search_documents('contract')
+        assert [result['document_id'] for result in results] == [document_ids[1]]
+
+    def test_packed_detection_uses_extracted_text_sidecars(self, service, monkeypatch):
+        class PackingClassifier:
+            document_token_budget = 100
+            truncation_strategy = 'head'
+            texts = []
+
+            def extract_prompt_text(self, file_name, content):
+                return content.read().decode('utf-8')
+
+            def detect_categories_from_texts(self, documents, max_workers):
+                self.texts.extend(documents)
+                return ['invoice'] * len(documents)
+
+        service._classifier = PackingClassifier()
+        document_id = service.storage.upload_file(io.BytesIO(b'Invoice 42'), 'invoice.txt')
+
+        assert service.detect_and_update_categories([document_id], pack=True)['succeeded'] == 1
+        assert service.storage.get_extracted_text(document_id)['text'] == 'Invoice 42'
+
+        def unexpected_read(document_id):
+            raise AssertionError('document read again')
+
+        monkeypatch.setattr(service.storage, 'open_document', unexpected_read)
+        assert service.detect_and_update_categories([document_id], pack=True)['succeeded'] == 1
+        assert service._classifier.texts == [('Invoice 42', hashlib.sha256(b'Invoice 42').hexdigest())] * 2
+
+    def test_upload_index_search_and_delete(self, service):
+        assert isinstance(service.storage, LocalFileStorage)
+        upload = service.upload_documents(
+            [(io.BytesIO(b'Invoice 42, total due 100 EUR'), 'invoice.txt'), (io.BytesIO(b'Notes'), 'notes.txt')]
+        )
+        assert upload['succeeded'] == 2
+        invoice_id = upload['results'][0]['document_id']
+
+        deadline = time.monotonic() + 5
+        while service.search_index.count() < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        results, _ = service.search_documents('total due')
+        assert [result['document_id'] for result in results] == [invoice_id]
+
+        service.storage.update_document_category(document_key=invoice_id, category='invoice')
+        documents, _ = service.query_documents(category='invoice')
+        assert [document['filename'] for document in documents] == [invoice_id]
+
+        assert service.delete_document(invoice_id) == {'message': 'Document deleted'}
+        assert service.search_documents('total due') == ([], None)
+        assert len(list(service.list_documents()[0])) == 1
+
+    def test_batch_delete_clears_the_search_index(self, service):
+        upload = service.upload_documents([(io.BytesIO(b'Invoice total'), f'{position}.txt') for position in range(3)])
+        document_ids = [result['document_id'] for result in upload['results']]
+        deadline = time.monotonic() + 5
+        while service.search_index.count() < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        deletion = service.delete_documents(document_ids[:2] + ['missing.txt', '../escape.txt'])
+        assert deletion['results'] == [
+            {'document_id': document_ids[0], 'deleted': True},
+            {'document_id': document_ids[1], 'deleted': True},
+            {'document_id': 'missing.txt', 'deleted': True},
+            {'document_id': '../escape.txt', 'error': 'Error while deleting document'},
+        ]
+        assert (deletion['succeeded'], deletion['failed']) == (3, 1)
+        results, _ = service.search_documents('invoice')
+        assert [result['document_id'] for result in results] == document_ids[2:]
+        assert [document['filename'] for document in service.list_documents()[0]] == document_ids[2:]
+
+
+def test_unknown_storage_backend():
+    with pytest.raises(ValueError):
+        DocumentStorageFactory.create_storage('ftp')
@@ -0,0 +1,185 @@
+import io
+import os
+import time
+
+import openpyxl
+import pytest
+from docx import Document
+
+from app.factories.processor_factory import DocumentProcessorFactory
+from app.processors import pdf_extraction_engine
+from app.processors.pdf_extraction_engine import PDFExtractionEngine, select_pages
+from app.processors.xlsx_processor import XLSXFileProcessor
+
+SYNTHETIC_DATA = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'deployment', 'synthetic_data'))
+
+
+def docx_bytes(paragraphs):
+    document = Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def xlsx_bytes(rows, extra_sheets=()):
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    for sheet_rows in extra_sheets:
+        worksheet = workbook.create_sheet()
+        for row in sheet_rows:
+            worksheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def sample_pdf():
+    with open(os.path.join(SYNTHETIC_DATA, 'annex-beechwoodmsbkyssamplecontract.pdf'), 'rb') as pdf:
+        return pdf.read()
+
+
+class TestProcessors:
+    @pytest.mark.parametrize(
+        'extension, content, expected',
+        [
+            ('txt', b'Invoice 42', 'Invoice 42'),
+            ('txt', 'Invoice 42', 'Invoice 42'),
+            ('docx', docx_bytes(['Invoice', 'Total: 10 EUR']), 'Invoice\nTotal: 10 EUR\n'),
+            ('xlsx', xlsx_bytes([['Item', 'Price'], ['Pen', 2]]), 'Item Price\nPen 2\n'),
+        ],
+    )
+    def test_extract_text(self, extension, content, expected):
+        processor = DocumentProcessorFactory.get_processor(extension)
+        assert processor.extract_text(content) == expected
+        assert ''.join(processor.iter_text(content)) == expected
+
+    def test_pdf_pages_are_yielded_lazily(self):
+        content = sample_pdf()
+        processor = DocumentProcessorFactory.get_processor('pdf')
+
+        first_page = next(processor.iter_text(content))
+        assert first_page.startswith('Page 1 of 3')
+        assert processor.extract_text(content).startswith(first_page)
+        assert len(processor.extract_text(content)) > len(first_page)
+
+    def test_large_text_is_chunked(self):
+        processor = DocumentProcessorFactory.get_processor('txt')
+        chunks = list(processor.iter_text('a' * (processor.CHUNK_SIZE * 2 + 1)))
+        assert [len(chunk) for chunk in chunks] == [processor.CHUNK_SIZE, processor.CHUNK_SIZE, 1]
+
+
+class TestXLSXFileProcessor:
+    def test_empty_cells_and_rows_are_skipped(self):
+        content = xlsx_bytes([['Item', None, 'Price'], [None, None, None], ['Pen', '', 2]])
+        assert XLSXFileProcessor().extract_text(content) == 'Item Price\nPen 2\n'
+
+    def test_rows_are_sampled_across_sheets_and_capped(self):
+        content = xlsx_bytes(
+            [[f'a{row}'] for row in range(5)],
+            extra_sheets=[[[f'b{row}'] for row in range(3)], [[f'c{row}'] for row in range(5)]],
+        )
+        processor = XLSXFileProcessor(max_rows_per_sheet=4, rows_per_block=2)
+        assert processor.extract_text(content).split() == [
+            'a0', 'a1', 'b0', 'b1', 'c0', 'c1', 'a2', 'a3', 'b2', 'c2', 'c3',
+        ]  # fmt: skip
+
+
+class TestPDFExtractionEngine:
+    @pytest.mark.parametrize(
+        'first_pages, last_pages, expected',
+        [
+            (None, None, [0, 1, 2, 3, 4]),
+            (2, None, [0, 1]),
+            (None, 1, [4]),
+            (2, 1, [0, 1, 4]),
+            (3, 3, [0, 1, 2, 3, 4]),
+            (10, 0, [0, 1, 2, 3, 4]),
+        ],
+    )
+    def test_select_pages(self, first_pages, last_pages, expected):
+        assert select_pages(5, first_pages, last_pages) == expected
+
+    def test_process_pool_matches_sequential_extraction(self):
+        content = sample_pdf()
+        sequential = PDFExtractionEngine().extract_text(content)
+        engine = PDFExtractionEngine(max_workers=2, pages_per_task=1)
+        try:
+            assert engine.extract_text(content) == sequential
+        finally:
+            engine.close()
+
+    def test_page_selection(self):
+        content = sample_pdf()
+        pages = list(PDFExtractionEngine().iter_pages(content))
+        assert list(PDFExtractionEngine(first_pages=1, last_pages=1).iter_pages(content)) == [pages[0], pages[-1]]
+
+    def test_timed_out_pages_come_back_empty(self):
+        content = sample_pdf()
+        engine = PDFExtractionEngine(max_workers=2, page_timeout=1e-6)
+        try:
+            assert set(engine.iter_pages(content)) == {''}
+            # Whether or not the pool had to be replaced, later extractions work.
+            engine.page_timeout = 10.0
+            assert engine.extract_text(content) == PDFExtractionEngine().extract_text(content)
+        finally:
+            engine.close()
+
+    def test_resetting_the_pool_kills_hung_workers(self):
+        engine = PDFExtractionEngine(max_workers=2)
+        pool = engine._get_pool()
+        futures = [pool.submit(time.sleep, 60) for _ in range(2)]
+        while not all(future.running() for future in futures):
+            time.sleep(0.01)
+        processes = list(pool._processes.values())
+        engine._reset_pool()
+        for process in processes:
+            process.join(timeout=5)
+        assert not any(process.is_alive() for process in processes)
+        engine.close()
+
+    def test_page_time_limit_counts_from_the_start_of_the_page(self):
+        assert pdf_extraction_engine.extract_page_range(sample_pdf(), [0, 1], page_timeout=1e-6) == ['', '']
+        assert all(pdf_extraction_engine.extract_page_range(sample_pdf(), [0, 1], page_timeout=10.0))
+
+    def test_opening_a_pdf_is_time_limited(self, monkeypatch):
+        def hanging_reader(stream):
+            time.sleep(5)
+
+        monkeypatch.setattr(pdf_extraction_engine, 'PdfReader', hanging_reader)
+        monkeypatch.setattr(pdf_extraction_engine, '_worker_reader', (None, None))
+        started = time.monotonic()
+        assert pdf_extraction_engine.extract_page_range(b'%PDF', [0, 1], page_timeout=0.1) == ['', '']
+        assert time.monotonic() - started < 1
+
+    def test_ranges_of_a_document_parse_it_once(self, monkeypatch):
+        content = sample_pdf()
+        pages = list(PDFExtractionEngine().iter_pages(content))
+        readers = []
+        pdf_reader = pdf_extraction_engine.PdfReader
+        monkeypatch.setattr(pdf_extraction_engine, 'PdfReader', lambda stream: readers.append(1) or pdf_reader(stream))
+        monkeypatch.setattr(pdf_extraction_engine, '_worker_reader', (None, None))
+
+        first = pdf_extraction_engine.extract_page_range(content, [0], document_key='document')
+        second = pdf_extraction_engine.extract_page_range(content, [1], document_key='document')
+        assert first + second == pages[:2]
+        assert len(readers) == 1
+
+    def test_workers_are_not_forked_from_the_server(self):
+        engine = PDFExtractionEngine(max_workers=2)
+        try:
+            assert engine._get_pool()._mp_context.get_start_method() in ('forkserver', 'spawn')
+        finally:
+            engine.close()
+
+    def test_falls_back_to_sequential_without_process_pools(self, monkeypatch):
+        def unavailable(*args, **kwargs):
+            raise OSError('no /dev/shm')
+
+        monkeypatch.setattr(pdf_extraction_engine, 'ProcessPoolExecutor', unavailable)
+        content = sample_pdf()
+        engine = PDFExtractionEngine(max_workers=4)
+        assert engine.extract_text(content) == PDFExtractionEngine().extract_text(content)
+        assert not engine.is_parallel
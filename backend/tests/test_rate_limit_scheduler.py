@@ -0,0 +1,103 @@
+import types
+
+import pytest
+from openai import APIConnectionError, APITimeoutError, BadRequestError, InternalServerError, RateLimitError
+
+from app.detection.rate_limit_scheduler import RateLimitScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def rate_limit_error(headers=None):
+    response = types.SimpleNamespace(status_code=429, headers=headers or {}, request=None)
+    return RateLimitError('Rate limit reached', response=response, body=None)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class TestRateLimitScheduler:
+    def test_requests_are_paced_to_the_requests_per_minute_budget(self, clock):
+        scheduler = RateLimitScheduler(requests_per_minute=60, tokens_per_minute=100000, clock=clock, sleep=clock.sleep)
+        for _ in range(60):
+            assert scheduler.acquire(10) == 0
+
+        # The bucket is empty: the next call waits for one request to refill (one second at 60 RPM).
+        assert scheduler.acquire(10) == pytest.approx(1.0)
+        assert scheduler.metrics()['wait']['count'] == 61
+
+    def test_calls_are_paced_to_the_tokens_per_minute_budget(self, clock):
+        scheduler = RateLimitScheduler(requests_per_minute=1000, tokens_per_minute=6000, clock=clock, sleep=clock.sleep)
+        scheduler.acquire(6000)
+        assert scheduler.acquire(3000) == pytest.approx(30.0)
+
+    def test_rate_limited_calls_honor_retry_after(self, clock):
+        scheduler = RateLimitScheduler(clock=clock, sleep=clock.sleep)
+        responses = [rate_limit_error({'retry-after': '7'}), rate_limit_error({'retry-after-ms': '250'}), 'invoice']
+
+        def call():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        assert scheduler.run(call, tokens=100) == 'invoice'
+        assert clock.sleeps == [7.0, 0.25]
+        metrics = scheduler.metrics()
+        assert (metrics['rate_limited'], metrics['retries'], metrics['queue_depth']) == (2, 2, 0)
+
+    def test_backoff_is_jittered_exponential_and_bounded(self, clock, monkeypatch):
+        monkeypatch.setattr('app.detection.rate_limit_scheduler.random.uniform', lambda low, high: high)
+        scheduler = RateLimitScheduler(max_retries=3, base_delay=1.0, max_delay=3.0, clock=clock, sleep=clock.sleep)
+
+        def call():
+            raise rate_limit_error()
+
+        with pytest.raises(RateLimitError):
+            scheduler.run(call, tokens=100)
+        assert clock.sleeps == [1.0, 2.0, 3.0]
+        assert scheduler.metrics()['rate_limited'] == 4
+
+    def test_transient_errors_are_retried(self, clock):
+        scheduler = RateLimitScheduler(clock=clock, sleep=clock.sleep)
+        response = types.SimpleNamespace(status_code=502, headers={}, request=None)
+        responses = [
+            APIConnectionError(request=None),
+            APITimeoutError(request=None),
+            InternalServerError('Bad gateway', response=response, body=None),
+            'invoice',
+        ]
+
+        def call():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        assert scheduler.run(call, tokens=100) == 'invoice'
+        metrics = scheduler.metrics()
+        assert (metrics['transient_errors'], metrics['rate_limited'], metrics['retries']) == (3, 0, 3)
+
+    def test_client_errors_are_not_retried(self, clock):
+        scheduler = RateLimitScheduler(clock=clock, sleep=clock.sleep)
+        response = types.SimpleNamespace(status_code=400, headers={}, request=None)
+
+        def call():
+            raise BadRequestError('Bad request', response=response, body=None)
+
+        with pytest.raises(BadRequestError):
+            scheduler.run(call, tokens=100)
+        assert clock.sleeps == []
@@ -1,8 +1,11 @@
 import io
+import tempfile
+import zipfile
 
 import pytest
 
 from app import create_app
+from app.utils.document_utils import ArchiveTooLargeError, extract_zip_documents
 
 
 @pytest.fixture
@@ -56,6 +59,38 @@ class TestUploadDocument:
         assert data_response.get('message') == 'File uploaded successfully'
         assert data_response.get('document') == dummy_document
 
+    def test_upload_and_classify(self, client, monkeypatch):
+        monkeypatch.setattr('app.routes.allowed_file', lambda filename: True)
+        monkeypatch.setattr('app.routes.is_file_size_exceeded', lambda file, filename: False)
+        calls = []
+
+        def upload_and_classify_document(content, file_name):
+            calls.append((content, file_name))
+            return {'document_id': '123_test.pdf', 'job_id': 'job-1'}
+
+        monkeypatch.setattr('app.routes.document_service.upload_and_classify_document', upload_and_classify_document)
+
+        data = {'file': (io.BytesIO(b'dummy data'), 'test.pdf'), 'classify': 'true'}
+        response = client.post('/upload', content_type='multipart/form-data', data=data)
+        assert response.status_code == 202
+        data_response = response.get_json()
+        assert data_response.get('document') == '123_test.pdf'
+        assert data_response.get('job_id') == 'job-1'
+        assert calls == [(b'dummy data', 'test.pdf')]
+
+    def test_upload_and_classify_duplicate(self, client, monkeypatch):
+        monkeypatch.setattr('app.routes.allowed_file', lambda filename: True)
+        monkeypatch.setattr('app.routes.is_file_size_exceeded', lambda file, filename: False)
+        monkeypatch.setattr(
+            'app.routes.document_service.upload_and_classify_document',
+            lambda content, file_name: {'document_id': '123_test.pdf', 'job_id': None},
+        )
+
+        data = {'file': (io.BytesIO(b'dummy data'), 'test.pdf'), 'classify': 'true'}
+        response = client.post('/upload', content_type='multipart/form-data', data=data)
+        assert response.status_code == 200
+        assert response.get_json() == {'message': 'File already uploaded', 'document': '123_test.pdf'}
+
     def test_upload_exception(self, client, monkeypatch):
         # Simulate an exception during upload_document.
         monkeypatch.setattr('app.routes.allowed_file', lambda filename: True)
@@ -73,21 +108,224 @@ class TestUploadDocument:
         assert data_response.get('error') == 'Internal server error'
 
 
+class TestUploadDocuments:
+    @pytest.fixture
+    def uploads(self, monkeypatch):
+        uploads = []
+
+        def upload_documents(files):
+            files = list(files)
+            uploads.append([(file_name, file.read()) for file, file_name in files])
+            return {
+                'results': [{'file_name': file_name, 'document_id': f'id_{file_name}'} for _, file_name in files],
+                'timings': {'total_seconds': 0.1, 'files_per_second': 10.0, 'megabytes_per_second': 1.0},
+            }
+
+        monkeypatch.setattr('app.routes.document_service.upload_documents', upload_documents)
+        return uploads
+
+    def test_upload_files_and_archive(self, client, uploads):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('folder/b.txt', b'second')
+            zip_file.writestr('__MACOSX/folder/._b.txt', b'resource fork')
+            zip_file.writestr('README', b'no extension')
+        archive.seek(0)
+        data = {'files': [(io.BytesIO(b'first'), 'a.pdf')], 'archive': (archive, 'documents.zip')}
+
+        response = client.post('/upload/batch', content_type='multipart/form-data', data=data)
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body['results'] == [
+            {'file_name': 'a.pdf', 'document_id': 'id_a.pdf'},
+            {'file_name': 'b.txt', 'document_id': 'id_b.txt'},
+            {'file_name': 'README', 'error': 'Selected document not allowed'},
+        ]
+        assert (body['succeeded'], body['failed']) == (2, 1)
+        assert body['timings']['files_per_second'] == 10.0
+        assert uploads == [[('a.pdf', b'first'), ('b.txt', b'second')]]
+
+    def test_oversized_files_are_rejected(self, client, uploads, monkeypatch):
+        monkeypatch.setattr('app.routes.is_file_size_exceeded', lambda file, filename: filename == 'big.pdf')
+        data = {'files': [(io.BytesIO(b'big'), 'big.pdf'), (io.BytesIO(b'small'), 'small.pdf')]}
+        response = client.post('/upload/batch', content_type='multipart/form-data', data=data)
+        assert [result.get('error') for result in response.get_json()['results']] == [
+            'Selected document is very heavy: Max 2MB',
+            None,
+        ]
+
+    def test_no_files(self, client):
+        response = client.post('/upload/batch', content_type='multipart/form-data', data={})
+        assert response.status_code == 400
+
+    @staticmethod
+    def zip_archive(*entries):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for name, content in entries:
+                zip_file.writestr(name, content)
+        archive.seek(0)
+        return archive
+
+    def test_archives_are_checked_before_reading(self, client, uploads, monkeypatch):
+        archive = self.zip_archive(('b.txt', b'b'), ('c.txt', b'c'))
+        bomb = self.zip_archive(('bomb.txt', b'0' * 2**21))
+
+        def unexpected_open(*args, **kwargs):
+            raise AssertionError('archive entry read')
+
+        monkeypatch.setattr(zipfile.ZipFile, 'open', unexpected_open)
+        monkeypatch.setattr('app.routes.MAX_UPLOAD_BATCH_SIZE', 2)
+        data = {'files': [(io.BytesIO(b'first'), 'a.pdf')], 'archive': (archive, 'documents.zip')}
+        response = client.post('/upload/batch', content_type='multipart/form-data', data=data)
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'At most 1 more documents can be uploaded in this request'}
+        assert uploads == []
+
+        monkeypatch.setattr('app.utils.document_utils.MAX_FILE_SIZE_BYTES', 10**9)
+        with pytest.raises(ArchiveTooLargeError, match='may not exceed 1MB in total'):
+            extract_zip_documents(bomb, max_documents=10, max_total_bytes=2**20)
+
+    def test_archive_entries_are_spooled(self):
+        archive = self.zip_archive(('a.txt', b'first'), ('b.txt', b'x' * 3 * 2**20))
+        documents = extract_zip_documents(archive, max_documents=10)
+        # Entries over the upload limit are reported without being inflated.
+        assert [name for name, _ in documents] == ['a.txt', 'b.txt']
+        assert isinstance(documents[0][1], tempfile.SpooledTemporaryFile)
+        assert documents[0][1].read() == b'first'
+        assert documents[1][1] is None
+
+    def test_invalid_archive(self, client):
+        data = {'archive': (io.BytesIO(b'not a zip'), 'documents.zip')}
+        response = client.post('/upload/batch', content_type='multipart/form-data', data=data)
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'archive is not a valid zip file'}
+
+
+class TestPresignedUpload:
+    def test_presigned_upload_success(self, client, monkeypatch):
+        presigned_upload = {'document_id': 'abc_test.pdf', 'url': 'https://bucket.s3.amazonaws.com/', 'fields': {}}
+        monkeypatch.setattr(
+            'app.routes.document_service.create_presigned_upload', lambda file_name, size: presigned_upload
+        )
+        response = client.post('/upload/presigned', json={'file_name': 'test.pdf', 'size': 10 * 1024 * 1024})
+        assert response.status_code == 200
+        assert response.get_json() == presigned_upload
+
+    @pytest.mark.parametrize(
+        'payload', [{'size': 10}, {'file_name': 'test.pdf'}, {'file_name': 'test.pdf', 'size': 0}, None]
+    )
+    def test_presigned_upload_invalid_request(self, client, payload):
+        response = client.post('/upload/presigned', json=payload)
+        assert response.status_code == 400
+
+    def test_presigned_upload_too_large(self, client, monkeypatch):
+        def create_presigned_upload(file_name, size):
+            raise ValueError('Documents are limited to 100MB')
+
+        monkeypatch.setattr('app.routes.document_service.create_presigned_upload', create_presigned_upload)
+        response = client.post('/upload/presigned', json={'file_name': 'test.pdf', 'size': 10**12})
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'Documents are limited to 100MB'}
+
+
 # ---------------------------
 # Tests for the /documents endpoint
 # ---------------------------
 class TestListDocuments:
     def test_list_documents_success(self, client, monkeypatch):
         dummy_list = [{'id': '123', 'filename': 'test.pdf'}]
-        monkeypatch.setattr('app.routes.document_service.list_documents', lambda: dummy_list)
+        monkeypatch.setattr('app.routes.document_service.list_documents', lambda **kwargs: (iter(dummy_list), None))
         response = client.get('/documents')
         assert response.status_code == 200
         assert response.get_json() == dummy_list
+        assert 'X-Next-Cursor' not in response.headers
+
+    def test_list_documents_page(self, client, monkeypatch):
+        calls = []
+
+        def list_documents(limit, cursor):
+            calls.append((limit, cursor))
+            return iter([{'id': '123'}, {'id': '456'}]), 'next-token'
+
+        monkeypatch.setattr('app.routes.document_service.list_documents', list_documents)
+        response = client.get('/documents?limit=2&cursor=token')
+        assert response.status_code == 200
+        assert response.get_json() == [{'id': '123'}, {'id': '456'}]
+        assert response.headers['X-Next-Cursor'] == 'next-token'
+        assert calls == [(2, 'token')]
+
+    def test_list_documents_invalid_limit(self, client):
+        for limit in ('0', '1001', 'abc'):
+            response = client.get(f'/documents?limit={limit}')
+            assert response.status_code == 400
+
+    def test_list_documents_invalid_cursor(self, client, monkeypatch):
+        def raise_value_error(**kwargs):
+            raise ValueError('Invalid cursor')
+
+        monkeypatch.setattr('app.routes.document_service.list_documents', raise_value_error)
+        response = client.get('/documents?limit=10&cursor=bogus')
+        assert response.status_code == 400
+        assert response.get_json().get('error') == 'Invalid cursor'
+
+    def test_list_documents_filtered(self, client, monkeypatch):
+        calls = []
+
+        def query_documents(**kwargs):
+            calls.append(kwargs)
+            return iter([{'id': '123'}]), '1'
+
+        monkeypatch.setattr('app.routes.document_service.query_documents', query_documents)
+        response = client.get(
+            '/documents?category=invoice&uploaded_after=2024-05-01T02:00:00%2B02:00&sort=-upload_time&limit=1'
+        )
+        assert response.status_code == 200
+        assert response.get_json() == [{'id': '123'}]
+        assert response.headers['X-Next-Cursor'] == '1'
+        assert calls == [
+            {
+                'limit': 1,
+                'cursor': None,
+                'category': 'invoice',
+                'uploaded_after': '2024-05-01T00:00:00',
+                'sort': 'upload_time',
+                'descending': True,
+            }
+        ]
+
+    def test_list_documents_invalid_filters(self, client):
+        for query in ('sort=-color', 'uploaded_after=last-week', 'uploaded_before=2024-13-01'):
+            response = client.get(f'/documents?{query}')
+            assert response.status_code == 400
+
+    def test_first_page_errors_are_reported_before_streaming(self, client, monkeypatch):
+        def failing_pages():
+            raise Exception('S3 error')
+            yield
+
+        monkeypatch.setattr('app.routes.document_service.list_documents', lambda **kwargs: (failing_pages(), None))
+        response = client.get('/documents')
+        assert response.status_code == 500
+        assert response.get_json().get('error') == 'Internal server error'
+
+    def test_later_page_errors_truncate_the_array(self, client, monkeypatch):
+        def failing_pages():
+            yield {'id': '123'}
+            raise Exception('S3 error')
+
+        monkeypatch.setattr('app.routes.document_service.list_documents', lambda **kwargs: (failing_pages(), None))
+        response = client.get('/documents')
+        assert response.status_code == 200
+        # Left unclosed, so no client can mistake it for the complete listing.
+        assert response.get_data(as_text=True) == '[{"id": "123"}'
+        assert response.get_json(silent=True) is None
 
     def test_list_documents_exception(self, client, monkeypatch):
         # Force list_documents to throw an exception.
         monkeypatch.setattr(
-            'app.routes.document_service.list_documents', lambda: (_ for _ in ()).throw(Exception('List error'))
+            'app.routes.document_service.list_documents',
+            lambda **kwargs: (_ for _ in ()).throw(Exception('List error')),
         )
         response = client.get('/documents')
         assert response.status_code == 500
@@ -145,6 +383,64 @@ class TestDetectDocumentCategory:
         data_response = response.get_json()
         assert data_response.get('error') == 'Internal server error'
 
+    def test_detect_async(self, client, monkeypatch):
+        monkeypatch.setattr('app.routes.document_service.enqueue_detection', lambda document_id: 'job-1')
+        response = client.post('/detect', json={'document_id': '123', 'async': True})
+        assert response.status_code == 202
+        assert response.get_json() == {'document_id': '123', 'job_id': 'job-1', 'status': 'queued'}
+
+
+# ---------------------------
+# Tests for the /detect/batch endpoint
+# ---------------------------
+class TestDetectDocumentCategories:
+    def test_detect_batch_missing_document_ids(self, client):
+        for payload in ({}, {'document_ids': []}, {'document_ids': 'abc'}):
+            response = client.post('/detect/batch', json=payload)
+            assert response.status_code == 400
+            assert response.get_json().get('error') == 'Missing document_ids'
+
+    def test_detect_batch_invalid_document_ids(self, client):
+        response = client.post('/detect/batch', json={'document_ids': ['123', '']})
+        assert response.status_code == 400
+
+    def test_detect_batch_too_many_documents(self, client):
+        response = client.post('/detect/batch', json={'document_ids': [str(i) for i in range(1001)]})
+        assert response.status_code == 400
+
+    def test_detect_batch_success(self, client, monkeypatch):
+        result = {
+            'results': [
+                {'document_id': '123', 'detected_category': 'invoice'},
+                {'document_id': '456', 'error': 'Document not found'},
+            ],
+            'succeeded': 1,
+            'failed': 1,
+            'timings': {'total_seconds': 0.5},
+        }
+        calls = []
+
+        def detect_and_update_categories(document_ids, pack):
+            calls.append((document_ids, pack))
+            return result
+
+        monkeypatch.setattr('app.routes.document_service.detect_and_update_categories', detect_and_update_categories)
+        response = client.post('/detect/batch', json={'document_ids': ['123', '456']})
+        assert response.status_code == 200
+        assert response.get_json() == result
+
+        client.post('/detect/batch', json={'document_ids': ['123'], 'pack': True})
+        assert calls == [(['123', '456'], False), (['123'], True)]
+
+    def test_detect_batch_exception(self, client, monkeypatch):
+        def raise_exception(document_ids, pack):
+            raise Exception('Detect error')
+
+        monkeypatch.setattr('app.routes.document_service.detect_and_update_categories', raise_exception)
+        response = client.post('/detect/batch', json={'document_ids': ['123']})
+        assert response.status_code == 500
+        assert response.get_json().get('error') == 'Internal server error'
+
 
 # ---------------------------
 # Tests for the /delete/<document_id> endpoint
@@ -184,3 +480,108 @@ class TestDeleteDocument:
         assert response.status_code == 500
         data_response = response.get_json()
         assert data_response.get('error') == 'Internal server error'
+
+
+# ---------------------------
+# Tests for the /delete/batch endpoint
+# ---------------------------
+class TestDeleteDocuments:
+    def test_delete_batch_invalid_document_ids(self, client):
+        for payload in ({}, {'document_ids': []}, {'document_ids': ['123', '']}):
+            response = client.post('/delete/batch', json=payload)
+            assert response.status_code == 400
+
+    def test_delete_batch_too_many_documents(self, client):
+        response = client.post('/delete/batch', json={'document_ids': [str(i) for i in range(10001)]})
+        assert response.status_code == 400
+
+    def test_delete_batch_success(self, client, monkeypatch):
+        result = {
+            'results': [{'document_id': '123', 'deleted': True}, {'document_id': '456', 'error': 'Access Denied'}],
+            'succeeded': 1,
+            'failed': 1,
+            'timings': {'total_seconds': 0.5},
+        }
+        calls = []
+
+        def delete_documents(document_ids):
+            calls.append(document_ids)
+            return result
+
+        monkeypatch.setattr('app.routes.document_service.delete_documents', delete_documents)
+        response = client.post('/delete/batch', json={'document_ids': ['123', '456']})
+        assert response.status_code == 200
+        assert response.get_json() == result
+        assert calls == [['123', '456']]
+
+    def test_delete_batch_exception(self, client, monkeypatch):
+        def raise_exception(document_ids):
+            raise Exception('Delete error')
+
+        monkeypatch.setattr('app.routes.document_service.delete_documents', raise_exception)
+        response = client.post('/delete/batch', json={'document_ids': ['123']})
+        assert response.status_code == 500
+
+
+# ---------------------------
+# Tests for the /metrics endpoint
+# ---------------------------
+class TestMetrics:
+    def test_metrics_success(self, client, monkeypatch):
+        metrics = {'classification_cache': {'hits': 3, 'misses': 1}, 's3_latency': {}}
+        monkeypatch.setattr('app.routes.document_service.get_metrics', lambda: metrics)
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.get_json() == metrics
+
+
+# ---------------------------
+# Tests for the /jobs/<job_id> endpoint
+# ---------------------------
+class TestGetJob:
+    def test_get_job_not_found(self, client, monkeypatch):
+        monkeypatch.setattr('app.routes.document_service.get_job', lambda job_id: None)
+        response = client.get('/jobs/unknown')
+        assert response.status_code == 404
+        assert response.get_json().get('error') == 'Job not found'
+
+    def test_get_job_success(self, client, monkeypatch):
+        job = {'job_id': 'job-1', 'status': 'succeeded', 'result': {'detected_category': 'invoice'}}
+        monkeypatch.setattr('app.routes.document_service.get_job', lambda job_id: job)
+        response = client.get('/jobs/job-1')
+        assert response.status_code == 200
+        assert response.get_json() == job
+
+
+# ---------------------------
+# Tests for the /search endpoint
+# ---------------------------
+class TestSearchDocuments:
+    def test_search_success(self, client, monkeypatch):
+        calls = []
+        results = [{'document_id': '1_invoice.pdf', 'original_name': 'invoice.pdf', 'score': 1.5, 'snippet': '[x]'}]
+
+        def search_documents(query, limit, cursor):
+            calls.append((query, limit, cursor))
+            return results, '5'
+
+        monkeypatch.setattr('app.routes.document_service.search_documents', search_documents)
+        response = client.get('/search?q=invoice+due&limit=5')
+        assert response.status_code == 200
+        assert response.get_json() == results
+        assert response.headers['X-Next-Cursor'] == '5'
+        assert calls == [('invoice due', 5, None)]
+
+    def test_search_invalid_limit(self, client):
+        for limit in ('0', '101', 'abc'):
+            response = client.get(f'/search?q=invoice&limit={limit}')
+            assert response.status_code == 400
+
+    def test_search_missing_query(self, client, monkeypatch):
+        def raise_value_error(query, limit, cursor):
+            raise ValueError('Missing search query')
+
+        monkeypatch.setattr('app.routes.document_service.search_documents', raise_value_error)
+        response = client.get('/search')
+        assert response.status_code == 400
+        assert response.get_json().get('error') == 'Missing search query'
@@ -0,0 +1,472 @@
+import hashlib
+import io
+import os
+import threading
+
+import boto3
+import pytest
+import requests
+from moto import mock_aws
+
+from app.factories.processor_factory import DocumentProcessorFactory
+from app.storage.s3_file_storage import S3FileStorage
+
+BUCKET = 'test-bucket'
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    monkeypatch.setenv('MY_AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('MY_AWS_STORAGE_BUCKET_NAME', BUCKET)
+    monkeypatch.setenv('METADATA_INDEX_PATH', str(tmp_path / 'index.sqlite3'))
+    with mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+        yield S3FileStorage()
+
+
+def record_calls(storage):
+    calls = []
+    storage._client.meta.events.register('before-call.s3', lambda model, **kwargs: calls.append(model.name))
+    return calls
+
+
+def count_calls(storage, operation):
+    calls = []
+    storage._client.meta.events.register(f'before-call.s3.{operation}', lambda **kwargs: calls.append(1))
+    return calls
+
+
+class TestMetadataIndex:
+    def test_listing_uploaded_documents_is_served_from_index(self, storage):
+        document_ids = {storage.upload_file(io.BytesIO(b'content'), name) for name in ('a.txt', 'b.txt', 'c.txt')}
+        head_calls = count_calls(storage, 'HeadObject')
+
+        # The first listing validates the freshly uploaded entries, later ones hit the index only.
+        first = storage.retrieve_s3_objects()
+        assert len(head_calls) == 3
+        second = storage.retrieve_s3_objects()
+        assert len(head_calls) == 3
+        assert first == second
+        assert {document['metadata']['key'] for document in second} == document_ids
+
+    def test_category_update_is_a_single_small_write(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b'content' * 100000), 'a.txt')
+        storage.retrieve_s3_objects()
+        calls = record_calls(storage)
+
+        storage.update_document_category(document_key=document_id, category='invoice')
+        assert calls == ['PutObject']
+        assert storage.get_mutable_metadata(document_id) == {'category': 'invoice'}
+
+        calls.clear()
+        documents = storage.retrieve_s3_objects()
+        assert documents[0]['metadata']['category'] == 'invoice'
+        # The write's LastModified is read once; afterwards listings only LIST documents and mutable metadata.
+        assert 'HeadObject' not in calls
+        calls.clear()
+        assert storage.retrieve_s3_objects() == documents
+        assert calls == ['ListObjectsV2', 'ListObjectsV2']
+
+    def test_category_updates_by_other_processes_are_listed(self, storage, monkeypatch, tmp_path):
+        document_id = storage.upload_file(io.BytesIO(b'content'), 'a.txt')
+        storage.retrieve_s3_objects()
+        monkeypatch.setenv('METADATA_INDEX_PATH', str(tmp_path / 'other.sqlite3'))
+        S3FileStorage().update_document_category(document_key=document_id, category='contract')
+
+        assert storage.retrieve_s3_objects()[0]['metadata']['category'] == 'contract'
+        assert [key for key, _ in storage._index.query(category='contract')] == [f'documents/{document_id}']
+
+    def test_rebuild_includes_mutable_metadata(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b'content'), 'a.txt')
+        storage.update_document_category(document_key=document_id, category='invoice')
+        storage.rebuild_metadata_index()
+        assert storage._index.get(f'documents/{document_id}')['metadata']['category'] == 'invoice'
+
+    def test_migrate_categories_out_of_object_metadata(self, storage):
+        client = boto3.client('s3', region_name='us-east-1')
+        client.put_object(Bucket=BUCKET, Key='documents/x.txt', Body=b'x', Metadata={'category': 'report'})
+        client.put_object(Bucket=BUCKET, Key='documents/y.txt', Body=b'y', Metadata={'category': 'none'})
+        storage.update_document_category(document_key='y.txt', category='invoice')
+
+        assert storage.migrate_mutable_metadata(dry_run=True) == {'scanned': 2, 'migrated': 1}
+        assert storage.get_mutable_metadata('x.txt') == {}
+        assert storage.migrate_mutable_metadata() == {'scanned': 2, 'migrated': 1}
+        assert storage.get_mutable_metadata('x.txt') == {'category': 'report'}
+        assert storage.migrate_mutable_metadata() == {'scanned': 2, 'migrated': 0}
+
+    def test_only_mutable_fields_can_be_updated(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b'content'), 'a.txt')
+        with pytest.raises(ValueError):
+            storage.update_document_metadata(document_id, {'filesize': '1'})
+
+    def test_stale_entry_is_refetched(self, storage):
+        boto3.client('s3', region_name='us-east-1').put_object(
+            Bucket=BUCKET, Key='documents/x.txt', Body=b'x', Metadata={'category': 'contract'}
+        )
+        # An entry recorded before another process rewrote the object.
+        storage._index.upsert('documents/x.txt', {'category': 'none'}, size=1, last_modified='2020-01-01T00:00:00')
+
+        documents = storage.retrieve_s3_objects()
+        assert documents[0]['metadata'] == {'category': 'contract'}
+
+    def test_delete_removes_index_entry(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b'content'), 'a.txt')
+        assert storage.remove_file_object_by_document_id(document_id) is True
+        assert storage._index.keys() == []
+        assert storage.remove_file_object_by_document_id(document_id) is True
+
+    def test_rebuild_metadata_index(self, storage):
+        client = boto3.client('s3', region_name='us-east-1')
+        client.put_object(Bucket=BUCKET, Key='documents/x.txt', Body=b'x', Metadata={'category': 'report'})
+        client.put_object(Bucket=BUCKET, Key='documents/y.txt', Body=b'y', Metadata={'category': 'invoice'})
+
+        assert storage.rebuild_metadata_index() == 2
+        head_calls = count_calls(storage, 'HeadObject')
+        documents = storage.retrieve_s3_objects()
+        assert head_calls == []
+        assert sorted(document['metadata']['category'] for document in documents) == ['invoice', 'report']
+
+
+class TestUploads:
+    def test_upload_records_the_hash_in_object_metadata(self, storage):
+        content = b'content' * 1000
+        calls = record_calls(storage)
+        document_id = storage.upload_file(io.BytesIO(content), 'a.txt')
+        assert calls == ['PutObject']
+
+        content_sha256 = hashlib.sha256(content).hexdigest()
+        assert storage.get_content_sha256(document_id) == content_sha256
+        # Without the index entry the hash is read back with a HEAD.
+        storage._index.delete(f'documents/{document_id}')
+        assert storage.get_content_sha256(document_id) == content_sha256
+
+    def test_large_upload_is_sent_in_parts(self, monkeypatch, storage):
+        monkeypatch.setattr(storage._transfer_config, 'multipart_threshold', 5 * 1024 * 1024)
+        monkeypatch.setattr(storage._transfer_config, 'multipart_chunksize', 5 * 1024 * 1024)
+        part_calls = count_calls(storage, 'UploadPart')
+        content = os.urandom(11 * 1024 * 1024)
+
+        document_id = storage.upload_file(io.BytesIO(content), 'a.pdf')
+        assert len(part_calls) == 3
+        assert storage.get_content_sha256(document_id) == hashlib.sha256(content).hexdigest()
+        assert storage.open_document(document_id).read() == content
+
+    def test_upload_files_reports_each_file(self, storage):
+        files = [(io.BytesIO(f'content {position}'.encode()), f'{position}.txt') for position in range(5)]
+        files.append((None, 'broken.txt'))
+
+        results = storage.upload_files(files)
+        assert 'error' in results[-1]
+        document_ids = [result['document_id'] for result in results[:-1]]
+        assert sorted(document['metadata']['key'] for document in storage.retrieve_s3_objects()) == sorted(document_ids)
+
+    def test_presigned_upload(self, storage):
+        presigned_upload = storage.generate_presigned_upload('contract.pdf', size=7)
+        response = requests.post(
+            presigned_upload['url'], data=presigned_upload['fields'], files={'file': ('contract.pdf', b'content')}
+        )
+        assert response.status_code in (200, 204)
+
+        document = storage.retrieve_s3_objects()[0]
+        assert document['metadata']['key'] == presigned_upload['document_id']
+        assert storage.open_document(presigned_upload['document_id']).read() == b'content'
+
+    def test_presigned_upload_size_limit(self, storage):
+        with pytest.raises(ValueError):
+            storage.generate_presigned_upload('contract.pdf', size=10**12)
+
+
+class TestDeduplication:
+    def test_duplicates_return_the_stored_document(self, storage, monkeypatch):
+        monkeypatch.setattr(storage._config, '_upload_deduplication', True)
+        document_id = storage.upload_file(io.BytesIO(b'contract'), 'contract.pdf')
+        # Listing refreshes the entry from a HEAD response, which carries the hash in the object metadata.
+        storage.retrieve_s3_objects()
+        put_calls = count_calls(storage, 'PutObject')
+
+        assert storage.upload_file(io.BytesIO(b'contract'), 'copy.pdf') == document_id
+        assert put_calls == []
+        assert storage.upload_file(io.BytesIO(b'other'), 'other.pdf') != document_id
+        assert len(storage.retrieve_s3_objects()) == 2
+
+    def test_concurrent_duplicates_are_stored_once(self, storage, monkeypatch):
+        monkeypatch.setattr(storage._config, '_upload_deduplication', True)
+        results = storage.upload_files([(io.BytesIO(b'contract'), f'{position}.pdf') for position in range(8)])
+        assert len({result['document_id'] for result in results}) == 1
+        assert len(storage.retrieve_s3_objects()) == 1
+
+    def test_deleted_documents_are_not_reused(self, storage, monkeypatch):
+        monkeypatch.setattr(storage._config, '_upload_deduplication', True)
+        document_id = storage.upload_file(io.BytesIO(b'contract'), 'contract.pdf')
+        # Removed behind this process's back, so its index entry is stale.
+        boto3.client('s3', region_name='us-east-1').delete_object(Bucket=BUCKET, Key=f'documents/{document_id}')
+
+        assert storage.upload_file(io.BytesIO(b'contract'), 'contract.pdf') != document_id
+
+    def test_hashes_survive_an_index_rebuild(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b'contract'), 'contract.pdf')
+        storage._index.delete(f'documents/{document_id}')
+        storage.rebuild_metadata_index()
+        assert storage.find_document_by_sha256(hashlib.sha256(b'contract').hexdigest()) == document_id
+
+    def test_duplicates_are_found_from_another_process(self, storage, monkeypatch, tmp_path):
+        monkeypatch.setattr(storage._config, '_upload_deduplication', True)
+        document_id = storage.upload_file(io.BytesIO(b'contract'), 'contract.pdf')
+
+        # Another container starts with an index of its own, filled by a sync of the bucket.
+        monkeypatch.setenv('METADATA_INDEX_PATH', str(tmp_path / 'other.sqlite3'))
+        other = S3FileStorage()
+        monkeypatch.setattr(other._config, '_upload_deduplication', True)
+        other.sync_metadata_index()
+        assert other.upload_file(io.BytesIO(b'contract'), 'copy.pdf') == document_id
+        other.close()
+
+
+def put_document(key, category, upload_time, original_name):
+    boto3.client('s3', region_name='us-east-1').put_object(
+        Bucket=BUCKET,
+        Key=f'documents/{key}',
+        Body=key.encode(),
+        Metadata={'category': category, 'upload_time': upload_time, 'original_name': original_name},
+    )
+
+
+class TestQueries:
+    @pytest.fixture(autouse=True)
+    def documents(self, storage):
+        put_document('1', 'invoice', '2024-05-01T09:00:00', 'invoice-may.pdf')
+        put_document('2', 'invoice', '2024-05-07T09:00:00', 'invoice-june.pdf')
+        put_document('3', 'contract', '2024-05-03T09:00:00', 'contract.pdf')
+        put_document('4', 'invoice', '2024-04-20T09:00:00', 'receipt.pdf')
+
+    def test_filters_are_served_from_the_index(self, storage):
+        documents, _ = storage.query_documents(category='invoice', uploaded_after='2024-05-01')
+        assert [document['filename'] for document in documents] == ['1', '2']
+
+        s3_calls = count_calls(storage, '*')
+        documents, _ = storage.query_documents(name_prefix='invoice-', sort='upload_time', descending=True)
+        assert [document['metadata']['category'] for document in documents] == ['invoice', 'invoice']
+        assert [document['filename'] for document in documents] == ['2', '1']
+        documents, _ = storage.query_documents(uploaded_before='2024-05-01')
+        assert [document['filename'] for document in documents] == ['4']
+        assert s3_calls == []
+
+    def test_pages(self, storage):
+        first, cursor = storage.query_documents(sort='original_name', limit=3)
+        second, last_cursor = storage.query_documents(sort='original_name', limit=3, cursor=cursor)
+        assert [document['filename'] for document in first + second] == ['3', '2', '1', '4']
+        assert last_cursor is None
+        with pytest.raises(ValueError):
+            storage.query_documents(cursor='bogus')
+
+    def test_cold_index_is_synced_before_answering(self, storage):
+        documents, _ = storage.query_documents(category='invoice')
+        assert [document['filename'] for document in documents] == ['1', '2', '4']
+        assert storage._index_sync_thread is None
+
+        # The sync is recorded in the index, so another process sharing it does not sync again.
+        other = S3FileStorage()
+        s3_calls = count_calls(other, '*')
+        assert len(other.query_documents()[0]) == 4
+        assert s3_calls == []
+        other.close()
+
+    def test_sync_follows_the_bucket(self, storage, monkeypatch):
+        assert len(storage.query_documents()[0]) == 4
+        client = boto3.client('s3', region_name='us-east-1')
+        client.delete_object(Bucket=BUCKET, Key='documents/1')
+        put_document('5', 'report', '2024-05-08T09:00:00', 'report.pdf')
+
+        # Until the index is due for a sync, queries only see what this process changed.
+        assert len(storage.query_documents()[0]) == 4
+        monkeypatch.setattr(storage._config, '_metadata_index_max_age_seconds', 0)
+        # A due sync runs in the background; the query that started it is answered from the index as it was.
+        assert len(storage.query_documents()[0]) == 4
+        storage._index_sync_thread.join()
+        documents, _ = storage.query_documents()
+        assert [document['filename'] for document in documents] == ['2', '3', '4', '5']
+
+    def test_queries_do_not_wait_for_a_due_sync(self, storage, monkeypatch):
+        assert len(storage.query_documents()[0]) == 4
+        monkeypatch.setattr(storage._config, '_metadata_index_max_age_seconds', 0)
+        release = threading.Event()
+        monkeypatch.setattr(storage, 'sync_metadata_index', lambda: release.wait(5))
+
+        assert len(storage.query_documents()[0]) == 4
+        assert len(storage.query_documents()[0]) == 4
+        assert storage._index_sync_thread.is_alive()
+        release.set()
+        storage._index_sync_thread.join()
+
+
+class TestExtractedText:
+    def test_sidecar_round_trip_is_kept_out_of_listings(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b'content'), 'a.txt')
+        assert storage.get_extracted_text(document_id) is None
+
+        storage.put_extracted_text(document_id, 'Invoice \u20ac 10', content_sha256='abc', max_tokens=100)
+        assert storage.get_extracted_text(document_id) == {
+            'text': 'Invoice \u20ac 10',
+            'content_sha256': 'abc',
+            'max_tokens': 100,
+            'truncation': 'head',
+        }
+        assert [document['metadata']['key'] for document in storage.retrieve_s3_objects()] == [document_id]
+
+    def test_delete_removes_sidecar(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b'content'), 'a.txt')
+        storage.put_extracted_text(document_id, 'content', content_sha256='abc', max_tokens=100)
+        storage.remove_file_object_by_document_id(document_id)
+        assert storage.get_extracted_text(document_id) is None
+
+
+class TestRangedReads:
+    def test_reader_seeks_and_reads_like_a_file(self, storage):
+        content = bytes(range(256)) * 40
+        document_id = storage.upload_file(io.BytesIO(content), 'a.bin')
+        document = storage.open_document(document_id, block_size=1000)
+
+        assert document.seek(-10, io.SEEK_END) == len(content) - 10
+        assert document.read() == content[-10:]
+        document.seek(2500)
+        assert document.read(1200) == content[2500:3700]
+        # Only the first block, the 240 byte last one and the two covering 2500-3700 were fetched.
+        assert document.bytes_fetched == 1000 + 240 + 2000
+        document.seek(0)
+        assert document.read() == content
+
+    def test_text_extraction_stops_the_download(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b'word ' * 200000), 'a.txt')
+        document = storage.open_document(document_id)
+
+        processor = DocumentProcessorFactory.get_processor('txt')
+        assert next(processor.iter_text(document)).startswith('word word')
+        assert document.bytes_fetched == document.DEFAULT_BLOCK_SIZE
+        assert document.size == 1000000
+
+    def test_empty_document(self, storage):
+        document_id = storage.upload_file(io.BytesIO(b''), 'a.txt')
+        assert storage.open_document(document_id).read() == b''
+
+    def test_content_hash_is_streamed(self, storage):
+        content = b'x' * 3000000
+        boto3.client('s3', region_name='us-east-1').put_object(Bucket=BUCKET, Key='documents/a.bin', Body=content)
+        calls = record_calls(storage)
+        assert storage.compute_content_sha256('a.bin') == hashlib.sha256(content).hexdigest()
+        assert calls == ['GetObject']
+
+    def test_packed_batch_detection_reads_ranges(self, storage, monkeypatch, tmp_path):
+        monkeypatch.setenv('JOB_QUEUE_PATH', str(tmp_path / 'jobs.sqlite3'))
+        monkeypatch.setenv('SEARCH_INDEX_PATH', str(tmp_path / 'search.sqlite3'))
+        from app.services.document_service import DocumentService
+
+        class HeadClassifier:
+            document_token_budget = 100
+            truncation_strategy = 'head'
+
+            def extract_prompt_text(self, file_name, content):
+                return content.read(1000).decode('utf-8')
+
+            def detect_categories_from_texts(self, documents, max_workers):
+                return ['invoice'] * len(documents)
+
+        service = DocumentService()
+        service._classifier = HeadClassifier()
+        document_id = service.storage.upload_file(io.BytesIO(b'word ' * 200000), 'a.txt')
+        ranges = []
+        service.storage._client.meta.events.register(
+            'before-parameter-build.s3.GetObject', lambda params, **kwargs: ranges.append(params.get('Range'))
+        )
+
+        assert service.detect_and_update_categories([document_id], pack=True)['succeeded'] == 1
+        # The sidecar lookup, then the first block of the 1 MB document.
+        assert ranges == [None, 'bytes=0-65535']
+        service.jobs.stop()
+
+
+class TestPagination:
+    def test_pages_follow_continuation_tokens(self, storage):
+        for position in range(5):
+            storage.upload_file(io.BytesIO(b'content'), f'{position}.txt')
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            documents, cursor = storage.retrieve_s3_objects_page(limit=2, cursor=cursor)
+            seen.extend(document['filename'] for document in documents)
+            pages += 1
+            if not cursor:
+                break
+        assert pages == 3
+        assert len(set(seen)) == 5
+
+    def test_unlimited_listing_walks_every_page(self, storage):
+        client = boto3.client('s3', region_name='us-east-1')
+        for position in range(1005):
+            client.put_object(Bucket=BUCKET, Key=f'documents/{position}.txt', Body=b'x')
+        storage.rebuild_metadata_index()
+
+        documents, cursor = storage.retrieve_s3_objects_page()
+        assert cursor is None
+        assert sum(1 for _ in documents) == 1005
+
+
+class TestConcurrency:
+    def test_batch_operations_fan_out_and_record_latency(self, storage):
+        document_ids = [storage.upload_file(io.BytesIO(b'content'), f'{position}.txt') for position in range(8)]
+        storage.latency_stats.reset()
+
+        objects = storage._map_concurrently(storage.find_file_object_by_document_id, document_ids)
+        assert all(document['Body'].read() == b'content' for document in objects)
+        with pytest.raises(Exception):
+            storage.find_file_object_by_document_id('missing.txt')
+
+        metadata = storage.get_s3_files_metadata(f'documents/{document_id}' for document_id in document_ids)
+        assert [metadata[f'documents/{document_id}']['key'] for document_id in document_ids] == document_ids
+
+        assert all(storage.remove_file_objects_by_document_ids(document_ids).values())
+        assert storage.retrieve_s3_objects() == []
+
+        stats = storage.latency_stats.snapshot()
+        assert stats['GetObject']['count'] == 9
+        assert stats['GetObject']['errors'] == 1
+        assert stats['HeadObject']['count'] == 8
+        # One request deletes the documents, another their extracted text and mutable metadata objects.
+        assert stats['DeleteObjects']['count'] == 2
+        assert 'DeleteObject' not in stats
+
+
+class TestBatchDelete:
+    def test_keys_are_deleted_in_chunks_with_their_sidecars(self, storage, monkeypatch):
+        monkeypatch.setattr('app.storage.s3_file_storage.DELETE_OBJECTS_MAX_KEYS', 3)
+        document_ids = [storage.upload_file(io.BytesIO(b'content'), f'{position}.txt') for position in range(8)]
+        for document_id in document_ids:
+            storage.put_extracted_text(document_id, 'content', 'hash', max_tokens=10)
+            storage.update_document_category(document_key=document_id, category='invoice')
+        delete_calls = count_calls(storage, 'DeleteObjects')
+
+        assert storage.remove_file_objects_by_document_ids(document_ids + document_ids[:1] + ['missing.txt']) == {
+            **dict.fromkeys(document_ids, True),
+            'missing.txt': True,
+        }
+        # 8 documents in chunks of 3, then their 16 sidecars.
+        assert len(delete_calls) == 3 + 6
+        assert boto3.client('s3', region_name='us-east-1').list_objects_v2(Bucket=BUCKET)['KeyCount'] == 0
+        assert storage._index.query() == []
+
+    def test_failed_keys_keep_their_index_entry_and_sidecars(self, storage, monkeypatch):
+        kept, deleted = (storage.upload_file(io.BytesIO(b'content'), name) for name in ('kept.txt', 'deleted.txt'))
+        storage.update_document_category(document_key=kept, category='invoice')
+        delete_objects = storage._client.delete_objects
+
+        def delete_objects_failing_one(Bucket, Delete):
+            objects = [obj for obj in Delete['Objects'] if obj['Key'] != f'documents/{kept}']
+            response = delete_objects(Bucket=Bucket, Delete={**Delete, 'Objects': objects})
+            if len(objects) < len(Delete['Objects']):
+                error = {'Key': f'documents/{kept}', 'Code': 'AccessDenied', 'Message': 'Access Denied'}
+                response['Errors'] = response.get('Errors', []) + [error]
+            return response
+
+        monkeypatch.setattr(storage._client, 'delete_objects', delete_objects_failing_one)
+        assert storage.remove_file_objects_by_document_ids([kept, deleted]) == {kept: False, deleted: True}
+        assert [document['filename'] for document in storage.retrieve_s3_objects()] == [kept]
+        assert storage.get_mutable_metadata(kept) == {'category': 'invoice'}
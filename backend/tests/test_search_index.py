@@ -0,0 +1,47 @@
+import pytest
+
+from app.storage.search_index import SearchIndex, build_match_expression
+
+
+@pytest.fixture
+def index(tmp_path):
+    search_index = SearchIndex(str(tmp_path / 'search.sqlite3'))
+    search_index.upsert('1_invoice.pdf', 'invoice.pdf', 'Invoice 42. Total amount due within thirty days: 1,200 EUR.')
+    search_index.upsert('2_contract.docx', 'contract.docx', 'Employment contract between the parties. Résumé attached.')
+    search_index.upsert('3_notes.txt', 'notes.txt', 'Meeting notes: the invoice was paid, the contract is pending.')
+    yield search_index
+    search_index.close()
+
+
+class TestSearchIndex:
+    def test_results_are_ranked_with_snippets(self, index):
+        results = index.search('invoice')
+        # The name weighs more than the text.
+        assert [result['document_id'] for result in results] == ['1_invoice.pdf', '3_notes.txt']
+        assert results[0]['score'] > results[1]['score']
+        assert '[Invoice]' in results[0]['snippet']
+        assert results[0]['original_name'] == 'invoice.pdf'
+
+    def test_every_word_must_match_and_the_last_one_is_a_prefix(self, index):
+        assert [result['document_id'] for result in index.search('contract pend')] == ['3_notes.txt']
+        assert [result['document_id'] for result in index.search('resume')] == ['2_contract.docx']
+
+    def test_operators_are_plain_words(self, index):
+        assert build_match_expression('invoice OR "contract') == '"invoice" "OR" "contract"*'
+        assert index.search('NEAR(invoice') == []
+        with pytest.raises(ValueError):
+            index.search(' "* ')
+
+    def test_updates_and_deletes(self, index):
+        index.upsert('1_invoice.pdf', 'invoice.pdf', 'Credit note')
+        assert [result['document_id'] for result in index.search('thirty')] == []
+        assert [result['document_id'] for result in index.search('credit')] == ['1_invoice.pdf']
+
+        index.delete('3_notes.txt')
+        assert [result['document_id'] for result in index.search('contract')] == ['2_contract.docx']
+        assert not index.contains('3_notes.txt')
+        assert index.count() == 2
+
+    def test_pages(self, index):
+        assert len(index.search('the', limit=1)) == 1
+        assert index.search('the', limit=1, offset=1) != index.search('the', limit=1)
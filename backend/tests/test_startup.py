@@ -0,0 +1,24 @@
+import os
+
+from benchmarks.startup import imported_heavy_modules, measure_import_time, run_python
+
+# Generous, so slow CI machines pass; importing the app eagerly used to take well over a second.
+IMPORT_BUDGET_SECONDS = float(os.environ.get('STARTUP_IMPORT_BUDGET_SECONDS', '1.5'))
+
+
+class TestStartup:
+    def test_app_import_loads_no_heavy_modules(self):
+        assert imported_heavy_modules('wsgi') == []
+
+    def test_app_import_time_is_within_budget(self):
+        total, _ = measure_import_time('wsgi')
+        assert total < IMPORT_BUDGET_SECONDS
+
+    def test_processor_factory_imports_only_the_requested_parser(self):
+        code = (
+            'import sys\n'
+            'from app.factories.processor_factory import DocumentProcessorFactory\n'
+            'DocumentProcessorFactory.get_processor("docx")\n'
+            'print(" ".join(name for name in ("PyPDF2", "docx", "openpyxl") if name in sys.modules))'
+        )
+        assert run_python(code).stdout.split() == ['docx']
@@ -18,7 +18,10 @@ export default {
   async getDocuments() {
     try {
       const response = await axios.get(`${API_BASE_URL}/documents`)
-      console.log(response.data)
+      // A listing interrupted after it started streaming is cut short and does not parse as an array.
+      if (!Array.isArray(response.data)) {
+        throw new Error('The document listing was interrupted')
+      }
       return response.data
     } catch (error) {
       throw error